@@ -0,0 +1,314 @@
+"""Streaming nginx access log statistics in bounded memory
+
+This module has no dependencies beyond the standard library so it can be
+shipped to a host & run there against its logs, only the summary comes
+back over the wire:
+
+	python accesslog.py [--since EPOCH] [--until EPOCH] LOG [LOG ...]
+
+It also filters any log's lines (read from stdin) down to a time window:
+
+	python accesslog.py --lines [--since EPOCH] [--until EPOCH] < LOG
+
+Lines are expected in nginx's combined format, with the upstream response
+time (or request time) as the last field, eg.
+
+	log_format timed '$remote_addr - $remote_user [$time_local] "$request" '
+		'$status $body_bytes_sent "$http_referer" "$http_user_agent" '
+		'$upstream_response_time';
+
+Latencies are counted into fixed log scale buckets per endpoint, so memory
+doesn't grow with the size of the log.
+"""
+
+from __future__ import print_function
+
+import calendar
+import gzip
+import json
+import re
+import sys
+import time
+
+from array import array
+
+LINE = re.compile(
+	r'^\S+ \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<path>\S+)[^"]*" '
+	r'(?P<status>\d{3}) .*?(?P<latency>\d+\.\d+)?\s*$'
+)
+
+# Numeric & hex ids are folded together to keep the number of endpoints down
+ID_SEGMENT = re.compile(r'/(\d+|[0-9a-fA-F]{8,}|[0-9a-fA-F-]{36})(?=/|$)')
+
+MAX_ENDPOINTS = 500
+OTHER = '(other)'
+
+# Bucket upper bounds in seconds, 1ms growing by 25% a bucket up to ~2 minutes
+BUCKETS = [0.001 * 1.25 ** i for i in range(53)]
+
+def _bucket(seconds):
+	for index, bound in enumerate(BUCKETS):
+		if seconds <= bound:
+			return index
+
+	return len(BUCKETS) - 1
+
+def _timestamp(value):
+	"""epoch seconds of an nginx $time_local, eg. 10/Oct/2026:13:55:36 -0500"""
+
+	parts = value.split()
+	when = calendar.timegm(time.strptime(parts[0], '%d/%b/%Y:%H:%M:%S'))
+
+	# The time is local to the host, the offset takes it back to UTC
+	if len(parts) > 1:
+		offset = parts[1]
+
+		if len(offset) != 5 or offset[0] not in '+-' or not offset[1:].isdigit():
+			raise ValueError('Bad UTC offset "%s"' % offset)
+
+		seconds = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+		when -= seconds if offset[0] == '+' else -seconds
+
+	return when
+
+def _local_time(value, format):
+	"""epoch seconds of a time written in the host's own timezone"""
+
+	return time.mktime(time.strptime(' '.join(value.split()), format))
+
+# Where a line's time is, for the logs filtered by time: ISO 8601 at the
+# start (app logs), nginx's [$time_local] & uwsgi's request log [asctime]
+TIMES = (
+	(re.compile(r'^(\d{4}-\d\d-\d\d)[ T](\d\d:\d\d:\d\d)'),
+		lambda match: _local_time('%s %s' % match.groups(), '%Y-%m-%d %H:%M:%S')),
+	(re.compile(r'\[(\d\d/\w{3}/\d{4}:\d\d:\d\d:\d\d [+-]\d{4})\]'),
+		lambda match: _timestamp(match.group(1))),
+	(re.compile(r'\[(\w{3} \w{3} +\d+ \d\d:\d\d:\d\d \d{4})\]'),
+		lambda match: _local_time(match.group(1), '%a %b %d %H:%M:%S %Y')),
+)
+
+def _line_time(line):
+	"""epoch seconds of a log line, None if it hasn't a time"""
+
+	for pattern, parse in TIMES:
+		match = pattern.search(line)
+
+		if match is not None:
+			try:
+				return parse(match)
+			except ValueError:
+				return None
+
+	return None
+
+def window(lines, since=None, until=None):
+	"""the lines in the window, those without a time (eg. tracebacks) go with the line before"""
+
+	keep = False
+
+	for line in lines:
+		when = _line_time(line)
+
+		if when is not None:
+			keep = (since is None or when >= since) and (until is None or when < until)
+
+		if keep:
+			yield line
+
+def _endpoint(method, path):
+	return '%s %s' % (method, ID_SEGMENT.sub('/:id', path.split('?', 1)[0]))
+
+class Stats(object):
+	"""request counts, statuses & latency histograms per endpoint"""
+
+	def __init__(self):
+		self.endpoints = {}
+		self.first = None
+		self.last = None
+
+	def _columns(self, endpoint):
+		if endpoint not in self.endpoints:
+			if len(self.endpoints) >= MAX_ENDPOINTS:
+				endpoint = OTHER
+
+			if endpoint not in self.endpoints:
+				# count, 1xx-5xx status classes, latency buckets
+				self.endpoints[endpoint] = {
+					'count': array('L', [0]),
+					'status': array('L', [0] * 6),
+					'latency': array('L', [0] * len(BUCKETS)),
+				}
+
+		return self.endpoints[endpoint]
+
+	def add(self, line, since=None, until=None):
+		"""count a log line, returns False if it couldn't be parsed"""
+
+		match = LINE.match(line)
+
+		if match is None:
+			return False
+
+		try:
+			when = _timestamp(match.group('time'))
+		except ValueError:
+			return False
+
+		if (since is not None and when < since) or (until is not None and when >= until):
+			return True
+
+		self.first = when if self.first is None else min(self.first, when)
+		self.last = when if self.last is None else max(self.last, when)
+
+		columns = self._columns(_endpoint(match.group('method'), match.group('path')))
+		columns['count'][0] += 1
+		columns['status'][min(int(match.group('status')) // 100, 5)] += 1
+
+		if match.group('latency'):
+			columns['latency'][_bucket(float(match.group('latency')))] += 1
+
+		return True
+
+	def merge(self, other):
+		"""fold another set of stats (eg. from another host) into this one"""
+
+		for endpoint, other_columns in other.endpoints.items():
+			columns = self._columns(endpoint)
+
+			for name in ('count', 'status', 'latency'):
+				for index, value in enumerate(other_columns[name]):
+					columns[name][index] += value
+
+		for when in (other.first, other.last):
+			if when is not None:
+				self.first = when if self.first is None else min(self.first, when)
+				self.last = when if self.last is None else max(self.last, when)
+
+		return self
+
+	def to_dict(self):
+		return {
+			'first': self.first,
+			'last': self.last,
+			'endpoints': dict([
+				(endpoint, dict([(name, list(values)) for name, values in columns.items()]))
+				for endpoint, columns in self.endpoints.items()
+			]),
+		}
+
+	@classmethod
+	def from_dict(cls, data):
+		stats = cls()
+		stats.first = data.get('first')
+		stats.last = data.get('last')
+
+		for endpoint, columns in data.get('endpoints', {}).items():
+			stats.endpoints[endpoint] = dict([
+				(name, array('L', values)) for name, values in columns.items()
+			])
+
+		return stats
+
+	def total(self):
+		"""stats for all endpoints together"""
+
+		total = Stats()
+		total.first, total.last = self.first, self.last
+		all_columns = total._columns('(all)')
+
+		for columns in self.endpoints.values():
+			for name in ('count', 'status', 'latency'):
+				for index, value in enumerate(columns[name]):
+					all_columns[name][index] += value
+
+		return total
+
+	def summary(self, endpoint):
+		"""count, rate, error rate & latency percentiles for an endpoint"""
+
+		columns = self.endpoints[endpoint]
+		count = columns['count'][0]
+		span = max((self.last or 0) - (self.first or 0), 1)
+
+		return {
+			'count': count,
+			'rate': float(count) / span,
+			'errors': float(columns['status'][5]) / count if count else 0.0,
+			'status': dict([('%sxx' % i, columns['status'][i]) for i in range(1, 6) if columns['status'][i]]),
+			'p50': _percentile(columns['latency'], 50),
+			'p95': _percentile(columns['latency'], 95),
+			'p99': _percentile(columns['latency'], 99),
+		}
+
+def _percentile(histogram, percent):
+	"""upper bound of the bucket holding the percentile"""
+
+	total = sum(histogram)
+
+	if not total:
+		return None
+
+	rank = total * percent / 100.0
+	seen = 0
+
+	for index, count in enumerate(histogram):
+		seen += count
+
+		if seen >= rank:
+			return BUCKETS[index]
+
+	return BUCKETS[-1]
+
+def _open(path):
+	if path.endswith('.gz'):
+		return gzip.open(path, 'rt') if sys.version_info[0] > 2 else gzip.open(path)
+
+	return open(path)
+
+def collect(paths, since=None, until=None):
+	"""read logs line by line into a Stats"""
+
+	stats = Stats()
+
+	for path in paths:
+		try:
+			log = _open(path)
+		except IOError:
+			continue
+
+		try:
+			for line in log:
+				stats.add(line, since, until)
+		finally:
+			log.close()
+
+	return stats
+
+def main(argv):
+	since = until = None
+	lines = False
+	paths = []
+	args = iter(argv)
+
+	for arg in args:
+		if arg == '--since':
+			since = float(next(args))
+		elif arg == '--until':
+			until = float(next(args))
+		elif arg == '--lines':
+			lines = True
+		else:
+			paths.append(arg)
+
+	if lines:
+		# Line by line, so followed logs stream through
+		for line in window(iter(sys.stdin.readline, ''), since, until):
+			sys.stdout.write(line)
+			sys.stdout.flush()
+
+		return
+
+	print(json.dumps(collect(paths, since, until).to_dict()))
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
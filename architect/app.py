@@ -5,10 +5,110 @@ import os.path
 from fabric.api import *
 from fabric.colors import red, blue, green, yellow
 from fabric.contrib.console import confirm
-from fabric.decorators import task
 
-from architect.nginx import restart as restart_nginx
-from architect.utils import _get_venv_bin
+from architect.artifact import _build_release, _unpack
+from architect.batch import Batch
+from architect.facts import _facts, invalidates
+from architect.resources import Checkout, Copy, Directory, Key, Requirements, Symlink, User, Virtualenv, converge
+from architect.health import _wait_healthy
+from architect.nginx import _install_site
+from architect.instrument import run, runs_once, sudo, task
+from architect.preflight import _check as _preflight
+from architect.release import _activate, _cleanup, _current_release
+from architect.rollout import _rollout, _summary, _timed
+from architect.service import _install_service, _service, _unit_path, _init_system
+from architect.sync import _local_manifest, _sync
+from architect.venvs import _build as _build_venv_image, _install_image as _install_venv_image
+from architect.utils import _any_host, _boolean, _get_app_dir, _get_venv_bin, _execute_parallel
+from architect.wheels import _build_once as _build_wheels, _install as _install_wheels, _requirements
+
+def _deploy_release():
+	# Build the artifact once per run, then unpack & switch to it on this host
+	release = _build_release()
+
+	if release is None:
+		return False
+
+	_unpack(release)
+	_activate(release)
+	_cleanup()
+
+	print green('Release %s deployed.' % release)
+
+def _structure_resources():
+	# The user, home & folders the app lives in
+	return [
+		Directory(env.home),
+		User(env.project_user, env.home),
+		Directory(env.home, env.project_user, env.project_group),
+	] + [
+		Directory(os.path.join(env.home, folder), user=env.project_user)
+		for folder in ('data', 'logs', 'tmp', 'static', '.ssh')
+	] + [
+		Key(os.path.join(env.home, '.ssh', 'id_rsa'), user=env.project_user),
+	]
+
+def _venv_resources():
+	# Images are unpacked rather than created
+	if getattr(env, 'use_venv_images', False):
+		return []
+
+	# Where are we creating the virtual environment
+	return [Virtualenv(getattr(env, 'venv', env.home), user=env.project_user)]
+
+def _code_resources(repo_pull_protocol='ssh'):
+	# Synced trees & releases are shipped rather than checked out, None for an unknown protocol
+	if getattr(env, 'use_sync', False) or getattr(env, 'use_releases', False):
+		return []
+
+	# Default to HG if a protocol isn't specified, otherwise try to match protocol
+	if env.project_repo.startswith('hg://') or env.project_repo.startswith('ssh://'):
+		real_repo_path = env.project_repo.replace('hg://', '%s://' % repo_pull_protocol)
+		return [Checkout(_get_app_dir(env), real_repo_path, 'hg', user=env.project_user)]
+
+	if env.project_repo.startswith('git://'):
+		real_repo_path = env.project_repo.replace('git://', '')
+		return [Checkout(_get_app_dir(env), real_repo_path, 'git', user=env.project_user)]
+
+	return None
+
+def _requirements_resources():
+	# Wheels keep track of their own installs, images come with theirs
+	requirements = _requirements()
+
+	if requirements is None or getattr(env, 'use_wheels', False) or getattr(env, 'use_venv_images', False):
+		return []
+
+	return [Requirements(
+		os.path.join(_get_app_dir(env), requirements),
+		getattr(env, 'venv', env.home),
+		log=os.path.join(env.home, 'logs', 'pip.log'),
+		user=env.project_user
+	)]
+
+def _config_path(name):
+	# The plain config, or the one for this environment
+	if os.path.exists('etc/%s.conf' % name):
+		return os.path.join(_get_app_dir(env), 'etc/%s.conf' % name)
+
+	environment = getattr(env, 'environment', None)
+
+	if environment is not None and os.path.exists('etc/%s.%s.conf' % (name, environment)):
+		return os.path.join(_get_app_dir(env), 'etc/%s.%s.conf' % (name, environment))
+
+	return None
+
+def _config_resources():
+	# Link a hand written nginx config (otherwise it's generated) & copy in the upstart job
+	resources = []
+
+	if _config_path('nginx'):
+		resources.append(Symlink('/etc/nginx/sites-enabled/%s' % env.project_url, _config_path('nginx')))
+
+	if _config_path('upstart'):
+		resources.append(Copy('/etc/init/%s.conf' % env.project_name, _config_path('upstart')))
+
+	return resources
 
 @task
 def setup():
@@ -24,51 +124,25 @@ def setup():
 	# 2. Install code
 	# 3. Configure
 
-	# Create the home directory
-	sudo('mkdir -p %s' % env.home)
-
-	# Add the user
-	sudo('useradd -U -d %s %s' % (env.home, env.project_user))
-
-	# Get the user/group id
-	with hide('stdout'):
-		uid = run('id -u %s' % env.project_user)
-		gid = run('id -g %s' % env.project_user)
-
-	print blue('User ID is: %s' % uid)
-	print blue('Group ID is: %s' % gid)
-
-	# Change the owner of the site instance
-	sudo('chown -R %s:%s %s' % (env.project_user, env.project_group, env.home))
-
-	# Create the virtual environment
-	with cd(env.home):
-		virtual_env_args = '--clear --distribute'
-		virtual_env_build_dest = env.home
-
-		# Where are we creating the virtual environment
-		if hasattr(env, 'venv'):
-			virtual_env_build_dest = env.venv
+	# Only what the host is missing gets done, in one round trip
+	converge(_structure_resources() + _venv_resources())
 
-		sudo('virtualenv %s %s' % (virtual_env_args, virtual_env_build_dest), user=env.project_user)
-
-	# Create other needed folders
-	with cd(env.home):
-		sudo('mkdir -p data logs tmp static .ssh', user=env.project_user)
+	if getattr(env, 'use_venv_images', False) and _requirements() is not None:
+		_build_venv_image()
+		_install_venv_image()
 
-	# Create a SSH key for site
-	sudo('ssh-keygen -q -t rsa -f %s -N ""' % os.path.join(
-		env.home, '.ssh', 'id_rsa'
-	), user=env.project_user)
+	# Re-probed only if something changed
+	facts = _facts()
+	user = facts.get('user') or {}
 
-	# Get the public key
-	with hide('stdout'):
-		public_key = sudo('cat %s' % os.path.join(env.home, '.ssh', 'id_rsa.pub'))
+	print blue('User ID is: %s' % user.get('uid'))
+	print blue('Group ID is: %s' % user.get('gid'))
 
-	print blue(public_key)
+	print blue(facts.get('ssh_key'))
 	print green('Setup complete.')
 
 @task
+@invalidates
 def bootstrap(repo_pull_protocol='ssh'):
 	"""bootstrap the project"""
 
@@ -78,92 +152,66 @@ def bootstrap(repo_pull_protocol='ssh'):
 	require('project_url', provided_by=('development', 'staging', 'production'))
 	require('project_user', provided_by=('development', 'staging', 'production'))
 
-	virtual_env_bin = _get_venv_bin(env)
-	pip = os.path.join(virtual_env_bin, 'pip')
-
-	with cd(env.home):
-		# Pull the repo
+	# Pull the repo
+	code = _code_resources(repo_pull_protocol)
 
-		# Default to HG if a protocol isn't specified, otherwise try to match protocol
-		if env.project_repo.startswith('hg://') or env.project_repo.startswith('ssh://'):
-			real_repo_path = env.project_repo.replace('hg://', '%s://' % repo_pull_protocol)
-			sudo('hg clone %s %s' % (real_repo_path, env.project_name), user=env.project_user)
+	if code is None:
+		print red('Unknown repository protocol!')
+		return
 
-		elif env.project_repo.startswith('git://'):
-			real_repo_path = env.project_repo.replace('git://', '')
-			sudo('git clone %s %s' % (real_repo_path, env.project_name), user=env.project_user)
+	if getattr(env, 'use_sync', False):
+		# The whole tree to a new host, only what changed otherwise
+		if _sync() is False:
+			return
 
-		else:
-			print red('Unknown repository protocol!')
+	elif getattr(env, 'use_releases', False):
+		if _current_release() is None and _deploy_release() is False:
 			return
 
-		pip_cmd = None
+	requirements = _requirements()
 
-		# Check if we need to install any modules
-		if os.path.exists('etc/pip.conf'):
-			# Setup the pip build command
-			pip_cmd = '%s install -q -r %s --log=%s' % (
-				pip,
-				os.path.join(env.home, env.project_name, 'etc/pip.conf'),
-				os.path.join(env.home, 'logs', 'pip.log')
-			)
+	if requirements is None:
+		print yellow('No pip installation!')
 
-		if os.path.exists('requirements.txt'):
-			pip_cmd = '%s install -q -r %s --log=%s' % (
-				pip,
-				os.path.join(env.home, env.project_name, 'requirements.txt'),
-				os.path.join(env.home, 'logs', 'pip.log')
-			)
+	converge(code + _requirements_resources() + _config_resources())
 
-		if pip_cmd is not None:
-			# Install the required modules
-			sudo(pip_cmd, user=env.project_user)
+	# Without hand written configs they're generated for each host
+	if not _config_path('nginx'):
+		_install_site()
 
-		else:
-			print yellow('No pip installation!')
-
-		if os.path.exists('etc/nginx.conf'):
-			# Link the configs
-			sudo('ln -s %s /etc/nginx/sites-enabled/%s' % (
-				os.path.join(env.home, env.project_name, 'etc/nginx.conf'),
-				env.project_url
-			))
-		else:
-			# Link the configs
-			sudo('ln -s %s /etc/nginx/sites-enabled/%s' % (
-				os.path.join(env.home, env.project_name, 'etc/nginx.%s.conf' % env.environment),
-				env.project_url
-			))
-
-		if os.path.exists('etc/upstart.conf'):
-			sudo('cp %s /etc/init/%s.conf' % (
-				os.path.join(env.home, env.project_name, 'etc/upstart.conf'),
-				env.project_name
-			))
-		else:
-			if os.path.exists('etc/upstart.%s.conf' % env.environment):
-				sudo('cp %s /etc/init/%s.conf' % (
-					os.path.join(env.home, env.project_name, 'etc/upstart.%s.conf' % env.environment),
-					env.project_name
-				))
-			else:
-				print yellow('No Upstart file added!')
+	if not _config_path('upstart'):
+		_install_service()
+
+	if requirements is not None and getattr(env, 'use_venv_images', False):
+		# Switch to the image built for these requirements
+		_build_venv_image()
+		_install_venv_image()
+
+	elif requirements is not None and getattr(env, 'use_wheels', False):
+		# Install the required modules from the wheelhouse, built once
+		_build_wheels()
+		_install_wheels(requirements)
 
 	print green('Environment is setup.')
 
 @task
+@invalidates
 def remove_app():
 	"""clean the site instance - enabels site to be re-bootstrapped"""
 
 	require('home', provided_by=('development', 'staging', 'production'))
 	require('project_name', provided_by=('development', 'staging', 'production'))
 
-	if not confirm(red('Remove application "%s"?' % os.path.join(env.home, env.project_name))):
+	if not confirm(red('Remove application "%s"?' % _get_app_dir(env))):
 		print red('Aborted.')
 		return
 
 	# Remove the application
-	sudo('rm -rf %s' % os.path.join(env.home, env.project_name))
+	if getattr(env, 'use_releases', False):
+		with cd(env.home):
+			sudo('rm -rf releases current')
+	else:
+		sudo('rm -rf %s' % _get_app_dir(env))
 
 	print green('App removed.')
 
@@ -174,6 +222,33 @@ def test():
 
 	print green('Test ran.')
 
+@invalidates
+def _deploy(branch='master'):
+	"""deploy the application to this host, returns False if it couldn't"""
+
+	# Deploy the application
+	if getattr(env, 'use_sync', False):
+		if _sync() is False:
+			return False
+
+	elif getattr(env, 'use_releases', False):
+		if _deploy_release() is False:
+			return False
+
+	elif env.project_repo.startswith('hg://') or env.project_repo.startswith('ssh://'):
+		with cd(_get_app_dir(env)):
+			sudo('hg pull -u', user=env.project_user)
+
+	elif env.project_repo.startswith('git://'):
+		with cd(_get_app_dir(env)):
+			sudo('git pull origin %s' % branch, user=env.project_user)
+
+	else:
+		print red('Unknown repository protocol!')
+		return False
+
+	print green('Application Deployed.')
+
 @task(default=True)
 def deploy(branch='master'):
 	"""deploy the application"""
@@ -184,22 +259,56 @@ def deploy(branch='master'):
 	require('project_user', provided_by=('development','staging', 'production'))
 	require('project_repo', provided_by=('development', 'staging', 'production'))
 
-	# Deploy the application
-	if env.project_repo.startswith('hg://') or env.project_repo.startswith('ssh://'):
-		with cd(os.path.join(env.home, env.project_name)):
-			sudo('hg pull -u', user=env.project_user)
+	return _deploy(branch)
 
-	elif env.project_repo.startswith('git://'):
-		with cd(os.path.join(env.home, env.project_name)):
-			sudo('git pull origin %s' % branch, user=env.project_user)
+@task
+@runs_once
+def rollout(branch='master', batch='25%', pool_size=None, failures=0, graceful=False):
+	"""deploy the application to all hosts in parallel batches"""
 
-	else:
-		print red('Unknown repository protocol!')
+	if not env.all_hosts:
+		print red('No hosts to roll out to!')
 		return
 
-	print green('Application Deployed.')
+	if pool_size is not None:
+		pool_size = int(pool_size)
+
+	# Catch broken configs before touching any host
+	_preflight('deploy')
+
+	# Work out what to ship before forking so every host shares it
+	if _any_host('use_sync') and _local_manifest() is None:
+		return False
+
+	if _any_host('use_releases') and _build_release() is None:
+		return False
+
+	def deploy_and_reload(branch):
+		# Only count the host as done once it is serving the new code
+		if deploy(branch) is False:
+			return False
+
+		return reload()
+
+	if _boolean(graceful):
+		target = deploy_and_reload
+	else:
+		target = deploy
+
+	def executor(batch_hosts):
+		return _execute_parallel(_timed, batch_hosts, pool_size, target, branch)
+
+	results = _rollout(env.all_hosts, executor, batch, failures)
+	_summary(results)
+
+	if [outcome for outcome in results.values() if not outcome['ok']]:
+		print red('Rollout incomplete.')
+		return False
+
+	print green('Application Rolled Out.')
 
 @task
+@invalidates
 def redeploy(repo_pull_protocol='ssh'):
 	"""deploy the application"""
 
@@ -208,12 +317,18 @@ def redeploy(repo_pull_protocol='ssh'):
 	require('project_name', provided_by=('development','staging', 'production'))
 	require('project_user', provided_by=('development','staging', 'production'))
 
-	if not confirm(red('Remove application "%s"?' % os.path.join(env.home, env.project_name))):
+	# With releases there is nothing to remove, just ship a fresh release & switch
+	if getattr(env, 'use_releases', False):
+		if _deploy_release() is not False:
+			print green('Application Re-deployed.')
+		return
+
+	if not confirm(red('Remove application "%s"?' % _get_app_dir(env))):
 		print red('Aborted.')
 		return
 
 	# Remove the app
-	sudo('rm -rf %s' % os.path.join(env.home, env.project_name))
+	sudo('rm -rf %s' % _get_app_dir(env))
 
 	# Re pull the repo
 	with cd(env.home):
@@ -233,6 +348,7 @@ def redeploy(repo_pull_protocol='ssh'):
 	print green('Application Re-deployed.')
 
 @task
+@invalidates
 def install_mods():
 	"""install needed python modules using pip"""
 
@@ -245,23 +361,32 @@ def install_mods():
 	pip_cmd = None
 
 	with cd(env.home):
+		requirements = _requirements()
+
 		# Check if we need to install any modules
-		if os.path.exists('etc/pip.conf'):
+		if requirements is not None:
 			# Setup the pip build command
 			pip_cmd = '%s install -q -r %s --log=%s' % (
 				pip,
-				os.path.join(env.home, env.project_name, 'etc/pip.conf'),
+				os.path.join(_get_app_dir(env), requirements),
 				os.path.join(env.home, 'logs', 'pip.log')
 			)
 
-		if os.path.exists('requirements.txt'):
-			pip_cmd = '%s install -q -r %s --log=%s' % (
-				pip,
-				os.path.join(env.home, env.project_name, 'requirements.txt'),
-				os.path.join(env.home, 'logs', 'pip.log')
-			)
+	if pip_cmd is not None and getattr(env, 'use_venv_images', False):
+		# Switch to the image built for these requirements
+		_build_venv_image()
+
+		if _install_venv_image():
+			print green('Virtualenv image installed.')
+
+	elif pip_cmd is not None and getattr(env, 'use_wheels', False):
+		# Install the required modules from the wheelhouse, built once
+		_build_wheels()
+
+		if _install_wheels(requirements):
+			print green('PIP install ran.')
 
-	if pip_cmd is not None:
+	elif pip_cmd is not None:
 		# Install the required modules
 		sudo(pip_cmd, user=env.project_user)
 		print green('PIP install ran.')
@@ -286,12 +411,13 @@ def install_crontab():
 		# Install the cron file
 		sudo('crontab -u %s %s' % (
 			env.project_user,
-			os.path.join(env.home, env.project_name, 'etc/cron.txt')
+			os.path.join(_get_app_dir(env), 'etc/cron.txt')
 		))
 
 	print green('Crontab installed.')
 
 @task
+@invalidates
 def upstart_link():
 	"""load upstart script"""
 
@@ -301,31 +427,33 @@ def upstart_link():
 
 	if os.path.exists('etc/upstart.conf'):
 		sudo('cp %s /etc/init/%s.conf' % (
-			os.path.join(env.home, env.project_name, 'etc/upstart.conf'),
+			os.path.join(_get_app_dir(env), 'etc/upstart.conf'),
 			env.project_name
 		))
-	else:
-		require('environment', provided_by=('develpment', 'staging', 'production'))
-
+	elif os.path.exists('etc/upstart.%s.conf' % getattr(env, 'environment', None)):
 		sudo('cp %s /etc/init/%s.conf' % (
-			os.path.join(env.home, env.project_name, 'etc/upstart.%s.conf' % env.environment),
+			os.path.join(_get_app_dir(env), 'etc/upstart.%s.conf' % env.environment),
 			env.project_name
 		))
+	else:
+		_install_service()
 
 	print green('Upstart conf linked.')
 
 @task
+@invalidates
 def upstart_unlink():
 	"""unload upstart script"""
 
 	require('host', provided_by=('development', 'staging', 'production'))
 	require('project_name', provided_by=('develpment', 'staging', 'production'))
 
-	sudo('rm /etc/init/%s.conf' % env.project_name)
+	sudo('rm %s' % _unit_path(_init_system(_facts())))
 
 	print green('Upstart conf unlinked.')
 
 @task
+@invalidates
 def nginx_link():
 	"""load upstart script"""
 
@@ -336,21 +464,23 @@ def nginx_link():
 	if os.path.exists('etc/nginx.conf'):
 		# Link the configs
 		sudo('ln -s %s /etc/nginx/sites-enabled/%s' % (
-			os.path.join(env.home, env.project_name, 'etc/nginx.conf'),
+			os.path.join(_get_app_dir(env), 'etc/nginx.conf'),
 			env.project_url
 		))
-	else:
-		require('environment', provided_by=('develpment', 'staging', 'production'))
-
+	elif os.path.exists('etc/nginx.%s.conf' % getattr(env, 'environment', None)):
 		# Link the configs
 		sudo('ln -s %s /etc/nginx/sites-enabled/%s' % (
-			os.path.join(env.home, env.project_name, 'etc/nginx.%s.conf' % env.environment),
+			os.path.join(_get_app_dir(env), 'etc/nginx.%s.conf' % env.environment),
 			env.project_url
 		))
+	else:
+		# No hand written config, generate one for the host
+		_install_site()
 
 	print green('Nginx conf linked.')
 
 @task
+@invalidates
 def nginx_unlink():
 	"""unload upstart script"""
 
@@ -368,7 +498,7 @@ def start():
 	require('host', provided_by=('development', 'staging', 'production'))
 	require('project_name', provided_by=('develpment', 'staging', 'production'))
 
-	sudo('start %s' % env.project_name)
+	sudo(_service('start'))
 
 	print green('Project started.')
 
@@ -379,10 +509,45 @@ def restart():
 	require('host', provided_by=('development', 'staging', 'production'))
 	require('project_name', provided_by=('develpment', 'staging', 'production'))
 
-	sudo('restart %s' % env.project_name)
+	sudo(_service('restart'))
 
 	print green('Project restarted.')
 
+def _reload():
+	"""gracefully reload uwsgi on this host, returns False if it isn't healthy after"""
+
+	pidfile = getattr(env, 'uwsgi_pidfile', os.path.join(env.home, 'tmp', 'uwsgi.pid'))
+
+	if getattr(env, 'uwsgi_reload', 'chain') == 'chain':
+		# Replace workers one at a time through the master fifo (needs lazy-apps)
+		signal = 'echo c > %s' % getattr(env, 'uwsgi_fifo', os.path.join(env.home, 'tmp', 'uwsgi.fifo'))
+	else:
+		# The master reloads the whole stack, no worker answers until it's
+		# back & new requests wait in the listen queue meanwhile
+		signal = 'kill -HUP $(cat %s)' % pidfile
+
+	# The old workers keep answering until they're replaced, so note them as
+	# they're signalled & only check the health of the ones taking over
+	with hide('stdout'):
+		workers = sudo('pgrep -P "$(cat %s)"; %s' % (pidfile, signal))
+
+	workers = [pid for pid in workers.split() if pid.isdigit()]
+
+	if not _wait_healthy(timeout=getattr(env, 'health_timeout', 60), replacing=workers):
+		print red('Project unhealthy after reload!')
+		return False
+
+	print green('Project reloaded.')
+
+@task
+def reload():
+	"""reload the uwsgi workers one at a time (uwsgi_reload=graceful does all at once), waiting until healthy"""
+
+	require('host', provided_by=('development', 'staging', 'production'))
+	require('home', provided_by=('development', 'staging', 'production'))
+
+	return _reload()
+
 @task
 def stop():
 	"""stop the uwsgi application"""
@@ -390,11 +555,12 @@ def stop():
 	require('host', provided_by=('development', 'staging', 'production'))
 	require('project_name', provided_by=('develpment', 'staging', 'production'))
 
-	sudo('stop %s' % env.project_name)
+	sudo(_service('stop'))
 
 	print yellow('Project stopped.')
 
 @task
+@invalidates
 def destroy():
 	"""destroy the application"""
 
@@ -408,23 +574,27 @@ def destroy():
 		print red('Aborted.')
 		return
 
+	destroy_steps = Batch()
+
 	# Stop the application
-	stop()
+	destroy_steps.add(_service('stop'))
 
 	# Remove the application
-	sudo('rm -rf %s' % env.home)
+	destroy_steps.add('rm -rf %s' % env.home)
 
 	# Remove the user
-	sudo('userdel %s' % env.project_user)
+	destroy_steps.add('userdel %s' % env.project_user)
 
 	# Remove the nginx script
-	sudo('unlink /etc/nginx/sites-enabled/%s' % env.project_url)
+	destroy_steps.add('unlink /etc/nginx/sites-enabled/%s' % env.project_url)
+
+	# Remove the upstart job or systemd unit
+	destroy_steps.add('rm -f %s' % _unit_path(_init_system(_facts())))
 
-	# Remove the upstart script
-	upstart_unlink()
+	# Reload NGINX, leaving other sites' requests alone
+	destroy_steps.add('/etc/init.d/nginx configtest && /etc/init.d/nginx reload')
 
-	# Restart NGINX
-	restart_nginx()
+	destroy_steps.run()
 
 	print red('Application Destroyed.')
 
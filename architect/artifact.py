@@ -0,0 +1,192 @@
+"""Build release artifacts once & ship them to every host"""
+
+import glob
+import hashlib
+import json
+import os.path
+import tarfile
+import time
+
+from cStringIO import StringIO
+
+from fabric.api import *
+from fabric.colors import red, cyan, green, yellow
+
+from architect.instrument import put, run, runs_once, sudo, task
+from architect.utils import _execute_parallel, _local_path
+
+MANIFEST_NAME = '.architect-manifest.json'
+
+def _vcs():
+	"""find which VCS the local working copy uses"""
+
+	if os.path.isdir('.git'):
+		return 'git'
+
+	if os.path.isdir('.hg'):
+		return 'hg'
+
+	return None
+
+def _revision(vcs):
+	"""get the revision of the local working copy"""
+
+	if vcs == 'git':
+		return local('git rev-parse --short HEAD', capture=True).strip()
+
+	return local('hg id -i', capture=True).strip().rstrip('+')
+
+def _tracked_files(vcs):
+	"""list the files under version control in the local working copy"""
+
+	if vcs == 'git':
+		files = local('git ls-files -z', capture=True)
+	else:
+		files = local('hg locate -0', capture=True)
+
+	# Skip anything deleted but not yet committed
+	return sorted([f for f in files.split('\0') if f and os.path.lexists(f)])
+
+def _digest(path):
+	"""sha1 of a file's contents (or a symlink's target)"""
+
+	sha = hashlib.sha1()
+
+	if os.path.islink(path):
+		sha.update(os.readlink(path))
+		return sha.hexdigest()
+
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(65536), ''):
+			sha.update(chunk)
+
+	return sha.hexdigest()
+
+def _manifest(paths):
+	"""map each path to the digest of its contents"""
+	return dict([(path, _digest(path)) for path in paths])
+
+def _artifact_path(release):
+	return _local_path('releases', '%s.tar.gz' % release)
+
+def _latest_release():
+	"""find the most recently built release id"""
+
+	artifacts = sorted(glob.glob(_artifact_path('*')))
+
+	if not artifacts:
+		return None
+
+	return os.path.basename(artifacts[-1])[:-len('.tar.gz')]
+
+def _build(release, files, revision):
+	"""write the tarball & manifest for a release, returns the manifest"""
+
+	manifest = {
+		'release': release,
+		'revision': revision,
+		'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+		'files': _manifest(files),
+	}
+
+	manifest_data = json.dumps(manifest, indent=1, sort_keys=True, separators=(',', ': '))
+
+	archive = tarfile.open(_artifact_path(release), 'w:gz')
+
+	try:
+		for path in files:
+			archive.add(path, recursive=False)
+
+		# Ship the manifest inside the release too
+		info = tarfile.TarInfo(MANIFEST_NAME)
+		info.size = len(manifest_data)
+		info.mtime = time.time()
+		archive.addfile(info, StringIO(manifest_data))
+	finally:
+		archive.close()
+
+	with open(_local_path('releases', '%s.manifest.json' % release), 'w') as f:
+		f.write(manifest_data)
+
+	return manifest
+
+def _unpack(release):
+	"""upload & unpack a release artifact into env.home/releases on this host"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+
+	release_dir = os.path.join(env.home, 'releases', release)
+
+	with settings(hide('everything'), warn_only=True):
+		if sudo('test -f %s' % os.path.join(release_dir, MANIFEST_NAME)).succeeded:
+			print yellow('Release %s already on host.' % release)
+			return
+
+	remote_artifact = '/tmp/%s.tar.gz' % release
+
+	put(_artifact_path(release), remote_artifact, mode=0644)
+
+	sudo('mkdir -p %s' % release_dir, user=env.project_user)
+	sudo('tar xzf %s -C %s' % (remote_artifact, release_dir), user=env.project_user)
+	run('rm -f %s' % remote_artifact)
+
+@runs_once
+def _build_release():
+	"""build a release artifact once per run, returns the release"""
+
+	vcs = _vcs()
+
+	if vcs is None:
+		print red('No git or hg working copy found!')
+		return
+
+	revision = _revision(vcs)
+	release = '%s-%s' % (time.strftime('%Y%m%d%H%M%S', time.gmtime()), revision)
+	files = _tracked_files(vcs)
+
+	manifest = _build(release, files, revision)
+
+	print cyan('%s files, %s bytes' % (
+		len(manifest['files']), os.path.getsize(_artifact_path(release))
+	))
+	print green('Release %s built.' % release)
+
+	# Let ship pick up the release we just built
+	env.release = release
+
+	return release
+
+@task
+@runs_once
+def build():
+	"""build a release artifact from the local working copy"""
+
+	return _build_release()
+
+@task
+@runs_once
+def ship(release=None):
+	"""ship a release artifact to all hosts"""
+
+	release = release or getattr(env, 'release', None) or _latest_release()
+
+	if release is None or not os.path.exists(_artifact_path(release)):
+		print red('No release artifact to ship, run artifact.build first!')
+		return
+
+	_execute_parallel(_unpack, env.all_hosts, None, release)
+
+	print green('Release %s shipped.' % release)
+
+	return release
+
+@task(default=True)
+@runs_once
+def deploy():
+	"""build a release artifact once & ship it to all hosts"""
+
+	release = _build_release()
+
+	if release is not None:
+		return ship(release)
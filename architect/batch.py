@@ -0,0 +1,121 @@
+"""Run a batch of commands on a host as one remote script
+
+Each sudo()/run() costs a round trip (and a sudo setup) to the host, a
+Batch queues commands up & sends them as a single script, then splits the
+output back into a result per command.
+"""
+
+import pipes
+
+from fabric.api import *
+from fabric.colors import red
+from fabric.operations import _AttributeString
+from fabric.state import output
+
+from architect.instrument import run, sudo
+
+MARKER = '__architect_step__'
+
+# Seconds between keepalives, so the cached connection stays warm between tasks
+KEEPALIVE = 30
+
+class Batch(object):
+	"""a queue of commands to run on the current host in one go"""
+
+	def __init__(self, user=None, use_sudo=True, stop_on_error=True):
+		self.user = user
+		self.use_sudo = use_sudo
+		self.stop_on_error = stop_on_error
+		self.steps = []
+
+	def __len__(self):
+		return len(self.steps)
+
+	def add(self, command, user=None, warn_only=False):
+		"""queue a command, returns its index in the results"""
+
+		if user is not None and user != self.user and not (self.use_sudo and self.user is None):
+			raise ValueError('Steps can only switch user in a batch run as root')
+
+		self.steps.append({
+			'command': command,
+			'user': user if user != self.user else None,
+			'warn_only': warn_only,
+		})
+
+		return len(self.steps) - 1
+
+	def _script(self, steps):
+		"""the shell script for the queued commands"""
+
+		lines = []
+
+		for index, step in enumerate(steps):
+			command = step['command']
+
+			if step['user'] is not None:
+				command = 'sudo -H -u %s /bin/sh -c %s' % (step['user'], pipes.quote(command))
+
+			# Each step reports its own exit status after its output
+			lines.append('( %s ) 2>&1; rc=$?; echo; echo "%s %s $rc"' % (command, MARKER, index))
+
+			if self.stop_on_error and not step['warn_only']:
+				lines.append('[ $rc -eq 0 ] || exit $rc')
+
+		return '\n'.join(lines)
+
+	def _parse(self, output, steps):
+		"""split the script output into a result per step"""
+
+		results = []
+		lines = []
+
+		for line in output.splitlines():
+			if line.startswith(MARKER):
+				index, return_code = line[len(MARKER):].split()
+
+				result = _AttributeString('\n'.join(lines).strip())
+				result.command = steps[int(index)]['command']
+				result.return_code = int(return_code)
+				result.succeeded = result.return_code == 0
+				result.failed = not result.succeeded
+
+				results.append(result)
+				lines = []
+			else:
+				lines.append(line)
+
+		return results
+
+	def run(self):
+		"""run the queued commands, returns a result for each one that ran"""
+
+		steps, self.steps = self.steps, []
+
+		if not steps:
+			return []
+
+		operation = sudo if self.use_sudo else run
+		kwargs = {'user': self.user} if self.use_sudo and self.user else {}
+
+		with settings(hide('stdout', 'running'), warn_only=True, keepalive=env.keepalive or KEEPALIVE):
+			script_output = operation(self._script(steps), **kwargs)
+
+		results = self._parse(script_output, steps)
+
+		for result in results:
+			if output.running:
+				print '[%s] batch: %s' % (env.host_string, result.command)
+
+			if output.stdout and result:
+				print result
+
+		# Stop like sudo()/run() would when a step fails
+		for result, step in zip(results, steps):
+			if result.failed and not step['warn_only'] and not env.warn_only:
+				abort(red('Batch step failed with %s: %s' % (result.return_code, result.command)))
+
+		if len(results) < len(steps) and script_output.failed and not env.warn_only:
+			abort(red('Batch failed after %s of %s steps:\n%s' % (len(results), len(steps), script_output)))
+
+		return results
@@ -0,0 +1,219 @@
+"""Benchmark deploy workflows against simulated hosts
+
+Remote operations are swapped for a simulated executor that sleeps for a
+configurable latency per round trip, so workflows can be timed against any
+number of stand-in hosts without touching a real server.
+"""
+
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+from contextlib import contextmanager
+
+from fabric import operations
+from fabric.api import *
+from fabric.colors import red, cyan, green, yellow
+from fabric.decorators import task, runs_once
+from fabric.operations import _AttributeString
+
+from architect.batch import MARKER
+from architect.instrument import _entries
+from architect.rollout import _timed
+from architect.utils import _boolean, _execute_parallel, _local_path, _percentile
+
+# app tasks, looked up as they're run: holding the app module here would
+# have fabric list its tasks under bench
+WORKFLOWS = ('setup', 'bootstrap', 'deploy', 'redeploy', 'install_mods')
+
+# Enough env for the workflows to run against a stand-in host
+BENCH_ENV = {
+	'home': '/srv/bench',
+	'project_name': 'bench',
+	'project_user': 'bench',
+	'project_group': 'bench',
+	'project_repo': 'git://example.com/bench.git',
+	'project_url': 'bench.example.com',
+	'environment': 'bench',
+}
+
+def _simulated(latency):
+	"""a stand-in for run/sudo that waits latency seconds & succeeds"""
+
+	def operation(command, *args, **kwargs):
+		time.sleep(latency)
+
+		# Batched scripts report a status for each of their steps
+		steps = re.findall(r'"%s (\d+) \$rc"' % MARKER, command)
+		result = _AttributeString('\n'.join(['%s %s 0' % (MARKER, step) for step in steps]))
+		result.return_code = 0
+		result.succeeded = True
+		result.failed = False
+
+		return result
+
+	return operation
+
+def _simulated_transfer(latency):
+	def transfer(*args, **kwargs):
+		time.sleep(latency)
+
+		result = _AttributeString('')
+		result.failed = []
+		result.succeeded = True
+
+		return result
+
+	return transfer
+
+@contextmanager
+def _simulate(latency):
+	"""swap the remote operations for simulated ones"""
+
+	import architect.app
+
+	saved = (operations.run, operations.sudo, operations.put, operations.get, architect.app.confirm)
+
+	operations.run = operations.sudo = _simulated(latency)
+	operations.put = operations.get = _simulated_transfer(latency)
+	architect.app.confirm = lambda *args, **kwargs: True
+
+	try:
+		yield
+	finally:
+		operations.run, operations.sudo, operations.put, operations.get, architect.app.confirm = saved
+
+def _bench_host(workflow):
+	"""run a workflow on the current stand-in host, counting its commands"""
+
+	import architect.app
+
+	recorded = len(_entries)
+	outcome = _timed(getattr(architect.app, workflow))
+	outcome['commands'] = len([
+		entry for entry in _entries[recorded:] if entry['kind'] != 'task'
+	])
+
+	return outcome
+
+def _bench(workflow, hosts, parallel, pool_size):
+	"""run a workflow across the stand-in hosts, returns the outcomes & wall time"""
+
+	started = time.time()
+	stdout = sys.stdout
+
+	# Keep the workflows' own output out of the way of the results
+	with settings(hide('everything'), **BENCH_ENV):
+		sys.stdout = open(os.devnull, 'w')
+
+		try:
+			if parallel:
+				outcomes = _execute_parallel(_bench_host, hosts, pool_size, workflow)
+			else:
+				outcomes = {}
+
+				for host in hosts:
+					with settings(host_string=host, host=host):
+						outcomes[host] = _bench_host(workflow)
+		finally:
+			sys.stdout.close()
+			sys.stdout = stdout
+
+	return outcomes, time.time() - started
+
+def _results_path(workflow, stamp='*'):
+	return _local_path('bench', '%s-%s.json' % (workflow, stamp))
+
+@task(default=True)
+@runs_once
+def workflow(name='deploy', count=10, latency=0.05, runs=1, parallel=False, pool_size=None):
+	"""benchmark a workflow against count simulated hosts"""
+
+	if name not in WORKFLOWS:
+		print red('Unknown workflow "%s", pick from %s.' % (name, ', '.join(sorted(WORKFLOWS))))
+		return
+
+	# count rather than hosts, fabric keeps hosts= for itself
+	hosts = ['bench-%03d' % i for i in range(int(count))]
+	latency = float(latency)
+	parallel = _boolean(parallel)
+	pool_size = int(pool_size) if pool_size else None
+
+	seconds = []
+	commands = []
+	failed = 0
+	wall = 0.0
+
+	with _simulate(latency):
+		for i in range(int(runs)):
+			outcomes, elapsed = _bench(name, hosts, parallel, pool_size)
+			wall += elapsed
+
+			for outcome in outcomes.values():
+				seconds.append(outcome['seconds'])
+				commands.append(outcome['commands'])
+
+				if not outcome['ok']:
+					failed += 1
+
+	results = {
+		'workflow': name,
+		'hosts': len(hosts),
+		'runs': int(runs),
+		'latency': latency,
+		'parallel': parallel,
+		'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+		'wall_seconds': round(wall, 4),
+		'throughput': round(len(seconds) / wall, 4) if wall else None,
+		'p50': _percentile(seconds, 50),
+		'p95': _percentile(seconds, 95),
+		'commands_per_host': max(commands) if commands else 0,
+		'failed': failed,
+	}
+
+	# Down to the microsecond, so runs in the same second don't overwrite each other
+	now = time.time()
+	stamp = '%s%06d' % (time.strftime('%Y%m%d%H%M%S', time.gmtime(now)), int(now % 1 * 1000000))
+
+	with open(_results_path(name, stamp), 'w') as f:
+		json.dump(results, f, indent=1, sort_keys=True, separators=(',', ': '))
+
+	print cyan('%s x %s hosts (%s latency, %s)' % (
+		name, len(hosts), latency, 'parallel' if parallel else 'serial'
+	))
+	print cyan('  throughput %.2f hosts/s, p50 %.3fs, p95 %.3fs, %s commands per host' % (
+		results['throughput'] or 0, results['p50'] or 0, results['p95'] or 0, results['commands_per_host']
+	))
+
+	if failed:
+		print red('  %s host runs failed.' % failed)
+
+	return results
+
+@task
+@runs_once
+def compare(name='deploy'):
+	"""compare the last two benchmark results for a workflow"""
+
+	paths = sorted(glob.glob(_results_path(name)))
+
+	if len(paths) < 2:
+		print yellow('Need two results for "%s" to compare.' % name)
+		return
+
+	before, after = [json.load(open(path)) for path in paths[-2:]]
+
+	for key in ('throughput', 'p50', 'p95', 'commands_per_host'):
+		if not before[key] or after[key] is None:
+			continue
+
+		change = (after[key] - before[key]) * 100.0 / before[key]
+
+		# Higher throughput is better, everything else is better lower
+		better = change > 0 if key == 'throughput' else change < 0
+		colour = green if better else red if change else cyan
+
+		print colour('%-18s %10.4g -> %-10.4g %+.1f%%' % (key, before[key], after[key], change))
@@ -0,0 +1,271 @@
+"""Deploy to a few canary hosts first & only carry on if they hold up
+
+The canaries (env.canary_hosts, 1 by default, or eg. 10%) are deployed
+& reloaded, then sampled for env.canary_window seconds alongside the
+untouched hosts: the health url is requested from each host & its
+access log summarised for the same window. If the canaries' p95 is more
+than env.canary_threshold times the untouched hosts' (or their error
+rate is more than env.canary_errors above it) they're rolled back to the
+release or revision they were on, otherwise the rollout carries on to
+the rest. With no hosts left untouched the canaries are compared with
+themselves, sampled before the deploy.
+"""
+
+import time
+
+from fabric.api import *
+from fabric.colors import red, cyan, green, yellow
+
+from architect import accesslog
+from architect.app import _deploy, _reload
+from architect.artifact import _build_release
+from architect.facts import _invalidate
+from architect.health import _curl, _health_url
+from architect.instrument import run, runs_once, sudo, task
+from architect.logs import _access_log, _collect, _ms
+from architect.preflight import _check as _preflight
+from architect.release import _activate, _current_release
+from architect.rollout import _host_count, _rollout, _summary, _timed
+from architect.utils import _any_host, _execute_parallel, _get_app_dir, _percentile
+
+CANARY_HOSTS = 1
+
+# Seconds to sample the canaries & untouched hosts for
+WINDOW = 60
+
+# Seconds between health requests while sampling
+INTERVAL = 1
+
+# Latencies are bucketed 1.25x apart, so a smaller ratio is one bucket of noise
+THRESHOLD = 1.5
+
+# Differences in p95 smaller than this are noise however big the ratio
+SLACK = 0.01
+
+# How much higher the canaries' error rate can be
+ERRORS = 0.01
+
+def _revision():
+	"""the release or revision the host is on, to roll back to"""
+
+	if getattr(env, 'use_releases', False):
+		return _current_release()
+
+	with cd(_get_app_dir(env)):
+		with settings(hide('everything'), warn_only=True):
+			revision = sudo("git rev-parse HEAD 2>/dev/null || hg log -r . --template '{node}'", user=env.project_user)
+
+	return revision.strip() if revision.succeeded and revision.strip() else None
+
+def _revert(previous):
+	"""put the host back on the release or revision it was on & reload"""
+
+	revision = previous[env.host_string]
+
+	if getattr(env, 'use_releases', False):
+		_activate(revision)
+	else:
+		with cd(_get_app_dir(env)):
+			sudo('if [ -d .git ]; then git reset -q --hard %s; else hg update -q -C -r %s; fi' % (
+				revision, revision
+			), user=env.project_user)
+
+	_invalidate()
+
+	return _reload()
+
+def _deploy_and_reload(branch):
+	# Only sample the host once it is serving the new code
+	if _deploy(branch) is False:
+		return False
+
+	return _reload()
+
+def _sample(window, interval):
+	"""request the health url through the window & summarise the access log for it"""
+
+	started = time.time()
+
+	with settings(hide('everything'), warn_only=True):
+		output = run('for i in $(seq %s); do %s; echo; sleep %s; done' % (
+			max(1, int(window / interval)), _curl(_health_url(), interval * 5), interval
+		))
+
+	health = []
+
+	for line in output.splitlines():
+		try:
+			status, seconds = line.split()
+			health.append((200 <= int(status) < 300, float(seconds)))
+		except ValueError:
+			continue
+
+	try:
+		with settings(warn_only=True):
+			log = _collect(_access_log(), started, None)
+	except ValueError:
+		log = None
+
+	return {'health': health, 'log': log}
+
+def _measure(samples):
+	"""p95 & error rate of the health requests & access logs of a group of hosts"""
+
+	health = []
+	stats = accesslog.Stats()
+
+	for sample in samples:
+		# A host that couldn't be sampled counts as one failed request
+		if not isinstance(sample, dict):
+			health.append((False, None))
+			continue
+
+		health.extend(sample['health'])
+
+		if sample['log']:
+			stats.merge(accesslog.Stats.from_dict(sample['log']))
+
+	measures = {}
+
+	if health:
+		measures['health'] = {
+			'count': len(health),
+			'p95': _percentile([seconds for ok, seconds in health if ok], 95),
+			'errors': float(len([ok for ok, seconds in health if not ok])) / len(health),
+		}
+
+	if stats.endpoints:
+		measures['access log'] = stats.total().summary('(all)')
+
+	return measures
+
+def _verdict(canary, baseline, threshold, errors):
+	"""print the comparison, returns the reasons the canaries failed"""
+
+	reasons = []
+
+	# The untouched hosts then the canaries for each measure
+	print cyan('%-12s %19s %19s' % ('Source', 'p95', 'Errors'))
+
+	for source in ('health', 'access log'):
+		if source not in canary or source not in baseline:
+			print yellow('%-12s no requests to compare' % source)
+			continue
+
+		was, now = baseline[source], canary[source]
+		failed = []
+
+		if was['p95'] and now['p95'] and now['p95'] > max(was['p95'] * threshold, was['p95'] + SLACK):
+			failed.append('%s p95 %s vs %s' % (source, _ms(now['p95']), _ms(was['p95'])))
+
+		# Every canary request failing leaves no latency to compare
+		if now['p95'] is None and was['p95'] is not None:
+			failed.append('%s got no successful requests' % source)
+
+		if now['errors'] > was['errors'] + errors:
+			failed.append('%s errors %.1f%% vs %.1f%%' % (source, now['errors'] * 100, was['errors'] * 100))
+
+		line = '%-12s %9s %9s %8.1f%% %8.1f%%' % (
+			source, _ms(was['p95']), _ms(now['p95']), was['errors'] * 100, now['errors'] * 100
+		)
+
+		print red(line) if failed else line
+
+		reasons.extend(failed)
+
+	return reasons
+
+@task(default=True)
+@runs_once
+def deploy(branch='master', canaries=None, window=None, threshold=None, errors=None,
+		batch='25%', pool_size=None, failures=0):
+	"""deploy to canary hosts, compare them with the rest, then carry on or roll back"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_name', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+	require('project_repo', provided_by=('development', 'staging', 'production'))
+
+	if not env.all_hosts:
+		print red('No hosts to deploy to!')
+		return False
+
+	if _any_host('use_sync'):
+		abort('Canary deploys need releases or a checkout to roll back to, not env.use_sync.')
+
+	if pool_size is not None:
+		pool_size = int(pool_size)
+
+	window = float(window or getattr(env, 'canary_window', WINDOW))
+	interval = float(getattr(env, 'canary_interval', INTERVAL))
+	threshold = float(threshold or getattr(env, 'canary_threshold', THRESHOLD))
+	errors = float(errors if errors is not None else getattr(env, 'canary_errors', ERRORS))
+
+	count = _host_count(canaries or getattr(env, 'canary_hosts', CANARY_HOSTS), len(env.all_hosts))
+	count = max(1, min(count, len(env.all_hosts)))
+	canary_hosts, rest = env.all_hosts[:count], env.all_hosts[count:]
+
+	# Catch broken configs before touching any host
+	_preflight('deploy')
+
+	if _any_host('use_releases') and _build_release() is None:
+		return False
+
+	previous = _execute_parallel(_revision, canary_hosts, pool_size)
+	unknown = [host for host, revision in previous.items() if not isinstance(revision, basestring)]
+
+	if unknown:
+		abort('Nothing to roll back to on %s.' % ', '.join(sorted(unknown)))
+
+	if not rest:
+		print yellow('No hosts left untouched, sampling the canaries before the deploy.')
+		baseline = _execute_parallel(_sample, canary_hosts, pool_size, window, interval)
+
+	print cyan('Canaries: %s' % ', '.join(canary_hosts))
+
+	results = _execute_parallel(_timed, canary_hosts, pool_size, _deploy_and_reload, branch)
+	reasons = [
+		'%s failed to deploy' % host for host, outcome in sorted(results.items())
+		if not isinstance(outcome, dict) or not outcome['ok']
+	]
+
+	if not reasons:
+		print cyan('Sampling for %ss.' % window)
+
+		samples = _execute_parallel(_sample, env.all_hosts, pool_size, window, interval)
+
+		if rest:
+			baseline = dict([(host, samples[host]) for host in rest])
+
+		canary = _measure([samples[host] for host in canary_hosts])
+		reasons = _verdict(canary, _measure(baseline.values()), threshold, errors)
+
+	if reasons:
+		print red('Canary failed: %s' % '; '.join(reasons))
+
+		reverted = _execute_parallel(_timed, canary_hosts, pool_size, _revert, previous)
+		_summary(reverted)
+
+		if [outcome for outcome in reverted.values() if not outcome['ok']]:
+			print red('Rollback incomplete!')
+		else:
+			print yellow('Canaries rolled back.')
+
+		return False
+
+	print green('Canaries healthy.')
+
+	if not rest:
+		return
+
+	def executor(batch_hosts):
+		return _execute_parallel(_timed, batch_hosts, pool_size, _deploy_and_reload, branch)
+
+	results = _rollout(rest, executor, batch, failures)
+	_summary(results)
+
+	if [outcome for outcome in results.values() if not outcome['ok']]:
+		print red('Rollout incomplete.')
+		return False
+
+	print green('Application Rolled Out.')
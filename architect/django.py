@@ -1,37 +1,143 @@
 """Management commands for dealing with django applications"""
 
 import os.path
+import time
 
 from fabric.api import *
-from fabric.colors import green
-from fabric.decorators import task
+from fabric.colors import red, cyan, green
 
-from architect.utils import _get_venv_bin
+from architect.instrument import run, sudo, task
+from architect.utils import _execute_parallel, _get_app_dir, _get_venv_bin
+
+# Commands that change shared state (the database, shared static files) &
+# so should only run on one host, anything else runs on each host in turn
+MODES = {
+	'migrate': 'once',
+	'syncdb': 'once',
+	'collectstatic': 'once',
+	'createcachetable': 'once',
+	'check': 'fanout',
+}
+
+# Seconds a once command waits for another run of it to finish
+LOCK_TIMEOUT = 600
+
+# Commands already run on all hosts this session
+_ran = set()
+
+def _manage_command(cmd, args, kwargs):
+	virtual_env_bin = _get_venv_bin(env)
+	py = os.path.join(virtual_env_bin, 'python')
+
+	manage_cmd = '%s %s %s' % (
+		py,
+		os.path.join(_get_app_dir(env), 'manage.py'),
+		cmd
+	)
+
+	if args:
+		manage_cmd += ' %s' % ' '.join(args)
+
+	if kwargs:
+		manage_cmd += ' %s' % ' '.join(['--%s=%s' % (k, v) for k, v in kwargs.items()])
+
+	return manage_cmd
+
+def _run_manage(cmd, args, kwargs, lock=None):
+	"""run a management command on this host, capturing its output & timing"""
+
+	started = time.time()
+
+	# Built here, each host has its own app dir & virtualenv
+	manage_cmd = _manage_command(cmd, args, kwargs)
+
+	# Hold a lock on the host so two runs of a once command never overlap
+	if lock is not None:
+		manage_cmd = 'flock -w %s %s %s' % (
+			getattr(env, 'manage_lock_timeout', LOCK_TIMEOUT),
+			os.path.join(env.home, 'tmp', '%s.lock' % lock),
+			manage_cmd
+		)
+
+	with cd(env.home):
+		with settings(hide('stdout', 'running'), warn_only=True):
+			result = sudo(manage_cmd, user=env.project_user)
+
+	return {
+		'ok': result.succeeded,
+		'seconds': time.time() - started,
+		'output': str(result),
+	}
+
+def _print_outcomes(outcomes):
+	"""print each distinct output once with the hosts that gave it"""
+
+	groups = {}
+
+	for host, outcome in sorted(outcomes.items()):
+		groups.setdefault((outcome['ok'], outcome['output']), []).append(host)
+
+	for (ok, output), hosts in sorted(groups.items()):
+		seconds = max([outcomes[host]['seconds'] for host in hosts])
+		colour = green if ok else red
+
+		print colour('[%s] %s in %.1fs' % (', '.join(hosts), 'ran' if ok else 'failed', seconds))
+
+		if output.strip():
+			print cyan(output)
 
 @task
 def manage(cmd, *args, **kwargs):
-	"""run a management command"""
+	"""run a management command, mode=each|fanout|once picks where"""
 
 	require('home', provided_by=('development', 'staging', 'production'))
 	require('project_name', provided_by=('development', 'staging', 'production'))
 	require('project_user', provided_by=('development', 'staging', 'production'))
 
-	virtual_env_bin = _get_venv_bin(env)
-	py = os.path.join(virtual_env_bin, 'python')
+	mode = kwargs.pop('mode', None) or MODES.get(cmd, 'each')
 
-	with cd(env.home):
-		manage_cmd = '%s %s %s' % (
-			py,
-			os.path.join(env.home, env.project_name, 'manage.py'),
-			cmd
-		)
+	if mode not in ('each', 'fanout', 'once'):
+		abort('Unknown mode "%s", use each, fanout or once.' % mode)
+
+	if mode == 'each':
+		with cd(env.home):
+			sudo(_manage_command(cmd, args, kwargs), user=env.project_user)
+
+		print green('Manage command ran.')
+		return
+
+	hosts = env.all_hosts or [env.host_string]
+
+	# Every run elects the same host, so its lock covers concurrent runs too
+	elected = sorted(hosts)[0]
+	lock = 'manage-%s' % cmd if mode == 'once' else None
+
+	if env.parallel:
+		# Already running on each host at once (fab -P), just do this one
+		if mode == 'once' and env.host_string != elected:
+			return
+
+		outcomes = {env.host_string: _run_manage(cmd, args, kwargs, lock)}
+
+	else:
+		# The first host handles every host, the rest have nothing left to do
+		ran = (cmd, args, tuple(sorted(kwargs.items())))
+
+		if ran in _ran:
+			return
+
+		_ran.add(ran)
+
+		outcomes = _execute_parallel(_run_manage, hosts if mode == 'fanout' else [elected], None, cmd, args, kwargs, lock)
 
-		if args:
-			manage_cmd += ' %s' % ' '.join(args)
+	# A host that couldn't be reached comes back as its exception
+	for host, outcome in outcomes.items():
+		if not isinstance(outcome, dict):
+			outcomes[host] = {'ok': False, 'seconds': 0.0, 'output': str(outcome)}
 
-		if kwargs:
-			manage_cmd += ' %s' % ' '.join(['--%s=%s' % (k, v) for k, v in kwargs.items()])
+	_print_outcomes(outcomes)
 
-		sudo(manage_cmd, user=env.project_user)
+	if [outcome for outcome in outcomes.values() if not outcome['ok']]:
+		abort('Manage command failed.')
 
 	print green('Manage command ran.')
@@ -0,0 +1,177 @@
+"""Facts about a host, gathered in one batched probe & cached locally
+
+Facts are kept in .architect/facts/<host>.json for env.facts_ttl seconds
+(an hour by default). Tasks that change a host are wrapped with
+@invalidates so the next look at the host probes it again.
+"""
+
+import json
+import os
+import os.path
+import time
+
+from functools import wraps
+
+from fabric.api import *
+from fabric.colors import cyan, green
+
+from architect.artifact import MANIFEST_NAME
+from architect.batch import Batch
+from architect.instrument import runs_once, task
+from architect.utils import _boolean, _get_app_dir, _get_venv_bin, _local_path
+
+FACTS_TTL = 3600
+
+def _facts_path(host=None):
+	return _local_path('facts', '%s.json' % (host or env.host_string).replace(':', '_').replace('@', '_'))
+
+def _probes():
+	"""the commands to gather facts with, keyed by fact"""
+
+	app_dir = _get_app_dir(env) if getattr(env, 'project_name', None) or getattr(env, 'use_releases', False) else None
+	probes = {
+		'os': '. /etc/os-release && echo "$ID $VERSION_ID"',
+		'kernel': 'uname -r',
+		'cpus': 'nproc',
+		'memory': "awk '/^MemTotal:/ { print $2 }' /proc/meminfo",
+		'somaxconn': 'cat /proc/sys/net/core/somaxconn',
+		'init': 'ps -p 1 -o comm=',
+		'packages': "dpkg-query -W -f '${Package} ${Version} ${Status}\\n' | awk '$NF == \"installed\" { print $1, $2 }'",
+		'nginx_sites': 'ls -1 /etc/nginx/sites-enabled',
+		'upstart_jobs': 'ls -1 /etc/init',
+	}
+
+	if getattr(env, 'project_user', None):
+		probes['user'] = 'id -u %s && id -g %s' % (env.project_user, env.project_user)
+
+	if getattr(env, 'home', None):
+		probes['venv'] = '%s -V 2>&1' % os.path.join(_get_venv_bin(env), 'python')
+		probes['ssh_key'] = 'cat %s' % os.path.join(env.home, '.ssh', 'id_rsa.pub')
+
+	if app_dir:
+		# The checkout belongs to the project user, not root. Shipped
+		# & synced trees have no working copy, their manifest has it
+		probes['revision'] = (
+			"cd %s && (git -c 'safe.directory=*' rev-parse --short HEAD || hg id -i || "
+			"sed -n 's/^ *\"revision\": \"\\([^\"]*\\)\".*/\\1/p' %s | grep .)"
+		) % (app_dir, MANIFEST_NAME)
+		probes['build_conf'] = 'cat %s' % os.path.join(app_dir, 'etc', 'build.conf')
+
+	return probes
+
+def _parse(name, result):
+	"""turn a probe's output into its fact, None if the probe failed"""
+
+	if result.failed:
+		return None
+
+	lines = [line.strip() for line in result.splitlines() if line.strip()]
+
+	if name in ('cpus', 'somaxconn'):
+		return int(lines[0]) if lines else None
+
+	# Bytes, /proc/meminfo counts in kB
+	if name == 'memory':
+		return int(lines[0]) * 1024 if lines else None
+
+	if name == 'packages':
+		return dict([line.split(' ', 1) for line in lines if ' ' in line])
+
+	if name in ('nginx_sites', 'upstart_jobs'):
+		return lines
+
+	if name == 'user':
+		return {'uid': int(lines[0]), 'gid': int(lines[1])} if len(lines) == 2 else None
+
+	if name == 'build_conf':
+		return str(result)
+
+	return lines[0] if lines else None
+
+def _gather():
+	"""probe the current host for all of its facts in one round trip"""
+
+	probes = _probes()
+	names = sorted(probes)
+	steps = Batch()
+
+	for name in names:
+		steps.add('( %s ) 2>/dev/null' % probes[name], warn_only=True)
+
+	with hide('stdout', 'running'):
+		results = steps.run()
+
+	facts = dict([(name, _parse(name, result)) for name, result in zip(names, results)])
+	facts['gathered'] = time.time()
+
+	with open(_facts_path(), 'w') as f:
+		json.dump(facts, f, indent=1, sort_keys=True)
+
+	return facts
+
+def _facts(refresh=False):
+	"""facts for the current host, from the cache while they're fresh"""
+
+	ttl = float(getattr(env, 'facts_ttl', FACTS_TTL))
+
+	if not refresh:
+		try:
+			with open(_facts_path()) as f:
+				facts = json.load(f)
+
+			if time.time() - facts.get('gathered', 0) < ttl:
+				return facts
+		except (IOError, ValueError):
+			pass
+
+	return _gather()
+
+def _invalidate(host=None):
+	"""forget the cached facts for a host"""
+
+	try:
+		os.remove(_facts_path(host))
+	except OSError:
+		pass
+
+def invalidates(func):
+	"""mark a task as changing the host, its facts are dropped afterwards"""
+
+	@wraps(func)
+	def wrapper(*args, **kwargs):
+		try:
+			return func(*args, **kwargs)
+		finally:
+			_invalidate()
+
+	return wrapper
+
+@task(default=True)
+def show(refresh=False):
+	"""show what is known about a host"""
+
+	require('host', provided_by=('development', 'staging', 'production'))
+
+	facts = _facts(_boolean(refresh))
+
+	for name in sorted(facts):
+		value = facts[name]
+
+		if name == 'packages' and value:
+			value = '%s installed' % len(value)
+		elif isinstance(value, (list, dict)):
+			value = json.dumps(value, sort_keys=True)
+		elif name == 'gathered':
+			value = '%ss ago' % int(time.time() - value)
+
+		print cyan('%-14s %s' % (name, value))
+
+@task
+@runs_once
+def clear():
+	"""forget the cached facts for every host"""
+
+	for host in env.all_hosts or [env.host_string]:
+		_invalidate(host)
+
+	print green('Facts cleared.')
@@ -4,7 +4,8 @@ import os.path
 
 from fabric.api import *
 from fabric.colors import green
-from fabric.decorators import task
+
+from architect.instrument import task
 
 #import github
 
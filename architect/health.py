@@ -0,0 +1,84 @@
+"""Health checks against the application on a host"""
+
+from fabric.api import *
+from fabric.colors import red, green
+
+from architect.instrument import run, task
+
+# Seconds each health request gets, however often they're made
+REQUEST_TIMEOUT = 5
+
+def _health_url(url=None):
+	return url or getattr(env, 'health_url', None) or 'http://127.0.0.1/'
+
+def _curl(url, timeout):
+	"""curl command printing the status code & total time of a request to url"""
+
+	host_header = ''
+
+	# Go through nginx as the site would be reached
+	if getattr(env, 'project_url', None):
+		host_header = "-H 'Host: %s' " % env.project_url
+
+	return "curl -s -o /dev/null -m %s %s-w '%%{http_code} %%{time_total}' '%s'" % (
+		timeout, host_header, url
+	)
+
+def _probe(url=None, timeout=5):
+	"""request url from the host, returns the status code & seconds taken"""
+
+	with settings(hide('everything'), warn_only=True):
+		result = run(_curl(_health_url(url), timeout))
+
+	try:
+		status, seconds = result.split()
+		return int(status), float(seconds)
+	except ValueError:
+		return 0, None
+
+def _wait_healthy(url=None, timeout=60, interval=1, replacing=None):
+	"""
+	wait (on the host, in one round trip) until url answers with a 2xx
+
+	replacing is the pids of workers being reloaded, they'd answer until
+	they're gone so url is only requested once they are.
+	"""
+
+	request_timeout = getattr(env, 'health_request_timeout', REQUEST_TIMEOUT)
+
+	# /proc rather than kill -0, which can't signal another user's workers
+	with settings(hide('everything'), warn_only=True):
+		result = run(
+			'end=$(($(date +%%s) + %s)); '
+			'for pid in %s; do while [ -d /proc/$pid ]; do '
+			'[ $(date +%%s) -lt $end ] || exit 1; sleep 0.2; done; done; '
+			'while [ $(date +%%s) -lt $end ]; do '
+			'case "$(%s | cut -d" " -f1)" in 2*) exit 0;; esac; '
+			'sleep %s; done; exit 1' % (
+				int(float(timeout)), ' '.join(replacing or []), _curl(_health_url(url), request_timeout), interval
+			)
+		)
+
+	return result.succeeded
+
+@task(default=True)
+def check(url=None, timeout=5):
+	"""check the application answers on the host"""
+
+	status, seconds = _probe(url, timeout)
+
+	if 200 <= status < 300:
+		print green('%s in %.3fs' % (status, seconds))
+	else:
+		print red('Unhealthy (%s)!' % (status or 'no response'))
+		return False
+
+@task
+def wait(url=None, timeout=60):
+	"""wait for the application to answer on the host"""
+
+	if not _wait_healthy(url, timeout):
+		print red('Still unhealthy after %ss!' % timeout)
+		return False
+
+	print green('Healthy.')
@@ -0,0 +1,169 @@
+"""Timing instrumentation for tasks & remote commands
+
+Architect modules use the run/sudo/put/get & task defined here in place of
+fabric's own, so every task & remote command is timed & recorded. Set
+env.report_file to also append each record to that file as NDJSON, which
+works across parallel runs too. Records carry the id of the run they're
+from, & with env.report_file set the run's summary is printed as it ends
+(see architect.report). Tasks also run with the vars the inventory
+gives their host (see architect.inventory), except those marked with the
+runs_once here, which act for every host at once.
+"""
+
+import atexit
+import json
+import os
+import time
+
+from functools import wraps
+
+from fabric import operations
+from fabric.api import env
+from fabric.decorators import runs_once as fabric_runs_once, task as fabric_task
+
+from architect.utils import _with_host_vars
+
+_entries = []
+
+# Parallel runs are forked, so their records carry the id of the run too
+RUN_ID = '%s-%s' % (time.strftime('%Y%m%dT%H%M%SZ', time.gmtime()), os.getpid())
+
+_pid = os.getpid()
+
+def _record(kind, name, started, **fields):
+	"""record a timed step of the run"""
+
+	entry = dict(fields)
+	entry.update({
+		'kind': kind,
+		'name': name,
+		'host': env.host_string,
+		'started': started,
+		'seconds': round(time.time() - started, 4),
+		'pid': os.getpid(),
+		'run': RUN_ID,
+	})
+
+	_entries.append(entry)
+
+	report_file = getattr(env, 'report_file', None)
+
+	if report_file:
+		# One write per line so parallel runs can share the file
+		with open(report_file, 'a') as f:
+			f.write(json.dumps(entry, sort_keys=True) + '\n')
+
+	return entry
+
+def _command(operation, user, command, args, kwargs):
+	"""time a remote command"""
+
+	started = time.time()
+
+	try:
+		result = operation(command, *args, **kwargs)
+	except BaseException:
+		# abort() on failure, we don't get to see the return code
+		_record('command', command, started, user=user, return_code=None,
+			failed=True, bytes_sent=len(command), bytes_received=0)
+		raise
+
+	_record('command', command, started, user=user,
+		return_code=getattr(result, 'return_code', None), failed=result.failed,
+		bytes_sent=len(command), bytes_received=len(result))
+
+	return result
+
+def _size(path):
+	if isinstance(path, basestring) and os.path.isfile(path):
+		return os.path.getsize(path)
+
+	return 0
+
+def run(command, *args, **kwargs):
+	return _command(operations.run, env.user, command, args, kwargs)
+
+def sudo(command, *args, **kwargs):
+	user = kwargs.get('user') or getattr(env, 'sudo_user', None) or 'root'
+
+	return _command(operations.sudo, user, command, args, kwargs)
+
+def put(local_path=None, remote_path=None, *args, **kwargs):
+	started = time.time()
+	result = operations.put(local_path, remote_path, *args, **kwargs)
+
+	_record('transfer', 'put %s' % remote_path, started, user=env.user,
+		failed=bool(result.failed), bytes_sent=_size(local_path), bytes_received=0)
+
+	return result
+
+def get(remote_path, local_path=None, *args, **kwargs):
+	started = time.time()
+	result = operations.get(remote_path, local_path, *args, **kwargs)
+
+	_record('transfer', 'get %s' % remote_path, started, user=env.user,
+		failed=bool(result.failed), bytes_sent=0, bytes_received=_size(local_path))
+
+	return result
+
+def _timed_task(func):
+	"""record the time taken by each run of a task"""
+
+	name = '%s.%s' % (func.__module__.split('.')[-1], func.__name__)
+
+	@wraps(func)
+	def timed(*args, **kwargs):
+		started = time.time()
+
+		try:
+			result = func(*args, **kwargs)
+		except BaseException:
+			_record('task', name, started, failed=True)
+			raise
+
+		_record('task', name, started, failed=result is False)
+
+		return result
+
+	return timed
+
+def runs_once(func):
+	"""fabric's runs_once decorator, also keeping the task to env's own vars"""
+
+	func = fabric_runs_once(func)
+	func.for_every_host = True
+
+	return func
+
+def _task(func):
+	"""time the task & run it with its host's inventory vars, unless it runs once for every host"""
+
+	if getattr(func, 'for_every_host', False):
+		return _timed_task(func)
+
+	return _timed_task(_with_host_vars(func))
+
+def task(*args, **kwargs):
+	"""fabric's task decorator, also timing each run of the task"""
+
+	# Same call signature handling as fabric's own decorator
+	invoked = bool(not args or kwargs)
+
+	if not invoked:
+		return fabric_task(_task(args[0]))
+
+	def wrapper(func):
+		return fabric_task(*args, **kwargs)(_task(func))
+
+	return wrapper
+
+def _finish():
+	# Only the process that started the run, not its forks
+	if os.getpid() != _pid or not getattr(env, 'report_file', None):
+		return
+
+	from architect import report
+
+	report._finish()
+
+atexit.register(_finish)
@@ -0,0 +1,207 @@
+"""Pick hosts from an inventory rather than per environment fabfile functions
+
+The inventory (etc/inventory.yml, or env.inventory) puts hosts in groups,
+with vars shared by every host, by a group's hosts & by a single host:
+
+	vars:
+	  project_name: shop
+	  home: /srv/shop
+	groups:
+	  web:
+	    vars: {uwsgi_threads: 8}
+	    hosts:
+	      web1.example.com: {tags: [eu]}
+	      web2.example.com: {tags: [us], uwsgi_threads: 16}
+	  worker:
+	    hosts: [worker1.example.com]
+
+`fab inventory:web,@eu,db*,~db9 app.deploy` picks the hosts for the tasks
+after it by group, @tag & host name pattern, with ~ leaving hosts out.
+Each architect task run on a host then has its host's vars set in env,
+tasks run once for all hosts (eg. app.rollout) keep to env's own & hand
+each host its vars as they fan out. Parsing the YAML is the slow part, so
+the inventory is indexed once into .architect/inventory.json & only
+parsed again when the file changes (dates & times are kept as strings).
+"""
+
+import fnmatch
+import json
+import os.path
+
+import yaml
+
+from fabric.api import *
+from fabric.colors import cyan, green
+
+from architect.instrument import task
+from architect.utils import _boolean, _local_path
+
+INVENTORY = 'etc/inventory.yml'
+
+# libyaml's loader is many times quicker, when it's available
+class Loader(getattr(yaml, 'CSafeLoader', yaml.SafeLoader)):
+	"""safe loader keeping dates & times as written, so the index is all JSON types"""
+
+Loader.add_constructor(u'tag:yaml.org,2002:timestamp', Loader.construct_yaml_str)
+
+# The index, once loaded this run
+_loaded = {}
+
+def _inventory_path():
+	return getattr(env, 'inventory', None) or INVENTORY
+
+def _members(hosts):
+	# Hosts can be listed alone or with their own vars
+	if isinstance(hosts, dict):
+		return hosts.items()
+
+	return [(host, None) for host in hosts or []]
+
+def _index(inventory):
+	"""each host's vars, plus the hosts in each group & with each tag"""
+
+	shared = inventory.get('vars') or {}
+	groups = {}
+	tags = {}
+	own = {}
+	hosts = {}
+
+	for group, spec in sorted((inventory.get('groups') or {}).items()):
+		spec = spec or {}
+		groups[group] = []
+
+		for host, host_vars in _members(spec.get('hosts')):
+			host_vars = dict(host_vars or {})
+
+			for tag in host_vars.pop('tags', None) or []:
+				tags.setdefault(tag, set()).add(host)
+
+			groups[group].append(host)
+			hosts.setdefault(host, dict(shared)).update(spec.get('vars') or {})
+			own.setdefault(host, {}).update(host_vars)
+
+		groups[group].sort()
+
+	# A host's own vars win over any of its groups'
+	for host, host_vars in own.items():
+		hosts[host].update(host_vars)
+
+	return {
+		'vars': shared,
+		'hosts': hosts,
+		'groups': groups,
+		'tags': dict([(tag, sorted(members)) for tag, members in tags.items()]),
+	}
+
+def _load():
+	"""the inventory's index, from the cache unless the inventory has changed"""
+
+	path = _inventory_path()
+
+	if not os.path.exists(path):
+		abort('No inventory found at %s!' % path)
+
+	stat = os.stat(path)
+	key = [os.path.abspath(path), stat.st_mtime, stat.st_size]
+
+	if _loaded.get('key') == key:
+		return _loaded['index']
+
+	cache = _local_path('inventory.json')
+
+	try:
+		with open(cache) as f:
+			cached = json.load(f)
+
+		if cached['key'] == key:
+			_loaded.update(cached)
+			return cached['index']
+	except (IOError, ValueError, KeyError):
+		pass
+
+	with open(path) as f:
+		try:
+			inventory = yaml.load(f, Loader=Loader) or {}
+		except yaml.YAMLError as e:
+			abort('Could not parse %s: %s' % (path, e))
+
+	_loaded.update({'key': key, 'index': _index(inventory)})
+
+	with open(cache, 'w') as f:
+		json.dump(_loaded, f)
+
+	return _loaded['index']
+
+def _select(index, selectors):
+	"""the hosts matching any of the selectors, less those matching a ~ selector"""
+
+	selected = set()
+	excluded = set()
+
+	for selector in selectors:
+		matches = excluded if selector.startswith('~') else selected
+		selector = selector.lstrip('~')
+
+		if selector.startswith('@'):
+			hosts = index['tags'].get(selector[1:])
+		elif selector in index['groups']:
+			hosts = index['groups'][selector]
+		elif selector in index['hosts']:
+			hosts = [selector]
+		else:
+			hosts = fnmatch.filter(index['hosts'], selector)
+
+		if not hosts:
+			abort('Nothing in the inventory matches "%s"!' % selector)
+
+		matches.update(hosts)
+
+	# Only leaving hosts out starts from all of them
+	if not selected:
+		selected = set(index['hosts'])
+
+	return sorted(selected - excluded)
+
+@task(default=True)
+def select(*selectors, **kwargs):
+	"""pick the hosts for the following tasks by group, @tag or pattern, ~ to leave out"""
+
+	index = _load()
+	hosts = _select(index, selectors)
+
+	if not hosts:
+		abort('No hosts selected!')
+
+	env.hosts = hosts
+	env.roledefs.update(index['groups'])
+
+	# Shared vars are set now for the checks tasks make before running on a host
+	env.update(index['vars'])
+	env.host_vars = dict([(host, index['hosts'][host]) for host in hosts])
+
+	if _boolean(kwargs.get('parallel', False)):
+		env.parallel = True
+
+	if kwargs.get('pool_size'):
+		env.pool_size = int(kwargs['pool_size'])
+
+	print green('%s hosts selected.' % len(hosts))
+
+@task
+def show(*selectors):
+	"""list the inventory's hosts with their groups & tags"""
+
+	index = _load()
+	groups = {}
+	tags = {}
+
+	for group, members in index['groups'].items():
+		for host in members:
+			groups.setdefault(host, []).append(group)
+
+	for tag, members in index['tags'].items():
+		for host in members:
+			tags.setdefault(host, []).append('@%s' % tag)
+
+	for host in _select(index, selectors):
+		print '%s %s' % (host, cyan(' '.join(sorted(groups.get(host, [])) + sorted(tags.get(host, [])))))
@@ -1,8 +1,205 @@
 """Utilities for handling logs"""
 
+import calendar
+import inspect
+import json
+import os.path
+import pipes
+import re
+import time
+
+from cStringIO import StringIO
+
 from fabric.api import *
-from fabric.colors import cyan
-from fabric.decorators import task
+from fabric.colors import cyan, green, red, yellow
+
+from architect import accesslog
+from architect.instrument import put, run, runs_once, sudo, task
+from architect.utils import _boolean, _execute_parallel, _local_path
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# A p95 this much slower after than before is flagged as a regression
+REGRESSION = 1.2
+
+SIZES = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+# Where accesslog is sent to run on the host
+SCRIPT = '/tmp/architect_accesslog.py'
+
+# Rotated logs are named <log>.<stamp>[.gz] so they sort by age
+ROTATE_SCRIPT = """
+stamp=%(stamp)s
+rotated=""
+for log in %(logs)s; do
+	[ -s "$log" ] || continue
+	if [ %(mode)s = rename ]; then
+		mv "$log" "$log.$stamp" && touch "$log" &&
+		chown --reference="$log.$stamp" "$log" && chmod --reference="$log.$stamp" "$log"
+	else
+		cp -p "$log" "$log.$stamp" && truncate -s 0 "$log"
+	fi && rotated="$rotated $log.$stamp" && echo "$log"
+done
+[ -z "$rotated" ] || [ %(mode)s != rename ] || { %(reopen)s; } > /dev/null
+for log in %(logs)s; do
+	find "$(dirname "$log")" -maxdepth 1 -name "$(basename "$log").*" %(age)s -delete
+	total=0; kept=0
+	for old in $(ls -1d "$log".* 2>/dev/null | sort -r); do
+		total=$((total + $(stat -c %%s "$old"))); kept=$((kept + 1))
+		[ $kept -gt 1 ] && { [ $kept -gt %(keep)s ] || [ $total -gt %(max_size)s ]; } && rm -f "$old"
+	done
+done
+[ -z "$rotated" ] || (setsid nohup nice -n 19 ionice -c 3 gzip -f $rotated > /dev/null 2>&1 &)
+true
+"""
+
+def _log_path(log):
+	"""logs are looked up in env.home/logs unless given a full path"""
+	
+	if log.startswith('/'):
+		return log
+	
+	return os.path.join(env.home, 'logs', '%s.log' % log)
+
+def _filter(pattern=None, level=None, since=None, until=None):
+	"""shell pipeline that filters log lines on the host"""
+	
+	stages = []
+	
+	if level:
+		level = {'WARN': 'WARNING'}.get(level.upper(), level.upper())
+		levels = LEVELS[LEVELS.index(level):] if level in LEVELS else (level,)
+		stages.append('grep --line-buffered -E %s' % pipes.quote(r'\b(%s)\b' % '|'.join(levels)))
+	
+	if pattern:
+		stages.append('grep --line-buffered -E %s' % pipes.quote(pattern))
+	
+	# Each line's time is read in its log's own format, by the script
+	# _put_script sends, before the other stages drop lines without one
+	if since is not None or until is not None:
+		stages.insert(0, '%s --lines%s' % (_script_command(), _window_args(since, until)))
+	
+	line_filter = ''.join([' | %s' % stage for stage in stages])
+	
+	# grep exits 1 when nothing matched, which isn't a failure here
+	if stages and stages[-1].startswith('grep'):
+		line_filter += ' || [ $? -eq 1 ]'
+	
+	return line_filter
+
+def _offset_path(log):
+	return _local_path('logs', env.host_string.replace(':', '_'), '%s.offset' % log.strip('/').replace('/', '_'))
+
+def _read_offset(log):
+	try:
+		with open(_offset_path(log)) as f:
+			return int(f.read().strip() or 0)
+	except (IOError, ValueError):
+		return 0
+
+def _write_offset(log, offset):
+	with open(_offset_path(log), 'w') as f:
+		f.write('%s\n' % offset)
+
+def _print_lines(lines):
+	for line in lines.splitlines():
+		print cyan('[%s] %s' % (env.host_string, line))
+
+def _access_log():
+	return getattr(env, 'access_log', None) or '/var/log/nginx/%s.access.log' % env.project_url
+
+def _epoch(value):
+	"""epoch seconds from an epoch, a time ago like 15m, 2h or 1d, or a UTC time like 2026-10-18T09:30"""
+	
+	if value is None:
+		return None
+	
+	match = re.match(r'^(\d+(?:\.\d+)?)([smhd])$', str(value))
+	
+	if match:
+		return time.time() - float(match.group(1)) * UNITS[match.group(2)]
+	
+	for format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+		try:
+			return calendar.timegm(time.strptime(str(value).replace(' ', 'T'), format))
+		except ValueError:
+			continue
+	
+	return float(value)
+
+def _script_command():
+	return '%s %s' % (getattr(env, 'analytics_python', 'python'), SCRIPT)
+
+def _put_script():
+	"""send accesslog to the host to run against its logs"""
+	
+	put(StringIO(inspect.getsource(accesslog)), SCRIPT, mode=0644)
+
+def _window_args(since, until):
+	args = ''
+	
+	if since is not None:
+		args += ' --since %s' % since
+	
+	if until is not None:
+		args += ' --until %s' % until
+	
+	return args
+
+def _collect(log, since, until):
+	"""summarise the access log on this host, only the summary comes back"""
+	
+	_put_script()
+	
+	with hide('everything'):
+		summary = sudo('%s%s %s' % (_script_command(), _window_args(since, until), log))
+	
+	return json.loads(summary)
+
+def _snapshot_path(name):
+	return _local_path('analytics', '%s.json' % name)
+
+def _print_stats(stats, top):
+	print cyan('%-40s %8s %8s %7s %8s %8s %8s' % ('Endpoint', 'Requests', 'Req/s', '5xx', 'p50', 'p95', 'p99'))
+	
+	endpoints = sorted(stats.endpoints, key=lambda endpoint: -stats.endpoints[endpoint]['count'][0])
+	
+	for endpoint in ['(all)'] + endpoints[:int(top)]:
+		source = stats.total() if endpoint == '(all)' else stats
+		summary = source.summary(endpoint)
+		
+		line = '%-40s %8s %8.2f %6.1f%% %8s %8s %8s' % (
+			endpoint[:40], summary['count'], summary['rate'], summary['errors'] * 100,
+			_ms(summary['p50']), _ms(summary['p95']), _ms(summary['p99'])
+		)
+		
+		print red(line) if summary['errors'] > 0.01 else line
+
+def _ms(seconds):
+	return '-' if seconds is None else '%.0fms' % (seconds * 1000)
+
+def _bytes(value):
+	"""bytes from a size like 500M or 2G"""
+	
+	value = str(value).strip().lower().rstrip('b')
+	
+	if value[-1:] in SIZES:
+		return int(float(value[:-1]) * SIZES[value[-1]])
+	
+	return int(value)
+
+def _reopen():
+	"""command telling the app to reopen its logs after they've been moved"""
+	
+	if getattr(env, 'log_reopen', None):
+		return env.log_reopen
+	
+	if getattr(env, 'uwsgi_fifo', None):
+		return 'echo l > %s' % env.uwsgi_fifo
+	
+	return None
 
 @task(default=True)
 def list():
@@ -18,24 +215,163 @@ def list():
 	print cyan(logs)
 
 @task
-def get(log, size=50):
-	"""get the last output of a given log"""
+@parallel
+def get(log, size=50, pattern=None, level=None, since=None, until=None, resume=False):
+	"""get the last output of a given log, filtered on the host"""
 	
 	require('home', provided_by=('development', 'staging', 'production'))
 	
-	with cd(env.home):
+	path = _log_path(log)
+	since, until = _epoch(since), _epoch(until)
+	line_filter = _filter(pattern, level, since, until)
+	
+	if since is not None or until is not None:
+		_put_script()
+	
+	if _boolean(resume):
+		# Carry on from where the last query stopped, starting over if the
+		# log has been truncated or rotated since
+		offset = _read_offset(log)
+		
 		with hide('stdout'):
-			log_contents = sudo('tail -n %s logs/%s.log' % (size, log))
+			log_contents = sudo(
+				'size=$(stat -c %%s %(path)s); off=%(offset)s; '
+				'[ "$size" -lt "$off" ] && off=0; '
+				'echo $size; tail -c +$((off + 1)) %(path)s | head -c $((size - off))%(filter)s' % {
+					'path': path, 'offset': offset, 'filter': line_filter
+				}
+			)
+		
+		size, _, log_contents = log_contents.partition('\n')
 		
-	print cyan(log_contents)
+		try:
+			_write_offset(log, int(size.strip()))
+		except ValueError:
+			print yellow('[%s] Could not index %s.' % (env.host_string, path))
+	else:
+		with hide('stdout'):
+			log_contents = sudo('tail -n %s %s%s' % (size, path, line_filter))
+	
+	_print_lines(log_contents)
 
 @task
-def clear(log, size=50):
-	"""get the last output of a given log"""
+@parallel
+def follow(log, pattern=None, level=None):
+	"""stream new lines of a given log as they arrive, filtered on the host"""
 	
 	require('home', provided_by=('development', 'staging', 'production'))
 	
-	with cd(env.home):
-		sudo('echo '' > logs/%s.log' % log)
+	# Stops with ctrl-c
+	sudo('tail -n 0 -F %s%s' % (_log_path(log), _filter(pattern, level)))
+
+@task
+@parallel
+def clear(log):
+	"""empty a given log in place"""
+	
+	require('home', provided_by=('development', 'staging', 'production'))
+	
+	# Truncating keeps the file the app has open, writers carry on at the start
+	sudo('truncate -s 0 %s' % _log_path(log))
+	
+	print cyan('[%s] Cleared %s.' % (env.host_string, log))
+
+@task
+@parallel
+def rotate(log=None, mode='copytruncate', keep=7, max_age=30, max_size='1G'):
+	"""rotate logs, compressing them in the background & applying retention"""
+	
+	require('home', provided_by=('development', 'staging', 'production'))
 	
-	print cyan(log_contents)
+	# All of the app's logs unless told otherwise
+	logs = _log_path(log) if log else os.path.join(env.home, 'logs', '*.log')
+	reopen = _reopen()
+	
+	# Renaming never copies the log but the app has to reopen it, copying
+	# works with anything at the cost of a copy & a few lost lines
+	if mode not in ('copytruncate', 'rename'):
+		abort('Unknown rotation mode "%s", use copytruncate or rename.' % mode)
+	
+	if mode == 'rename' and reopen is None:
+		abort('Set env.log_reopen (or env.uwsgi_fifo) to rotate by renaming.')
+	
+	with hide('stdout'):
+		rotated = sudo(ROTATE_SCRIPT % {
+			'stamp': time.strftime('%Y%m%d%H%M%S', time.gmtime()),
+			'logs': logs,
+			'mode': mode,
+			'reopen': reopen or 'true',
+			'age': '-mtime +%s' % int(max_age) if max_age else '-false',
+			'keep': max(int(keep), 1),
+			'max_size': _bytes(max_size) if max_size else 2 ** 62,
+		}, pty=False)
+	
+	if rotated.strip():
+		_print_lines(rotated)
+	else:
+		print yellow('[%s] Nothing to rotate.' % env.host_string)
+
+@task
+@runs_once
+def analyze(log=None, since=None, until=None, top=20, save=None):
+	"""request rates, statuses & latency percentiles from every host's access log"""
+	
+	require('project_url', provided_by=('development', 'staging', 'production'))
+	
+	results = _execute_parallel(_collect, env.all_hosts, None, log or _access_log(), _epoch(since), _epoch(until))
+	stats = accesslog.Stats()
+	
+	for host, summary in results.items():
+		if isinstance(summary, dict):
+			stats.merge(accesslog.Stats.from_dict(summary))
+		else:
+			print red('[%s] Could not read the access log.' % host)
+	
+	if not stats.endpoints:
+		print yellow('No requests found.')
+		return stats
+	
+	_print_stats(stats, top)
+	
+	if save:
+		with open(_snapshot_path(save), 'w') as f:
+			json.dump(stats.to_dict(), f)
+		
+		print green('Saved as "%s".' % save)
+	
+	return stats
+
+@task
+@runs_once
+def compare(before='before', after='after', top=20):
+	"""compare two saved analyses, eg. from before & after a deploy"""
+	
+	snapshots = []
+	
+	for name in (before, after):
+		if not os.path.exists(_snapshot_path(name)):
+			print red('No saved analysis "%s", run logs.analyze:save=%s first!' % (name, name))
+			return
+		
+		with open(_snapshot_path(name)) as f:
+			snapshots.append(accesslog.Stats.from_dict(json.load(f)))
+	
+	old, new = snapshots
+	endpoints = [e for e in new.endpoints if e in old.endpoints]
+	endpoints.sort(key=lambda endpoint: -new.endpoints[endpoint]['count'][0])
+	
+	print cyan('%-40s %17s %17s' % ('Endpoint', 'p95', '5xx'))
+	
+	for endpoint in ['(all)'] + endpoints[:int(top)]:
+		if endpoint == '(all)':
+			was, now = old.total().summary(endpoint), new.total().summary(endpoint)
+		else:
+			was, now = old.summary(endpoint), new.summary(endpoint)
+		
+		line = '%-40s %8s%9s %7.1f%%%8.1f%%' % (
+			endpoint[:40], _ms(was['p95']), _ms(now['p95']), was['errors'] * 100, now['errors'] * 100
+		)
+		
+		slower = was['p95'] and now['p95'] and now['p95'] > was['p95'] * REGRESSION
+		
+		print red(line) if slower or now['errors'] > was['errors'] else line
@@ -1,8 +1,115 @@
 """Commands for dealing with server services"""
 
+import os.path
+import re
+
+from cStringIO import StringIO
+
 from fabric.api import *
-from fabric.colors import red, blue, green, yellow
-from fabric.decorators import task
+from fabric.colors import red, blue, cyan, green, yellow
+
+from architect.facts import _facts, invalidates
+from architect.instrument import put, run, sudo, task
+from architect.utils import _boolean, _get_uwsgi_socket, _template
+
+def _site_path():
+	return '/etc/nginx/sites-available/%s' % env.project_url
+
+def _sizing(facts):
+	"""pool & buffer sizes for the host's cores & memory"""
+
+	cpus = facts.get('cpus') or 1
+	memory = (facts.get('memory') or 1024 ** 3) / float(1024 ** 3)
+
+	return {
+		'keepalive': min(cpus * 16, 256),
+		'buffers': '%s 16k' % (8 if memory < 2 else 16 if memory < 8 else 32),
+		'buffer_size': '16k',
+		'client_body_buffer_size': '128k' if memory < 4 else '512k',
+		'cache_size': '%sm' % max(64, min(1024, int(memory * 1024 / 16))),
+	}
+
+def _site_config():
+	"""the site config for env.project_url, sized for the current host"""
+
+	sizing = _sizing(_facts())
+	upstream = re.sub(r'\W', '_', env.project_url)
+	socket = _get_uwsgi_socket(env)
+	cache = getattr(env, 'nginx_cache', None) or {}
+
+	# The uwsgi protocol is one request per connection, uwsgi's http-socket
+	# can keep a pool of connections open instead
+	if getattr(env, 'uwsgi_http', False):
+		prefix = 'proxy'
+		keepalive = '\n\tkeepalive %s;' % sizing['keepalive']
+		upstream_pass = '\n\t\t'.join([
+			'proxy_pass http://%s;' % upstream,
+			'proxy_http_version 1.1;',
+			'proxy_set_header Connection "";',
+			'proxy_set_header Host $host;',
+			'proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;',
+		])
+	else:
+		prefix = 'uwsgi'
+		keepalive = ''
+		upstream_pass = 'include uwsgi_params;\n\t\tuwsgi_pass %s;' % upstream
+
+	locations = ''
+
+	# Cached locations get their own TTL (in seconds), everything else isn't cached
+	for path in sorted(set(['/'] + cache.keys())):
+		locations += _template('nginx.location.conf') % {
+			'path': path,
+			'pass': upstream_pass,
+			'prefix': prefix,
+			'buffers': sizing['buffers'],
+			'buffer_size': sizing['buffer_size'],
+			'read_timeout': getattr(env, 'uwsgi_timeout', 60),
+			'cache': _template('nginx.cache.conf').rstrip('\n') % {
+				'prefix': prefix, 'zone': upstream, 'ttl': cache[path]
+			} if path in cache else '',
+		}
+
+	cache_path = ''
+
+	if cache:
+		cache_path = '\n%s_cache_path /var/cache/nginx/%s levels=1:2 keys_zone=%s:10m max_size=%s inactive=10m;\n' % (
+			prefix, upstream, upstream, sizing['cache_size']
+		)
+
+	return _template('nginx.site.conf') % {
+		'project_url': env.project_url,
+		'upstream': upstream,
+		'server': socket if ':' in socket else 'unix:%s' % socket,
+		'keepalive': keepalive,
+		'cache_path': cache_path,
+		'client_max_body_size': getattr(env, 'client_max_body_size', '10m'),
+		'client_body_buffer_size': sizing['client_body_buffer_size'],
+		'locations': locations,
+	}
+
+def _install_site():
+	"""install the generated site config, returns False if it hadn't changed"""
+
+	remote_config = '/tmp/%s.nginx.conf' % env.project_url
+
+	put(StringIO(_site_config()), remote_config, mode=0644)
+
+	# A config that fails the test is swapped back out before nginx sees it
+	with hide('stdout'):
+		result = sudo(
+			'if cmp -s %(tmp)s %(path)s; then rm -f %(tmp)s; echo unchanged; else '
+			'mkdir -p /var/cache/nginx; [ ! -e %(path)s ] || cp -p %(path)s %(path)s.previous; '
+			'mv %(tmp)s %(path)s && ln -sfn %(path)s %(enabled)s && '
+			'{ /etc/init.d/nginx configtest || { [ -e %(path)s.previous ] && mv %(path)s.previous %(path)s || rm -f %(path)s %(enabled)s; exit 1; }; } && '
+			'/etc/init.d/nginx reload; fi' % {
+				'tmp': remote_config,
+				'path': _site_path(),
+				'enabled': '/etc/nginx/sites-enabled/%s' % env.project_url,
+			}
+		)
+
+	return result.strip() != 'unchanged'
 
 @task
 def configtest():
@@ -34,8 +141,11 @@ def restart():
 
 @task
 def reload():
-	"""reload nginx"""
+	"""test the config & gracefully reload nginx"""
 	require('host', provided_by=('development', 'staging', 'production'))
+	# nginx keeps its old config when a reload fails, but only says so in its
+	# error log, so test the config first to fail here instead
+	sudo('/etc/init.d/nginx configtest')
 	sudo('/etc/init.d/nginx reload')
 	print green('Nginx Reload.')
 
@@ -46,14 +156,13 @@ def status():
 	sudo('/etc/init.d/nginx status')
 
 @task
-def get_sites():
+def get_sites(refresh=False):
 	"""list sites in nginx"""
 	require('host', provided_by=('development', 'staging', 'production'))
 
-	with hide('stdout'):
-		sites = sudo('ls -la /etc/nginx/sites-enabled/', user=env.project_user)
+	sites = _facts(_boolean(refresh)).get('nginx_sites') or []
 
-	print cyan(sites)
+	print cyan('\n'.join(sites))
 
 @task
 def get_config():
@@ -65,3 +174,21 @@ def get_config():
 		config = sudo('cat /etc/nginx/conf/nginx.conf', user=env.project_user)
 
 	print cyan(config)
+
+@task
+@invalidates
+def site(show=False):
+	"""generate & install the site config for the project url"""
+
+	require('host', provided_by=('development', 'staging', 'production'))
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_url', provided_by=('development', 'staging', 'production'))
+
+	if _boolean(show):
+		print cyan(_site_config())
+		return
+
+	if _install_site():
+		print green('Nginx site installed.')
+	else:
+		print yellow('Nginx site unchanged.')
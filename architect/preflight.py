@@ -0,0 +1,247 @@
+"""Local pre-flight checks, run before any connection is made to a host"""
+
+import os.path
+import re
+
+from multiprocessing.pool import ThreadPool
+
+import yaml
+
+from fabric.api import *
+from fabric.colors import red, green
+
+from architect.instrument import runs_once, task
+from architect.utils import _host_setting
+from architect.wheels import _requirements
+
+# env keys each workflow needs
+WORKFLOW_ENV = {
+	'setup': ('home', 'project_user', 'project_group'),
+	'bootstrap': ('home', 'project_name', 'project_repo', 'project_url', 'project_user'),
+	'deploy': ('home', 'project_name', 'project_user', 'project_repo'),
+	'redeploy': ('home', 'project_name', 'project_user'),
+	'install_mods': ('home', 'project_name'),
+	'install_crontab': ('home', 'project_name', 'project_user'),
+	'upstart_link': ('home', 'project_name'),
+	'nginx_link': ('home', 'project_name', 'project_url'),
+}
+
+CRON_SPECIALS = ('@reboot', '@yearly', '@annually', '@monthly', '@weekly', '@daily', '@midnight', '@hourly')
+CRON_FIELD = re.compile(r'^[\d*/,\-a-zA-Z]+$')
+REQUIREMENT = re.compile(
+	r'^[A-Za-z0-9][A-Za-z0-9._\-]*(\[[A-Za-z0-9._,\- ]*\])?'
+	r'\s*((===|==|>=|<=|!=|~=|>|<)\s*[^\s,;]+\s*,?\s*)*(;.*)?$'
+)
+
+def _config(name):
+	"""find the plain or per environment version of a config file"""
+
+	for path in ('etc/%s.conf' % name, 'etc/%s.%s.conf' % (name, getattr(env, 'environment', None))):
+		if os.path.exists(path):
+			return path
+
+	return None
+
+def _check_env(workflow):
+	keys = WORKFLOW_ENV.get(workflow) or sorted(set(sum(WORKFLOW_ENV.values(), ())))
+	hosts = sorted(getattr(env, 'host_vars', None) or {})
+	errors = []
+
+	# With an inventory each host can have its own, so check every host's
+	for key in keys:
+		if not hosts and not env.get(key):
+			errors.append('env.%s is not set' % key)
+
+		missing = [host for host in hosts if not _host_setting(host, key)]
+
+		if missing:
+			errors.append('env.%s is not set for %s' % (key, ', '.join(missing)))
+
+	if not env.get('all_hosts') and not env.get('hosts') and not env.get('host_string'):
+		errors.append('no hosts to run against')
+
+	return errors
+
+def _check_nginx():
+	path = _config('nginx')
+
+	# Without one the site config is generated
+	if path is None:
+		return []
+
+	with open(path) as f:
+		# Drop comments, keeping quoted strings intact
+		text = re.sub(r'("(?:\\.|[^"])*"|\'(?:\\.|[^\'])*\')|#[^\n]*', lambda m: m.group(1) or '', f.read())
+
+	errors = []
+	depth = 0
+	statement = ''
+
+	for char in re.sub(r'"(?:\\.|[^"])*"|\'(?:\\.|[^\'])*\'', '""', text):
+		if char == '{':
+			depth += 1
+			statement = ''
+		elif char == '}':
+			depth -= 1
+			if statement.strip():
+				errors.append('%s: missing ";" after "%s"' % (path, statement.strip()))
+			statement = ''
+			if depth < 0:
+				errors.append('%s: unexpected "}"' % path)
+				depth = 0
+		elif char == ';':
+			statement = ''
+		else:
+			statement += char
+
+	if depth > 0:
+		errors.append('%s: %s unclosed "{"' % (path, depth))
+
+	if statement.strip():
+		errors.append('%s: missing ";" after "%s"' % (path, statement.strip()))
+
+	if not re.search(r'(^|[\s;{}])server\s*{', text):
+		errors.append('%s: no server block' % path)
+
+	return errors
+
+def _check_upstart():
+	path = _config('upstart')
+
+	if path is None:
+		return []
+
+	with open(path) as f:
+		lines = [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+	errors = []
+
+	if not [line for line in lines if line.startswith('exec ') or line == 'script']:
+		errors.append('%s: no exec or script stanza' % path)
+
+	if lines.count('script') != lines.count('end script'):
+		errors.append('%s: unbalanced script/end script' % path)
+
+	return errors
+
+def _check_cron():
+	path = 'etc/cron.txt'
+
+	if not os.path.exists(path):
+		return []
+
+	errors = []
+
+	with open(path) as f:
+		for number, line in enumerate(f, 1):
+			line = line.strip()
+
+			# Blank lines, comments & variable assignments
+			if not line or line.startswith('#') or re.match(r'^[A-Za-z_]\w*\s*=', line):
+				continue
+
+			fields = line.split()
+
+			if fields[0] in CRON_SPECIALS:
+				valid = len(fields) > 1
+			else:
+				valid = len(fields) > 5 and all([CRON_FIELD.match(field) for field in fields[:5]])
+
+			if not valid:
+				errors.append('%s:%s: bad crontab line "%s"' % (path, number, line))
+
+	return errors
+
+def _check_build():
+	path = 'etc/build.conf'
+
+	if not os.path.exists(path):
+		return []
+
+	try:
+		with open(path) as f:
+			build = yaml.safe_load(f)
+	except yaml.YAMLError as e:
+		return ['%s: invalid YAML (%s)' % (path, str(e).replace('\n', ' '))]
+
+	if build is None:
+		return []
+
+	if not isinstance(build, dict):
+		return ['%s: expected a mapping' % path]
+
+	install = build.get('install', [])
+
+	if not isinstance(install, list) or not all([isinstance(p, basestring) for p in install]):
+		return ['%s: install should be a list of package names' % path]
+
+	return []
+
+def _check_requirements():
+	path = _requirements()
+
+	if path is None:
+		return []
+
+	errors = []
+
+	with open(path) as f:
+		for number, line in enumerate(f, 1):
+			line = line.split(' #')[0].strip()
+
+			if not line or line.startswith('#'):
+				continue
+
+			# Included requirements files are relative to this one
+			if line.startswith('-r ') or line.startswith('--requirement '):
+				include = os.path.join(os.path.dirname(path), line.split(None, 1)[1])
+
+				if not os.path.exists(include):
+					errors.append('%s:%s: missing included file %s' % (path, number, include))
+
+			elif line.startswith('-') or '://' in line:
+				continue
+
+			elif not REQUIREMENT.match(line):
+				errors.append('%s:%s: bad requirement "%s"' % (path, number, line))
+
+	return errors
+
+def _preflight(workflow=None):
+	"""run the checks side by side, returns a list of errors"""
+
+	checks = [
+		lambda: _check_env(workflow),
+		_check_nginx,
+		_check_upstart,
+		_check_cron,
+		_check_build,
+		_check_requirements,
+	]
+
+	pool = ThreadPool(len(checks))
+
+	try:
+		return sum(pool.map(lambda check: check(), checks), [])
+	finally:
+		pool.close()
+
+def _check(workflow=None):
+	"""stop the run if the local configs or env have problems"""
+
+	errors = _preflight(workflow)
+
+	if errors:
+		for error in errors:
+			print red('  %s' % error)
+
+		abort('Pre-flight found %s problems.' % len(errors))
+
+	print green('Pre-flight OK.')
+
+@task(default=True)
+@runs_once
+def check(workflow=None):
+	"""validate local configs & env before connecting to any host"""
+
+	_check(workflow)
@@ -0,0 +1,350 @@
+"""Bring up new hosts, running the setup stages as a dependency graph
+
+The stages of setup, ubuntu.build, bootstrap & install_crontab are split
+up by what they depend on, worked out for each host from its own vars. A
+stage starts as soon as the stages it depends on are done, in its own
+process & connection to the host, so eg. apt installs overlap with the
+virtualenv & the code fetch. Every host works through its stages in
+parallel with the others.
+"""
+
+import multiprocessing
+import os.path
+import pipes
+import time
+
+import yaml
+
+from fabric import state
+from fabric.api import *
+from fabric.colors import red, cyan, green
+
+from architect.app import (_code_resources, _config_path, _config_resources, _deploy_release,
+	_requirements_resources, _structure_resources, _venv_resources)
+from architect.artifact import _build_release
+from architect.facts import _invalidate
+from architect.instrument import _record, runs_once, sudo, task
+from architect.nginx import _install_site
+from architect.preflight import _check as _preflight
+from architect.release import _current_release
+from architect.resources import CHANGED, Crontab, Package
+from architect.rollout import _timed
+from architect.service import _install_service
+from architect.sync import _local_manifest, _sync
+from architect.venvs import _build as _build_venv_image, _install_image as _install_venv_image
+from architect.utils import _any_host, _execute_parallel, _get_app_dir, _percentile, _with_host_vars
+from architect.wheels import _build_once as _build_wheels, _install as _install_wheels, _requirements
+
+def _packages():
+	"""the os packages listed in the local etc/build.conf"""
+
+	if not os.path.exists('etc/build.conf'):
+		return []
+
+	with open('etc/build.conf') as f:
+		build = yaml.safe_load(f) or {}
+
+	return build.get('install') or []
+
+def _ship_release():
+	# New hosts get the release already built for this run
+	if _current_release() is None:
+		return _deploy_release()
+
+def _stages():
+	"""each stage's dependencies & its resources (or a function for work that isn't)"""
+
+	code = _code_resources()
+
+	if code is None:
+		return None
+
+	# Synced trees & releases are shipped to the host rather than checked out
+	if getattr(env, 'use_sync', False):
+		code = _sync
+	elif getattr(env, 'use_releases', False):
+		code = _ship_release
+
+	stages = {
+		'structure': ((), _structure_resources()),
+		'virtualenv': (('structure',), _venv_resources()),
+		'code': (('structure',), code),
+		'requirements': (('virtualenv', 'code', 'packages'), _requirements_resources()),
+		# nginx & uwsgi can come from the packages, so their configs wait on them
+		'configs': (('code', 'packages'), _config_resources()),
+	}
+
+	if _packages():
+		stages['packages'] = ((), [Package(*_packages())])
+
+	requirements = _requirements()
+
+	if requirements is not None and getattr(env, 'use_venv_images', False):
+		stages['virtualenv'] = (('structure',), _install_venv_image)
+
+	elif requirements is not None and getattr(env, 'use_wheels', False):
+		stages['requirements'] = (stages['requirements'][0], lambda: _install_wheels(requirements))
+
+	# Without a hand written config the site is generated for each host
+	if not _config_path('nginx'):
+		stages['nginx'] = (('structure', 'packages'), _install_site)
+
+	if not _config_path('upstart'):
+		stages['service'] = (('structure', 'packages'), _install_service)
+
+	if os.path.exists('etc/cron.txt'):
+		stages['crontab'] = (('code',), [Crontab(env.project_user, os.path.join(_get_app_dir(env), 'etc/cron.txt'))])
+
+	# Nothing to do, eg. no requirements
+	return dict([(name, stage) for name, stage in stages.items() if stage[1]])
+
+def _waves(stages):
+	"""group the stages by how many stages they wait on in a row, checking for cycles"""
+
+	waves = []
+	done = set()
+
+	while len(done) < len(stages):
+		wave = sorted([
+			name for name, (depends, work) in stages.items()
+			if name not in done and all([d in done or d not in stages for d in depends])
+		])
+
+		if not wave:
+			abort('Provisioning stages depend on each other: %s' % ', '.join(sorted(set(stages) - done)))
+
+		waves.append(wave)
+		done.update(wave)
+
+	return waves
+
+def _line(resource):
+	# Stop the stage at the first resource that can't be fixed
+	step = resource.step()
+
+	if resource.user is not None:
+		step = 'sudo -H -u %s /bin/sh -c %s' % (resource.user, pipes.quote(step))
+
+	return '%s || exit $?' % step
+
+def _run_resources(resources):
+	"""converge a stage's resources on the host, returns its outcome"""
+
+	started = time.time()
+
+	with settings(hide('everything'), warn_only=True):
+		output = sudo('\n'.join([_line(resource) for resource in resources]))
+
+	return {
+		'ok': output.succeeded,
+		'seconds': time.time() - started,
+		'changed': len([line for line in output.splitlines() if line.strip() == CHANGED]),
+		'error': None if output.succeeded else output.strip(),
+	}
+
+def _run_stage(name, work):
+	# Work that isn't resources is a function run against the host
+	if callable(work):
+		return _timed(work)
+
+	return _run_resources(work)
+
+def _run_stages(stages, runner, done=None):
+	"""
+	run each stage as soon as the stages it depends on are done
+
+	Every stage runs in its own process (with its own connection to the
+	host), calling runner with its name & work for its outcome. Stages
+	depending on one that failed are skipped. done is called with each
+	stage's name & outcome as it finishes, returns every stage's outcome.
+	"""
+
+	# Abort up front rather than wait forever on a cycle
+	_waves(stages)
+
+	queue = multiprocessing.Queue()
+	running = {}
+	outcomes = {}
+	began = time.time()
+
+	def run(name):
+		# Like fabric's parallel mode, the parent's connections aren't shared
+		state.connections.clear()
+
+		try:
+			outcome = runner(name, stages[name][1])
+		except SystemExit:
+			# abort() has already said why
+			outcome = {'ok': False, 'seconds': 0.0, 'error': 'aborted'}
+		except BaseException as e:
+			outcome = {'ok': False, 'seconds': 0.0, 'error': str(e) or e.__class__.__name__}
+
+		queue.put((name, outcome))
+
+	while len(outcomes) < len(stages):
+		# A skipped stage can mean skipping the stages after it too
+		skipped = True
+
+		while skipped:
+			skipped = False
+
+			for name, (depends, work) in sorted(stages.items()):
+				if name in outcomes or name in running:
+					continue
+
+				depends = [d for d in depends if d in stages]
+				failed = [d for d in depends if d in outcomes and not outcomes[d]['ok']]
+
+				if failed:
+					skipped = True
+					outcomes[name] = {
+						'ok': False, 'seconds': 0.0, 'started': time.time() - began,
+						'error': 'skipped, %s failed' % ', '.join(failed),
+					}
+
+					if done is not None:
+						done(name, outcomes[name])
+
+				elif all([d in outcomes for d in depends]):
+					running[name] = (multiprocessing.Process(target=run, args=(name,)), time.time() - began)
+					running[name][0].start()
+
+		if not running:
+			continue
+
+		name, outcome = queue.get()
+		process, outcome['started'] = running.pop(name)
+		process.join()
+
+		outcomes[name] = outcome
+
+		if done is not None:
+			done(name, outcome)
+
+	return outcomes
+
+def _provision_host():
+	"""run the host's stages, worked out from its own vars"""
+
+	stages = _stages()
+
+	if stages is None:
+		print red('[%s] Unknown repository protocol!' % env.host_string)
+		return False
+
+	def done(name, outcome):
+		_record('stage', name, time.time() - outcome['seconds'], ok=outcome['ok'], changed=outcome.get('changed'))
+
+		if outcome['ok']:
+			print cyan('[%s] %s done in %.1fs' % (env.host_string, name, outcome['seconds']))
+		else:
+			print red('[%s] %s failed: %s' % (env.host_string, name, outcome['error']))
+
+	outcomes = _run_stages(stages, _run_stage, done)
+
+	_invalidate()
+
+	return outcomes
+
+def _report(results):
+	hosts = [outcomes for outcomes in results.values() if isinstance(outcomes, dict)]
+	names = set()
+
+	for outcomes in hosts:
+		names.update(outcomes)
+
+	def offset(name):
+		return _percentile([outcomes[name]['started'] for outcomes in hosts if name in outcomes], 50)
+
+	print cyan('%-14s %6s %6s %8s %8s %8s' % ('Stage', 'Hosts', 'Failed', 'Start', 'p50', 'Max'))
+
+	# In the order they started, so overlapping stages show up as such
+	for name in sorted(names, key=lambda name: (offset(name), name)):
+		outcomes = [host[name] for host in hosts if name in host]
+		seconds = [outcome['seconds'] for outcome in outcomes]
+
+		print '%-14s %6s %6s %7.1fs %7.1fs %7.1fs' % (
+			name, len(outcomes), len([o for o in outcomes if not o['ok']]),
+			offset(name), _percentile(seconds, 50) or 0, max(seconds or [0])
+		)
+
+def _plan():
+	"""the stages for the current host, each with what it waits for"""
+
+	stages = _stages()
+
+	if stages is None:
+		return None
+
+	return tuple([
+		(name, tuple([d for d in stages[name][0] if d in stages]))
+		for wave in _waves(stages) for name in wave
+	])
+
+@task
+@runs_once
+def plan():
+	"""show the provisioning stages & what each waits for, for each set of hosts they differ for"""
+
+	# Hosts' inventory vars can change their stages
+	plans = {}
+
+	for host in env.all_hosts or [env.host_string]:
+		with settings(host_string=host):
+			plans.setdefault(_with_host_vars(_plan)(), []).append(host)
+
+	for stages, hosts in sorted(plans.items(), key=lambda item: item[1]):
+		if len(plans) > 1:
+			print green('%s:' % ', '.join(hosts))
+
+		if stages is None:
+			print red('Unknown repository protocol!')
+			continue
+
+		for name, depends in stages:
+			print cyan('%-14s %s' % (name, 'after %s' % ', '.join(depends) if depends else 'at once'))
+
+@task(default=True)
+@runs_once
+def up(pool_size=None):
+	"""provision all hosts in parallel, overlapping independent stages"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_name', provided_by=('development', 'staging', 'production'))
+	require('project_repo', provided_by=('development', 'staging', 'production'))
+	require('project_url', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+	require('project_group', provided_by=('development', 'staging', 'production'))
+
+	# Catch broken configs before touching any host
+	_preflight('bootstrap')
+
+	# Build once before forking so every host ships the same release or tree
+	if _any_host('use_sync') and _local_manifest() is None:
+		return False
+
+	if _any_host('use_releases') and _build_release() is None:
+		return False
+
+	if _any_host('use_venv_images') and _requirements() is not None:
+		_build_venv_image()
+
+	if _any_host('use_wheels') and _requirements() is not None:
+		_build_wheels()
+
+	started = time.time()
+	results = _execute_parallel(_provision_host, env.all_hosts, int(pool_size) if pool_size else None)
+
+	_report(results)
+
+	failed = [
+		host for host, outcomes in results.items()
+		if not isinstance(outcomes, dict) or
+		[outcome for outcome in outcomes.values() if not outcome['ok']]
+	]
+
+	if failed:
+		print red('Provisioning failed on %s' % ', '.join(sorted(failed)))
+		return False
+
+	print green('%s hosts provisioned in %.1fs.' % (len(results), time.time() - started))
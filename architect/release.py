@@ -0,0 +1,143 @@
+"""Tools for switching between release directories"""
+
+import os.path
+
+from fabric.api import *
+from fabric.colors import red, cyan, green, yellow
+
+from architect.facts import invalidates
+from architect.instrument import sudo, task
+
+KEEP_RELEASES = 5
+
+def _releases_dir():
+	return os.path.join(env.home, 'releases')
+
+def _current_link():
+	return os.path.join(env.home, 'current')
+
+def _list_releases():
+	"""list the releases on this host, oldest first"""
+
+	with settings(hide('everything'), warn_only=True):
+		releases = sudo('ls -1 %s' % _releases_dir(), user=env.project_user)
+
+	if releases.failed:
+		return []
+
+	# Release ids start with a UTC timestamp so they sort chronologically
+	return sorted([r.strip() for r in releases.splitlines() if r.strip()])
+
+def _current_release():
+	"""get the release the current symlink points at"""
+
+	with settings(hide('everything'), warn_only=True):
+		target = sudo('readlink %s' % _current_link(), user=env.project_user)
+
+	if target.failed or not target.strip():
+		return None
+
+	return os.path.basename(target.strip().rstrip('/'))
+
+def _activate(release):
+	"""atomically point the current symlink at a release"""
+
+	release_dir = os.path.join(_releases_dir(), release)
+	tmp_link = '%s.%s' % (_current_link(), release)
+
+	# Build the new link beside the old one & rename it over the top, so
+	# current always resolves to a complete release
+	sudo('ln -sfn %s %s && mv -T %s %s' % (
+		release_dir, tmp_link, tmp_link, _current_link()
+	), user=env.project_user)
+
+def _cleanup(keep=None):
+	"""remove all but the newest releases, never removing the current one"""
+
+	keep = int(keep or getattr(env, 'keep_releases', KEEP_RELEASES))
+	releases = _list_releases()
+	current = _current_release()
+
+	old = [r for r in releases[:-keep] if r != current] if keep > 0 else []
+
+	if old:
+		with cd(_releases_dir()):
+			sudo('rm -rf %s' % ' '.join(old), user=env.project_user)
+
+	return old
+
+@task(default=True)
+def list():
+	"""list the releases on a host"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+
+	current = _current_release()
+
+	for release in _list_releases():
+		if release == current:
+			print green('* %s' % release)
+		else:
+			print cyan('  %s' % release)
+
+@task
+@invalidates
+def activate(release=None):
+	"""switch to a release, defaults to the newest"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+
+	releases = _list_releases()
+
+	if not releases:
+		print red('No releases found!')
+		return False
+
+	release = release or releases[-1]
+
+	if release not in releases:
+		print red('Unknown release "%s"!' % release)
+		return False
+
+	_activate(release)
+
+	print green('Release %s activated.' % release)
+
+@task
+@invalidates
+def rollback(release=None):
+	"""switch back to the previous release"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+
+	releases = _list_releases()
+	current = _current_release()
+
+	if release is None:
+		if current not in releases or releases.index(current) == 0:
+			print red('No previous release to roll back to!')
+			return False
+
+		release = releases[releases.index(current) - 1]
+
+	if release not in releases:
+		print red('Unknown release "%s"!' % release)
+		return False
+
+	_activate(release)
+
+	print yellow('Rolled back to release %s.' % release)
+
+@task
+def cleanup(keep=None):
+	"""remove old releases"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+
+	removed = _cleanup(keep)
+
+	print green('Removed %s old releases.' % len(removed))
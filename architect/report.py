@@ -0,0 +1,110 @@
+"""Reports on where the time went during a run"""
+
+import json
+import os.path
+import time
+
+from fabric.api import *
+from fabric.colors import cyan, green, red
+from fabric.decorators import task, runs_once
+
+from architect.instrument import RUN_ID, _entries
+
+TOP = 10
+
+# Runs whose summary has been printed
+_printed = set()
+
+def _load(run=None):
+	"""
+	records of a run, from env.report_file when set (it holds parallel runs too)
+
+	run is a run id, 'all' for every run in the file, or None for this run
+	(or the last one in the file, when this run hasn't recorded anything).
+	"""
+
+	report_file = getattr(env, 'report_file', None)
+
+	if report_file and os.path.exists(report_file):
+		with open(report_file) as f:
+			entries = [json.loads(line) for line in f if line.strip()]
+	else:
+		entries = list(_entries)
+
+	if run == 'all':
+		return entries
+
+	if run is None:
+		runs = [entry.get('run') for entry in entries]
+		run = RUN_ID if RUN_ID in runs else (runs[-1] if runs else None)
+
+	return [entry for entry in entries if entry.get('run') == run]
+
+def _slowest(entries, top):
+	return sorted(entries, key=lambda entry: -entry['seconds'])[:top]
+
+def _summary(entries, top):
+	"""print the slowest of the entries & the totals of their commands"""
+
+	_printed.update([entry.get('run') for entry in entries])
+
+	commands = [entry for entry in entries if entry['kind'] != 'task']
+
+	print cyan('%8s  %-8s  %-20s  %s' % ('Seconds', 'Kind', 'Host', 'Step'))
+
+	for entry in _slowest(entries, int(top)):
+		line = '%8.2f  %-8s  %-20s  %s' % (
+			entry['seconds'], entry['kind'], entry['host'] or 'local', entry['name'][:60]
+		)
+
+		print red(line) if entry.get('failed') else line
+
+	print cyan('%s commands, %.2fs, %s bytes sent, %s bytes received' % (
+		len(commands),
+		sum([entry['seconds'] for entry in commands]),
+		sum([entry.get('bytes_sent', 0) for entry in commands]),
+		sum([entry.get('bytes_received', 0) for entry in commands]),
+	))
+
+def _finish():
+	"""print the summary of this run as it ends, unless it already has been"""
+
+	if RUN_ID in _printed:
+		return
+
+	entries = _load(RUN_ID)
+
+	if entries:
+		_summary(entries, int(getattr(env, 'report_top', TOP)))
+
+@task(default=True)
+@runs_once
+def summary(top=TOP, run=None):
+	"""print the slowest tasks & commands of the run, run=<id>|all for others"""
+
+	entries = _load(run)
+
+	if not entries:
+		print red('Nothing recorded!')
+		return
+
+	_summary(entries, int(top))
+
+@task
+@runs_once
+def write(path='architect-report.json', run=None):
+	"""write the records of the run as JSON (or NDJSON for a .ndjson path)"""
+
+	entries = _load(run)
+
+	with open(path, 'w') as f:
+		if path.endswith('.ndjson'):
+			for entry in entries:
+				f.write(json.dumps(entry, sort_keys=True) + '\n')
+		else:
+			json.dump({
+				'generated': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+				'entries': entries,
+			}, f, indent=1, sort_keys=True, separators=(',', ': '))
+
+	print green('Report written to %s.' % path)
@@ -0,0 +1,216 @@
+"""Declarative resources, converged on a host in one round trip
+
+Each resource knows how to test whether the host already has it & how to
+put it right if not. converge() sends every test & fix as a single batch,
+so a host that is already set up is checked in one go & left untouched.
+"""
+
+from abc import ABCMeta, abstractmethod
+
+from fabric.api import *
+from fabric.colors import green, yellow
+
+from architect.batch import Batch
+from architect.facts import _invalidate
+from architect.ubuntu import _apt_get, _update
+
+CHANGED = '__architect_changed__'
+
+class Resource(object):
+	"""something a host should have, run as user (root by default)"""
+
+	__metaclass__ = ABCMeta
+
+	user = None
+
+	def __str__(self):
+		return '%s %s' % (self.__class__.__name__.lower(), self.name)
+
+	@abstractmethod
+	def check(self):
+		"""shell test that succeeds when the host already has the resource"""
+
+	@abstractmethod
+	def fix(self):
+		"""shell command that gives the host the resource"""
+
+	def step(self):
+		"""shell that runs the fix only if the check fails, saying so if it did"""
+
+		# Only the fix's output is kept, the marker says it ran
+		return 'if ( %s ) > /dev/null 2>&1; then true; else %s && echo %s; fi' % (
+			self.check(), self.fix(), CHANGED
+		)
+
+class User(Resource):
+	def __init__(self, name, home):
+		self.name = name
+		self.home = home
+
+	def check(self):
+		return 'id -u %s' % self.name
+
+	def fix(self):
+		return 'useradd -U -d %s %s' % (self.home, self.name)
+
+class Directory(Resource):
+	def __init__(self, name, owner=None, group=None, user=None):
+		self.name = name
+		self.owner = owner
+		self.group = group or owner
+		self.user = user
+
+	def check(self):
+		if self.owner is None:
+			return 'test -d %s' % self.name
+
+		return 'test -d %s && [ "$(stat -c %%U:%%G %s)" = "%s:%s" ]' % (
+			self.name, self.name, self.owner, self.group
+		)
+
+	def fix(self):
+		if self.owner is None:
+			return 'mkdir -p %s' % self.name
+
+		return 'mkdir -p %s && chown -R %s:%s %s' % (self.name, self.owner, self.group, self.name)
+
+class Virtualenv(Resource):
+	def __init__(self, name, user=None, args='--distribute'):
+		self.name = name
+		self.user = user
+		self.args = args
+
+	def check(self):
+		return 'test -x %s/bin/python' % self.name
+
+	def fix(self):
+		return 'virtualenv %s %s' % (self.args, self.name)
+
+class Key(Resource):
+	"""an ssh key pair"""
+
+	def __init__(self, name, user=None):
+		self.name = name
+		self.user = user
+
+	def check(self):
+		return 'test -f %s.pub' % self.name
+
+	def fix(self):
+		return 'ssh-keygen -q -t rsa -f %s -N ""' % self.name
+
+class Symlink(Resource):
+	def __init__(self, name, target, user=None):
+		self.name = name
+		self.target = target
+		self.user = user
+
+	def check(self):
+		return '[ "$(readlink %s)" = "%s" ]' % (self.name, self.target)
+
+	def fix(self):
+		return 'ln -sfn %s %s' % (self.target, self.name)
+
+class Copy(Resource):
+	"""a file with the same contents as source"""
+
+	def __init__(self, name, source, user=None):
+		self.name = name
+		self.source = source
+		self.user = user
+
+	def check(self):
+		return 'cmp -s %s %s' % (self.source, self.name)
+
+	def fix(self):
+		return 'cp %s %s' % (self.source, self.name)
+
+class Checkout(Resource):
+	"""a working copy of a git or hg repository"""
+
+	def __init__(self, name, repo, vcs='git', user=None):
+		self.name = name
+		self.repo = repo
+		self.vcs = vcs
+		self.user = user
+
+	def check(self):
+		return 'test -d %s/.%s' % (self.name, self.vcs)
+
+	def fix(self):
+		return '%s clone %s %s' % (self.vcs, self.repo, self.name)
+
+class Crontab(Resource):
+	"""a user's crontab, the same as the file at source"""
+
+	def __init__(self, name, source):
+		self.name = name
+		self.source = source
+
+	def check(self):
+		return 'crontab -u %s -l | cmp -s - %s' % (self.name, self.source)
+
+	def fix(self):
+		return 'crontab -u %s %s' % (self.name, self.source)
+
+class Requirements(Resource):
+	"""a requirements file installed into a virtualenv with pip"""
+
+	def __init__(self, name, venv, log=None, user=None):
+		self.name = name
+		self.venv = venv
+		self.log = log
+		self.user = user
+
+	def _stamp(self):
+		return '%s/.architect-requirements' % self.venv
+
+	def check(self):
+		return '[ "$(md5sum < %s)" = "$(cat %s)" ]' % (self.name, self._stamp())
+
+	def fix(self):
+		log = ' --log=%s' % self.log if self.log else ''
+
+		return '%s/bin/pip install -q -r %s%s && md5sum < %s > %s' % (
+			self.venv, self.name, log, self.name, self._stamp()
+		)
+
+class Package(Resource):
+	"""os packages installed with apt"""
+
+	def __init__(self, *names):
+		self.names = names
+		self.name = ' '.join(names)
+
+	def check(self):
+		return ' && '.join([
+			'dpkg-query -W -f \'${Status}\' %s | grep -q "ok installed"' % name for name in self.names
+		])
+
+	def fix(self):
+		return '%s && %s' % (_update(), _apt_get('install %s' % self.name))
+
+def converge(resources):
+	"""bring the host in line with the resources in order, returns those changed"""
+
+	steps = Batch()
+
+	for resource in resources:
+		steps.add(resource.step(), user=resource.user)
+
+	with hide('stdout'):
+		results = steps.run()
+
+	changed = []
+
+	for resource, result in zip(resources, results):
+		if result.endswith(CHANGED):
+			changed.append(resource)
+			print yellow('[%s] changed %s' % (env.host_string, resource))
+
+	if changed:
+		_invalidate()
+	else:
+		print green('[%s] nothing to change.' % env.host_string)
+
+	return changed
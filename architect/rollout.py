@@ -0,0 +1,111 @@
+"""Tools for rolling a task out across many hosts in batches"""
+
+import math
+import time
+
+from fabric.api import *
+from fabric.colors import red, green, yellow, cyan
+
+def _host_count(value, total):
+	"""convert a count ('25%' or '10') into a number of hosts"""
+
+	value = str(value).strip()
+
+	if value.endswith('%'):
+		return int(math.ceil(total * float(value[:-1]) / 100.0))
+
+	return int(value)
+
+def _batches(hosts, size):
+	"""split hosts into batches of the given size"""
+
+	step = max(1, min(_host_count(size, len(hosts)), len(hosts)))
+
+	return [hosts[i:i + step] for i in range(0, len(hosts), step)]
+
+def _timed(func, *args, **kwargs):
+	"""run func on the current host, capturing its outcome & timing"""
+
+	started = time.time()
+	error = None
+
+	try:
+		result = func(*args, **kwargs)
+	except SystemExit:
+		# abort() has already reported why, treat it as a failure of this host only
+		result = False
+		error = 'aborted'
+	except Exception as e:
+		result = False
+		error = str(e) or e.__class__.__name__
+
+	return {
+		'ok': result is not False and error is None,
+		'seconds': time.time() - started,
+		'error': error,
+	}
+
+def _rollout(hosts, executor, batch='25%', failures=0):
+	"""
+	roll out across hosts in batches, stopping once the failure budget is used
+
+	executor is called with each batch of hosts & must return a dict of
+	host -> outcome (as returned by _timed), this keeps the engine usable
+	with a fake executor & local stand-in hosts.
+	"""
+
+	budget = _host_count(failures, len(hosts))
+	results = {}
+	failed = 0
+
+	for number, batch_hosts in enumerate(_batches(hosts, batch), 1):
+		print cyan('Batch %s: %s' % (number, ', '.join(batch_hosts)))
+
+		for host, outcome in executor(batch_hosts).items():
+			# Anything other than an outcome dict means the executor itself failed
+			if not isinstance(outcome, dict):
+				outcome = {'ok': False, 'seconds': 0.0, 'error': str(outcome)}
+
+			results[host] = outcome
+
+			if not outcome['ok']:
+				failed += 1
+
+		if failed > budget:
+			print red('Failure budget of %s exceeded (%s failed), stopping rollout.' % (budget, failed))
+			break
+
+	for host in hosts:
+		if host not in results:
+			results[host] = {'ok': None, 'seconds': 0.0, 'error': 'skipped'}
+
+	return results
+
+def _summary(results):
+	"""print a per-host timing summary of a rollout"""
+
+	width = max([len(host) for host in results] + [4])
+
+	print cyan('%s  %-7s  %8s' % ('Host'.ljust(width), 'Status', 'Seconds'))
+
+	for host, outcome in sorted(results.items(), key=lambda item: -item[1]['seconds']):
+		if outcome['ok']:
+			status, colour = 'ok', green
+		elif outcome['ok'] is None:
+			status, colour = 'skipped', yellow
+		else:
+			status, colour = 'failed', red
+
+		line = '%s  %-7s  %8.2f' % (host.ljust(width), status, outcome['seconds'])
+
+		if outcome['error'] and outcome['ok'] is False:
+			line += '  %s' % outcome['error']
+
+		print colour(line)
+
+	ran = [outcome['seconds'] for outcome in results.values() if outcome['ok'] is not None]
+
+	if ran:
+		print cyan('%s hosts, slowest %.2fs, mean %.2fs' % (
+			len(ran), max(ran), sum(ran) / len(ran)
+		))
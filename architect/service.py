@@ -0,0 +1,148 @@
+"""Generate the uwsgi config & its upstart or systemd service for each host
+
+uwsgi is sized from the host's facts: env.uwsgi_workers_per_cpu processes
+per core (2 by default) with env.uwsgi_threads threads each (4), capped so
+the workers fit in three quarters of the memory at env.uwsgi_worker_memory
+MB each (256), which is also where a worker gets recycled.
+"""
+
+import os.path
+
+from cStringIO import StringIO
+
+from fabric.api import *
+from fabric.colors import cyan, green, yellow
+
+from architect.facts import _facts, invalidates
+from architect.instrument import put, sudo, task
+from architect.utils import _boolean, _get_app_dir, _get_uwsgi_socket, _get_venv_bin, _template
+
+WORKERS_PER_CPU = 2
+THREADS = 4
+
+# MB a worker can grow to before it is recycled
+WORKER_MEMORY = 256
+
+def _ini_path():
+	return os.path.join(env.home, 'etc', 'uwsgi.ini')
+
+def _init_system(facts):
+	return getattr(env, 'init_system', None) or ('systemd' if facts.get('init') == 'systemd' else 'upstart')
+
+def _unit_path(init):
+	if init == 'systemd':
+		return '/etc/systemd/system/%s.service' % env.project_name
+
+	return '/etc/init/%s.conf' % env.project_name
+
+def _sizing(facts):
+	"""uwsgi processes, threads & listen queue for the host's cores & memory"""
+
+	cpus = facts.get('cpus') or 1
+	memory = (facts.get('memory') or 1024 ** 3) // 1024 ** 2
+	worker_memory = int(getattr(env, 'uwsgi_worker_memory', WORKER_MEMORY))
+	threads = int(getattr(env, 'uwsgi_threads', THREADS))
+
+	processes = cpus * int(getattr(env, 'uwsgi_workers_per_cpu', WORKERS_PER_CPU))
+	processes = max(1, min(processes, memory * 3 // 4 // worker_memory))
+
+	# Room to queue a burst for every thread, the kernel caps it at somaxconn
+	listen = min(max(128, processes * threads * 16), facts.get('somaxconn') or 128)
+
+	return {
+		'cpus': cpus,
+		'memory': memory,
+		'processes': processes,
+		'threads': threads,
+		'listen': listen,
+		'reload_on_rss': worker_memory,
+	}
+
+def _ini(facts):
+	context = _sizing(facts)
+	context.update({
+		'project_name': env.project_name,
+		'project_user': env.project_user,
+		'project_group': getattr(env, 'project_group', env.project_user),
+		'home': env.home,
+		'app_dir': _get_app_dir(env),
+		'venv': os.path.dirname(_get_venv_bin(env)),
+		'module': getattr(env, 'wsgi_module', '%s.wsgi' % env.project_name),
+		'socket_option': 'http-socket' if getattr(env, 'uwsgi_http', False) else 'socket',
+		'socket': _get_uwsgi_socket(env),
+		'lazy_apps': 'true' if getattr(env, 'uwsgi_reload', 'chain') == 'chain' else 'false',
+		'max_requests': getattr(env, 'uwsgi_max_requests', 5000),
+		'harakiri': getattr(env, 'uwsgi_timeout', 60),
+	})
+
+	return _template('uwsgi.ini') % context
+
+def _unit(init):
+	return _template('systemd.service' if init == 'systemd' else 'upstart.conf') % {
+		'project_name': env.project_name,
+		'uwsgi': getattr(env, 'uwsgi_bin', None) or os.path.join(_get_venv_bin(env), 'uwsgi'),
+		'ini': _ini_path(),
+	}
+
+def _install_file(content, path):
+	"""put a generated file in place, returns False if it hadn't changed"""
+
+	remote_file = '/tmp/%s' % path.strip('/').replace('/', '_')
+
+	put(StringIO(content), remote_file, mode=0644)
+
+	with hide('stdout'):
+		result = sudo('if cmp -s %(tmp)s %(path)s; then rm -f %(tmp)s; echo unchanged; '
+			'else mkdir -p %(dir)s && mv %(tmp)s %(path)s; fi' % {
+				'tmp': remote_file,
+				'path': path,
+				'dir': os.path.dirname(path),
+			})
+
+	return result.strip() != 'unchanged'
+
+def _install_service():
+	"""install the uwsgi config & service for this host, returns True if either changed"""
+
+	facts = _facts()
+	init = _init_system(facts)
+
+	ini_changed = _install_file(_ini(facts), _ini_path())
+	unit_changed = _install_file(_unit(init), _unit_path(init))
+
+	if unit_changed and init == 'systemd':
+		sudo('systemctl daemon-reload && systemctl enable %s' % env.project_name)
+
+	if ini_changed:
+		print yellow('[%s] uwsgi config changed, reload to apply it.' % env.host_string)
+
+	return ini_changed or unit_changed
+
+def _service(action):
+	"""command to start, stop or restart the app with the host's init system"""
+
+	if _init_system(_facts()) == 'systemd':
+		return 'systemctl %s %s' % (action, env.project_name)
+
+	return '%s %s' % (action, env.project_name)
+
+@task(default=True)
+@invalidates
+def install(show=False):
+	"""generate & install the uwsgi config & service, sized for the host"""
+
+	require('host', provided_by=('development', 'staging', 'production'))
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_name', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+
+	if _boolean(show):
+		facts = _facts()
+		print cyan(_ini(facts))
+		print cyan(_unit(_init_system(facts)))
+		return
+
+	if _install_service():
+		print green('Service installed.')
+	else:
+		print yellow('Service unchanged.')
@@ -0,0 +1,267 @@
+"""Build static assets once, fingerprinted & precompressed, & push what changed
+
+The assets in env.static_root (static/ by default, after running the
+env.static_collect command if set, eg. collectstatic) are built into
+.architect/static/build. Each file is kept under its own name & a copy
+named with a hash of its contents (app.css -> app.3f2a9c1d0b7e.css), with
+staticfiles.json mapping one to the other in the layout django's
+ManifestStaticFilesStorage reads. Compressible files get .gz (& .br, when
+the brotli module is installed) versions beside them for nginx to serve.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import tarfile
+import time
+
+from cStringIO import StringIO
+
+from fabric.api import *
+from fabric.colors import red, cyan, green, yellow
+
+from architect.artifact import MANIFEST_NAME, _digest
+from architect.instrument import put, run, runs_once, sudo, task
+from architect.sync import _diff, _remote_manifest
+from architect.utils import _boolean, _execute_parallel, _local_path
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+COMPRESS = ('.css', '.js', '.svg', '.html', '.json', '.txt', '.xml', '.map', '.ico', '.eot', '.ttf', '.otf')
+
+HASH_LENGTH = 12
+
+STATIC_MANIFEST = 'staticfiles.json'
+
+NGINX_SNIPPET = """location %(url)s {
+	alias %(root)s/;
+	gzip_static on;%(brotli)s
+	expires 1h;
+
+	# Hashed names change with their contents, so they can be cached for good
+	location ~ "\\.[0-9a-f]{%(length)s}\\.\\w+$" {
+		expires max;
+		add_header Cache-Control "public, immutable";
+	}
+}
+"""
+
+# The build is only done once per run
+_built = {}
+
+def _build_dir():
+	return _local_path('static', 'build')
+
+def _static_dir():
+	return os.path.join(env.home, 'static')
+
+def _snippet_path():
+	return '/etc/nginx/snippets/%s-static.conf' % env.project_url
+
+def _hashed_name(path, digest):
+	base, ext = os.path.splitext(path)
+	return '%s.%s%s' % (base, digest[:HASH_LENGTH], ext)
+
+def _compress(path):
+	"""write .gz (& .br) versions of a file beside it, if they're any smaller"""
+
+	if os.path.splitext(path)[1].lower() not in COMPRESS:
+		return
+
+	with open(path, 'rb') as f:
+		data = f.read()
+
+	# No timestamp in the header, so unchanged files give unchanged .gz files
+	buf = StringIO()
+	archive = gzip.GzipFile(filename='', mode='wb', fileobj=buf, compresslevel=9, mtime=0)
+	archive.write(data)
+	archive.close()
+
+	versions = [('.gz', buf.getvalue())]
+
+	if brotli is not None:
+		versions.append(('.br', brotli.compress(data)))
+
+	for suffix, compressed in versions:
+		if len(compressed) < len(data):
+			with open(path + suffix, 'wb') as f:
+				f.write(compressed)
+
+def _build():
+	"""build the assets, returns a manifest of the build"""
+
+	if _built:
+		return _built
+
+	if getattr(env, 'static_collect', None):
+		local(env.static_collect)
+
+	source = getattr(env, 'static_root', 'static')
+
+	if not os.path.isdir(source):
+		abort('No static files found in %s!' % source)
+
+	build = _build_dir()
+	shutil.rmtree(build, ignore_errors=True)
+
+	paths = {}
+
+	for root, dirs, files in os.walk(source):
+		for name in files:
+			# Compressed versions are made fresh below
+			if name.endswith('.gz') or name.endswith('.br'):
+				continue
+
+			path = os.path.join(root, name)
+			relative = os.path.relpath(path, source)
+			paths[relative] = _hashed_name(relative, _digest(path))
+
+			for target in (relative, paths[relative]):
+				target = os.path.join(build, target)
+
+				if not os.path.isdir(os.path.dirname(target)):
+					os.makedirs(os.path.dirname(target))
+
+				shutil.copy2(path, target)
+				_compress(target)
+
+	with open(os.path.join(build, STATIC_MANIFEST), 'w') as f:
+		json.dump({'paths': paths, 'version': '1.0'}, f, indent=1, sort_keys=True)
+
+	for root, dirs, files in os.walk(build):
+		for name in files:
+			path = os.path.join(root, name)
+			_built[os.path.relpath(path, build)] = _digest(path)
+
+	return _built
+
+def _pack(manifest, changed):
+	"""pack the changed files & new manifest, returns the local path"""
+
+	sha = hashlib.sha1()
+	sha.update(json.dumps([manifest, changed], sort_keys=True))
+	path = _local_path('static', '%s.tar.gz' % sha.hexdigest()[:16])
+
+	# Hosts with the same assets share the same delta
+	if os.path.exists(path):
+		return path
+
+	archive = tarfile.open(path, 'w:gz')
+
+	try:
+		for p in changed:
+			archive.add(os.path.join(_build_dir(), p), p, recursive=False)
+
+		data = json.dumps({'files': manifest}, sort_keys=True)
+		info = tarfile.TarInfo(MANIFEST_NAME)
+		info.size = len(data)
+		info.mtime = time.time()
+		archive.addfile(info, StringIO(data))
+	finally:
+		archive.close()
+
+	return path
+
+def _nginx_snippet():
+	return NGINX_SNIPPET % {
+		'url': getattr(env, 'static_url', '/static/'),
+		'root': _static_dir(),
+		'brotli': '\n\tbrotli_static on;' if getattr(env, 'nginx_brotli', False) else '',
+		'length': HASH_LENGTH,
+	}
+
+def _push_snippet():
+	"""install the nginx snippet for the assets, reloading nginx if it changed"""
+
+	remote_snippet = '/tmp/%s-static.conf' % env.project_url
+
+	put(StringIO(_nginx_snippet()), remote_snippet, mode=0644)
+
+	# A snippet nginx won't take is swapped back for the one it replaced (kept
+	# out of the snippets dir, which may all be included), so the config
+	# nginx loads next is still good
+	sudo('if cmp -s %(tmp)s %(path)s; then rm -f %(tmp)s; else '
+		'mkdir -p %(dir)s && rm -f %(previous)s && { [ ! -f %(path)s ] || cp -p %(path)s %(previous)s; } && '
+		'mv %(tmp)s %(path)s && '
+		'if /etc/init.d/nginx configtest; then rm -f %(previous)s; /etc/init.d/nginx reload; '
+		'else if [ -f %(previous)s ]; then mv %(previous)s %(path)s; else rm -f %(path)s; fi; exit 1; fi; fi' % {
+			'tmp': remote_snippet,
+			'previous': '%s.previous' % remote_snippet,
+			'path': _snippet_path(),
+			'dir': os.path.dirname(_snippet_path()),
+		})
+
+def _push(manifest, prune=False):
+	"""send this host the assets it doesn't have yet"""
+
+	changed, stale = _diff(manifest, _remote_manifest(_static_dir()))
+
+	# Old hashed files are left for pages still pointing at them unless pruning,
+	# which can only see the files of the last push in the host's manifest
+	if not _boolean(prune):
+		stale = []
+
+	if changed:
+		delta = _pack(manifest, changed)
+		remote_delta = '/tmp/%s' % os.path.basename(delta)
+
+		put(delta, remote_delta, mode=0644)
+
+		sudo('mkdir -p %s && tar xzf %s -C %s' % (_static_dir(), remote_delta, _static_dir()), user=env.project_user)
+		run('rm -f %s' % remote_delta)
+
+	if stale:
+		with cd(_static_dir()):
+			sudo('rm -f -- %s' % ' '.join(stale), user=env.project_user)
+
+	_push_snippet()
+
+	print cyan('[%s] %s assets sent, %s removed.' % (env.host_string, len(changed), len(stale)))
+
+@task
+@runs_once
+def build():
+	"""build the static assets once, hashed & compressed"""
+
+	manifest = _build()
+
+	print green('%s static files built%s.' % (
+		len(manifest), '' if brotli is not None else ' (no brotli module, gzip only)'
+	))
+
+@task(default=True)
+@runs_once
+def push(pool_size=None, prune=False):
+	"""send changed static assets to all hosts in parallel, prune=true removes those the last push left stale"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+	require('project_url', provided_by=('development', 'staging', 'production'))
+
+	manifest = _build()
+
+	results = _execute_parallel(_push, env.all_hosts, int(pool_size) if pool_size else None, manifest, prune)
+
+	failed = [host for host, result in results.items() if isinstance(result, BaseException)]
+
+	if failed:
+		print red('Static push failed on %s' % ', '.join(sorted(failed)))
+		return False
+
+	print green('Static assets pushed.')
+
+@task
+@runs_once
+def nginx():
+	"""show the nginx config for the static assets"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+
+	print cyan(_nginx_snippet())
+	print yellow('Include it in the site with: include %s;' % _snippet_path())
@@ -0,0 +1,136 @@
+"""The state of every host at once, in one round trip to each
+
+Each host gets its probes as one batch, with every probe (& the connection)
+limited to env.status_timeout seconds, & all hosts are probed in parallel,
+so checking the fleet takes about as long as the slowest host.
+"""
+
+import json
+import pipes
+import time
+
+from fabric.api import *
+from fabric.colors import red, cyan, green
+
+from architect.batch import Batch
+from architect.facts import _probes as _fact_probes
+from architect.health import _curl, _health_url
+from architect.instrument import runs_once, task
+from architect.utils import _execute_parallel
+
+TIMEOUT = 5
+
+COLUMNS = ('nginx', 'uwsgi', 'revision', 'disk', 'load', 'health')
+
+def _probes(timeout):
+	"""the command for each column"""
+
+	uwsgi = 'pgrep -c -x uwsgi'
+
+	if getattr(env, 'project_user', None):
+		uwsgi = 'pgrep -c -x -u %s uwsgi' % env.project_user
+
+	return {
+		'nginx': 'pgrep -x nginx > /dev/null && echo up',
+		# Count the master & workers, pgrep fails when there are none
+		'uwsgi': uwsgi,
+		'revision': _fact_probes().get('revision', 'false'),
+		'disk': "df -P %s | awk 'NR == 2 { print $5 }'" % env.home,
+		'load': "cut -d ' ' -f 1-3 /proc/loadavg",
+		'health': _curl(_health_url(), timeout),
+	}
+
+def _status(timeout):
+	"""probe the current host, returns a row for the table"""
+
+	started = time.time()
+	probes = _probes(timeout)
+	steps = Batch()
+
+	for name in COLUMNS:
+		steps.add('timeout %s sh -c %s 2>/dev/null' % (timeout, pipes.quote(probes[name])), warn_only=True)
+
+	with hide('everything'):
+		results = steps.run()
+
+	row = dict([
+		(name, result.strip() if result.succeeded and result.strip() else None)
+		for name, result in zip(COLUMNS, results)
+	])
+
+	try:
+		status, seconds = row['health'].split()
+		row['health'] = int(status)
+		row['health_seconds'] = float(seconds)
+	except (AttributeError, ValueError):
+		row['health'] = None
+		row['health_seconds'] = None
+
+	row['uwsgi'] = int(row['uwsgi']) if row['uwsgi'] else 0
+	row['ok'] = bool(row['nginx'] and row['uwsgi'] and row['health'] and 200 <= row['health'] < 300)
+	row['seconds'] = time.time() - started
+
+	return row
+
+def _print_table(rows):
+	width = max([len(host) for host in rows] + [4])
+
+	print cyan('%s  %-5s  %5s  %-12s  %4s  %-14s  %-12s' % (
+		'Host'.ljust(width), 'nginx', 'uwsgi', 'Revision', 'Disk', 'Load', 'Health'
+	))
+
+	for host, row in sorted(rows.items()):
+		if row.get('error'):
+			print red('%s  %s' % (host.ljust(width), row['error']))
+			continue
+
+		health = 'down'
+
+		if row['health']:
+			health = '%s %.0fms' % (row['health'], row['health_seconds'] * 1000)
+
+		line = '%s  %-5s  %5s  %-12s  %4s  %-14s  %-12s' % (
+			host.ljust(width), row['nginx'] or 'down', row['uwsgi'] or 'down',
+			(row['revision'] or '-')[:12], row['disk'] or '-', row['load'] or '-', health
+		)
+
+		print line if row['ok'] else red(line)
+
+@task(default=True)
+@runs_once
+def show(format='table', timeout=None, pool_size=None):
+	"""nginx, uwsgi, revision, disk, load & health of every host, format=table|json"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+
+	if format not in ('table', 'json'):
+		abort('Unknown format "%s", use table or json.' % format)
+
+	timeout = int(timeout or getattr(env, 'status_timeout', TIMEOUT))
+	started = time.time()
+
+	# A host that can't be reached is reported rather than stopping the rest
+	with settings(hide('running'), warn_only=True, skip_bad_hosts=True, timeout=timeout, connection_attempts=1):
+		results = _execute_parallel(_status, env.all_hosts, int(pool_size) if pool_size else None, timeout)
+
+	rows = {}
+
+	for host, row in results.items():
+		if not isinstance(row, dict):
+			row = {'ok': False, 'error': 'unreachable' if row is None else str(row) or row.__class__.__name__}
+
+		rows[host] = row
+
+	if format == 'json':
+		print json.dumps(rows, indent=1, sort_keys=True)
+	else:
+		_print_table(rows)
+
+	unhealthy = len([row for row in rows.values() if not row['ok']])
+
+	if format == 'table':
+		colour = red if unhealthy else green
+		print colour('%s hosts in %.1fs, %s unhealthy.' % (len(rows), time.time() - started, unhealthy))
+
+	if unhealthy:
+		return False
@@ -0,0 +1,164 @@
+"""Sync the application tree by sending only the files that changed"""
+
+import hashlib
+import json
+import os.path
+import tarfile
+import time
+
+from cStringIO import StringIO
+
+from fabric.api import *
+from fabric.colors import red, cyan, green, yellow
+
+from architect.artifact import MANIFEST_NAME, _manifest, _revision, _tracked_files, _vcs
+from architect.facts import invalidates
+from architect.instrument import put, run, sudo, task
+from architect.release import _activate, _cleanup, _current_link, _releases_dir
+from architect.utils import _get_app_dir, _local_path
+
+STALE_NAME = '.architect-stale'
+
+# The local manifest is only worked out once per run
+_local = {}
+
+def _local_manifest():
+	"""manifest of the local working copy"""
+
+	if not _local:
+		vcs = _vcs()
+
+		if vcs is None:
+			return None
+
+		revision = _revision(vcs)
+
+		_local.update({
+			'release': '%s-%s' % (time.strftime('%Y%m%d%H%M%S', time.gmtime()), revision),
+			'revision': revision,
+			'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+			'files': _manifest(_tracked_files(vcs)),
+		})
+
+	return _local
+
+def _remote_manifest(path):
+	"""manifest left on the host by the last sync or release"""
+
+	with settings(hide('everything'), warn_only=True):
+		manifest = sudo('cat %s' % os.path.join(path, MANIFEST_NAME), user=env.project_user)
+
+	if manifest.failed:
+		return {}
+
+	try:
+		return json.loads(manifest).get('files', {})
+	except ValueError:
+		return {}
+
+def _diff(local_files, remote_files):
+	"""work out which files need sending & which need deleting"""
+
+	changed = sorted([p for p, digest in local_files.items() if remote_files.get(p) != digest])
+	stale = sorted([p for p in remote_files if p not in local_files])
+
+	return changed, stale
+
+def _delta(manifest, changed, stale):
+	"""pack the changed files, stale list & new manifest, returns the local path"""
+
+	sha = hashlib.sha1()
+	sha.update(json.dumps([manifest['files'], changed, stale], sort_keys=True))
+	path = _local_path('deltas', '%s.tar.gz' % sha.hexdigest()[:16])
+
+	# Hosts on the same base revision share the same delta
+	if os.path.exists(path):
+		return path
+
+	# Hosts synced in parallel can pack the same delta at once, so each packs
+	# its own & moves it into place whole
+	packing = '%s.%s' % (path, os.getpid())
+	archive = tarfile.open(packing, 'w:gz')
+
+	try:
+		for p in changed:
+			archive.add(p, recursive=False)
+
+		for name, data in (
+			(MANIFEST_NAME, json.dumps(manifest, indent=1, sort_keys=True, separators=(',', ': '))),
+			(STALE_NAME, '\0'.join(stale)),
+		):
+			info = tarfile.TarInfo(name)
+			info.size = len(data)
+			info.mtime = time.time()
+			archive.addfile(info, StringIO(data))
+	finally:
+		archive.close()
+
+	os.rename(packing, path)
+
+	return path
+
+def _sync():
+	"""bring this host's application tree in line with the local working copy"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+
+	manifest = _local_manifest()
+
+	if manifest is None:
+		print red('No git or hg working copy found!')
+		return False
+
+	releases = getattr(env, 'use_releases', False)
+
+	if releases:
+		base = _current_link()
+		target = os.path.join(_releases_dir(), manifest['release'])
+	else:
+		base = target = _get_app_dir(env)
+
+	remote = _remote_manifest(base)
+	changed, stale = _diff(manifest['files'], remote)
+
+	if not changed and not stale:
+		print yellow('Already up to date.')
+		return
+
+	print cyan('Sending %s changed files, removing %s.' % (len(changed), len(stale)))
+
+	delta = _delta(manifest, changed, stale)
+	remote_delta = '/tmp/%s' % os.path.basename(delta)
+
+	put(delta, remote_delta, mode=0644)
+
+	if releases:
+		# Start the new release as a hard linked copy of the current one, tar
+		# replaces changed files rather than writing through the links
+		sudo('mkdir -p %s && (test ! -e %s || cp -al %s/. %s)' % (
+			target, base, base, target
+		), user=env.project_user)
+
+	elif not remote:
+		# The first sync to a host has no tree to unpack into yet
+		sudo('mkdir -p %s' % target, user=env.project_user)
+
+	with cd(target):
+		sudo('tar xzf %s && xargs -0 -r rm -f -- < %s && rm -f %s' % (
+			remote_delta, STALE_NAME, STALE_NAME
+		), user=env.project_user)
+
+	run('rm -f %s' % remote_delta)
+
+	if releases:
+		_activate(manifest['release'])
+		_cleanup()
+
+@task(default=True)
+@invalidates
+def push():
+	"""sync the application tree with the local working copy"""
+
+	if _sync() is not False:
+		print green('Application synced.')
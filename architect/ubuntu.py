@@ -1,12 +1,58 @@
 """Tools for working with ubuntu"""
 
+import re
+
 from fabric.api import *
 from fabric.colors import red, blue, green
 from fabric.contrib.console import confirm
-from fabric.decorators import task
 
 import yaml
 
+from architect.facts import _facts, _invalidate, invalidates
+from architect.instrument import run, sudo, task
+from architect.utils import _boolean, _get_app_dir
+
+# Seconds the package index is trusted for before apt-get update runs again
+APT_TTL = 86400
+
+UPDATE_STAMP = '/var/lib/apt/architect-update-stamp'
+
+def _apt_get(command):
+	"""a non-interactive apt-get, through env.apt_proxy (eg. apt-cacher-ng) if set"""
+	
+	options = ''
+	
+	if getattr(env, 'apt_proxy', None):
+		options = ' -o Acquire::http::Proxy=%s' % env.apt_proxy
+	
+	return 'DEBIAN_FRONTEND=noninteractive apt-get -q -y%s %s' % (options, command)
+
+def _update(force=False):
+	"""apt-get update, skipped on the host while the index is fresher than env.apt_ttl"""
+	
+	update = '%s && touch %s' % (_apt_get('update'), UPDATE_STAMP)
+	
+	if force:
+		return update
+	
+	return '[ $(( $(date +%%s) - $(stat -c %%Y %s 2>/dev/null || echo 0) )) -lt %s ] || { %s; }' % (
+		UPDATE_STAMP, int(getattr(env, 'apt_ttl', APT_TTL)), update
+	)
+
+def _install(packages):
+	"""install whichever packages the host is missing in one transaction"""
+	
+	installed = _facts().get('packages') or {}
+	missing = [package for package in packages if package not in installed]
+	
+	if missing:
+		try:
+			sudo('%s && %s' % (_update(), _apt_get('install %s' % ' '.join(missing))))
+		finally:
+			_invalidate()
+	
+	return missing
+
 @task
 def build():
 	"""build os packages for app using apt-get"""
@@ -14,22 +60,19 @@ def build():
 	require('host', provided_by=('development', 'staging', 'production'))
 	require('home', provided_by=('development', 'staging', 'production'))
 	
-	packages = []
+	packages = _facts().get('build_conf')
 	
-	with cd(os.path.join(env.home, env.project_name)):
-		with hide('stdout'):
-			packages = sudo('cat etc/build.conf')
-		
 	if packages:
 		try:
-			build = yaml.load(packages)
+			build = yaml.safe_load(packages)
 		except Exception:
 			print red('Unable to read build config!')
 			return
-		
-		if packages.has_key('install'):
-			sudo('apt-get install %s' % ' '.join(packages['install']))
-		
+	
+		if isinstance(build, dict) and build.get('install'):
+			installed = _install(build['install'])
+			print blue('%s packages installed.' % len(installed))
+	
 	print green('Packages Built.')
 
 @task
@@ -41,29 +84,30 @@ def install(mods=None):
 	if not mods:
 		print red('Please specify a module to install!')
 		return
-		
-	sudo('apt-get install %s' % mods)
-		
+	
+	installed = _install(re.split(r'[\s,]+', mods.strip()))
+	
+	print blue('%s packages installed.' % len(installed))
 	print green('Packages Installed.')
 
 @task
-def update(mods=[]):
-	"""upgrade os packages using apt-get"""
+def update(force=True):
+	"""update the package index using apt-get"""
 	
 	require('host', provided_by=('development', 'staging', 'production'))
 	
-	sudo('apt-get update')
+	sudo(_update(_boolean(force)))
 	
-	print green('Upgraded.')
+	print green('Updated.')
 
 @task
+@invalidates
 def upgrade(mods=[]):
 	"""upgrade os packages using apt-get"""
 	
 	require('host', provided_by=('development', 'staging', 'production'))
 	
-	sudo('apt-get update')
-	sudo('apt-get upgrade')
+	# Keep changed config files rather than stopping to ask
+	sudo('%s && %s' % (_update(), _apt_get('-o Dpkg::Options::=--force-confold upgrade')))
 	
 	print green('Upgraded.')
-	
\ No newline at end of file
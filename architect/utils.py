@@ -1,9 +1,87 @@
+import math
 import os.path
 
+from functools import wraps
+
+from fabric.api import env, execute, parallel, settings
+
 def _get_venv_bin(env):
+	# Prebuilt virtualenv images are switched in behind env.home/venv
+	if getattr(env, 'use_venv_images', False):
+		return os.path.join(env.home, 'venv', 'bin')
+
 	# Try to find the virtual environment
 	if hasattr(env, 'venv'):
 		return os.path.join(env.venv, 'bin')
 
 	# Assume the cwd is a virtualenv
-	return os.path.join(env.home, 'bin')
\ No newline at end of file
+	return os.path.join(env.home, 'bin')
+
+def _get_uwsgi_socket(env):
+	# Where uwsgi listens & nginx passes requests to
+	return getattr(env, 'uwsgi_socket', None) or os.path.join(env.home, 'tmp', 'uwsgi.sock')
+
+def _host_vars(env):
+	# Variables the inventory gives the current host
+	host_vars = getattr(env, 'host_vars', None) or {}
+
+	return host_vars.get(env.host_string) or host_vars.get(env.host) or {}
+
+def _with_host_vars(func):
+	# Run func with the inventory's vars for the host it's run on, the one
+	# place they're set in env
+	@wraps(func)
+	def on_host(*args, **kwargs):
+		with settings(**_host_vars(env)):
+			return func(*args, **kwargs)
+
+	return on_host
+
+def _host_setting(host, key, default=None):
+	# A setting as it will be on a host, for checks made once for every host
+	host_vars = (getattr(env, 'host_vars', None) or {}).get(host) or {}
+
+	return host_vars.get(key, env.get(key, default))
+
+def _any_host(key, hosts=None):
+	# Whether a setting is on for any of the hosts
+	return bool([host for host in (env.all_hosts if hosts is None else hosts) if _host_setting(host, key)])
+
+def _execute_parallel(func, hosts, pool_size=None, *args, **kwargs):
+	# Run func on each of the hosts at once, at most pool_size at a time
+	return execute(parallel(pool_size=pool_size)(_with_host_vars(func)), hosts=hosts, *args, **kwargs)
+
+def _local_path(*parts):
+	# Local working state (artifacts, caches) lives in .architect beside the project
+	path = os.path.join('.architect', *parts)
+
+	if not os.path.isdir(os.path.dirname(path)):
+		os.makedirs(os.path.dirname(path))
+
+	return path
+
+def _get_app_dir(env):
+	# With the releases layout the app is served from whichever release is current
+	if getattr(env, 'use_releases', False):
+		return os.path.join(env.home, 'current')
+
+	return os.path.join(env.home, env.project_name)
+
+def _percentile(values, percent):
+	# Nearest rank percentile of a list of numbers
+	if not values:
+		return None
+
+	values = sorted(values)
+	rank = int(math.ceil(len(values) * float(percent) / 100.0))
+
+	return values[max(0, min(rank, len(values)) - 1)]
+
+def _boolean(value):
+	# Task arguments arrive from the command line as strings
+	return str(value).lower() in ('1', 'true', 'yes', 'y', 'on')
+
+def _template(name):
+	# Config templates shipped with architect
+	with open(os.path.join(os.path.dirname(__file__), 'templates', name)) as f:
+		return f.read()
@@ -0,0 +1,151 @@
+"""Build the virtualenv once as an image & unpack it on every host
+
+With env.use_venv_images set, the virtualenv is built on one host
+(env.venv_build_host, or the first host) matching the others' OS & packed
+up as .architect/venvs/<key>.tar.gz, keyed on the requirements. Hosts
+unpack it into env.home/venvs/<key> & switch the env.home/venv symlink to
+it. Images are built at the same path they are unpacked to, so the
+scripts' #! lines & the virtualenv's own paths hold on every host.
+"""
+
+import hashlib
+import os.path
+
+from fabric.api import *
+from fabric.colors import cyan, green, yellow
+
+from architect.artifact import _digest
+from architect.facts import invalidates
+from architect.instrument import get, put, run, runs_once, sudo, task
+from architect.utils import _local_path
+from architect.wheels import _requirements
+
+# Images kept on a host, the current one & the one before to switch back to
+KEEP_IMAGES = 2
+
+def _images_dir():
+	return os.path.join(env.home, 'venvs')
+
+def _venv_link():
+	return os.path.join(env.home, 'venv')
+
+def _image_key():
+	"""content address of the requirements & the interpreter they're built for"""
+
+	sha = hashlib.sha1()
+
+	with open(_requirements(), 'rb') as f:
+		sha.update(f.read())
+
+	sha.update(getattr(env, 'venv_python', 'python'))
+
+	return sha.hexdigest()[:16]
+
+def _image_path(key):
+	return _local_path('venvs', '%s.tar.gz' % key)
+
+def _build_image(key):
+	"""build the virtualenv on this host & pull the image back"""
+
+	dest = os.path.join(_images_dir(), key)
+	remote_requirements = '/tmp/venv-%s.txt' % key
+	remote_tar = '/tmp/venv-%s.tar.gz' % key
+
+	put(_requirements(), remote_requirements, mode=0644)
+
+	sudo('rm -rf %(dest)s && mkdir -p %(images)s && virtualenv -q -p %(python)s %(dest)s && '
+		'%(dest)s/bin/pip install -q -r %(requirements)s && tar czf %(tar)s -C %(dest)s .' % {
+			'dest': dest,
+			'images': _images_dir(),
+			'python': getattr(env, 'venv_python', 'python'),
+			'requirements': remote_requirements,
+			'tar': remote_tar,
+		}, user=env.project_user)
+
+	get(remote_tar, _image_path(key))
+
+	run('rm -f %s %s' % (remote_tar, remote_requirements))
+
+def _install_image():
+	"""unpack the image on this host & switch to it, returns False if it was already in use"""
+
+	key = _image_key()
+
+	with settings(hide('everything'), warn_only=True):
+		current = run('readlink %s' % _venv_link())
+
+	if os.path.basename(current.strip()) == key:
+		print yellow('[%s] Virtualenv image %s already in use.' % (env.host_string, key))
+		return False
+
+	if not os.path.exists(_image_path(key)):
+		abort('No virtualenv image %s, run venvs.build first.' % key)
+
+	dest = os.path.join(_images_dir(), key)
+	remote_tar = '/tmp/venv-%s.tar.gz' % key
+
+	put(_image_path(key), remote_tar, mode=0644)
+
+	# Check the upload, unpack it, then switch the link over in one rename
+	sudo('echo "%(digest)s  %(tar)s" | sha1sum -c --quiet && '
+		'rm -rf %(dest)s && mkdir -p %(dest)s && tar xzf %(tar)s -C %(dest)s && touch %(dest)s && '
+		'ln -sfn %(dest)s %(link)s.%(key)s && mv -T %(link)s.%(key)s %(link)s && '
+		'cd %(images)s && ls -1t | tail -n +%(keep)s | xargs -r rm -rf' % {
+			'digest': _digest(_image_path(key)),
+			'tar': remote_tar,
+			'dest': dest,
+			'link': _venv_link(),
+			'key': key,
+			'images': _images_dir(),
+			'keep': int(getattr(env, 'keep_venv_images', KEEP_IMAGES)) + 1,
+		}, user=env.project_user)
+
+	run('rm -f %s' % remote_tar)
+
+	print green('[%s] Virtualenv image %s installed.' % (env.host_string, key))
+
+	return True
+
+@runs_once
+def _build():
+	"""build the image once per run, if it isn't already built, returns its key"""
+
+	if _requirements() is None:
+		abort('No requirements to build a virtualenv image from!')
+
+	key = _image_key()
+
+	if os.path.exists(_image_path(key)):
+		print yellow('Virtualenv image %s already built.' % key)
+		return key
+
+	build_host = getattr(env, 'venv_build_host', None) or env.all_hosts[0]
+
+	print cyan('Building virtualenv image %s on %s.' % (key, build_host))
+
+	execute(_build_image, key, hosts=[build_host])
+
+	print green('Virtualenv image %s built.' % key)
+
+	return key
+
+@task
+@runs_once
+def build():
+	"""build the virtualenv image on the build host, if it isn't already built"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+
+	return _build()
+
+@task(default=True)
+@invalidates
+def install():
+	"""install the virtualenv image on a host"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+
+	_build()
+	_install_image()
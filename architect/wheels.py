@@ -0,0 +1,225 @@
+"""Build pip requirements into wheels once & install them from a local wheelhouse"""
+
+import fcntl
+import hashlib
+import os.path
+
+from fabric.api import *
+from fabric.colors import cyan, green, yellow
+
+from architect.facts import invalidates
+from architect.instrument import get, put, run, runs_once, sudo, task
+from architect.utils import _boolean, _get_app_dir, _get_venv_bin, _local_path, _with_host_vars
+
+# Describes the interpreter ABI of the remote virtualenv, wheels built for
+# one ABI can't be installed into another
+ABI_SCRIPT = "import sys, sysconfig; print('-'.join(['.'.join(map(str, sys.version_info[:2])), str(sys.maxunicode), sysconfig.get_platform()]))"
+
+def _requirements():
+	"""find the local requirements file, requirements.txt wins over etc/pip.conf"""
+
+	for requirements in ('requirements.txt', 'etc/pip.conf'):
+		if os.path.exists(requirements):
+			return requirements
+
+	return None
+
+def _wheelhouse():
+	return os.path.join(env.home, 'wheelhouse')
+
+def _stamp():
+	return os.path.join(_wheelhouse(), 'installed')
+
+def _probe(requirements):
+	"""
+	get the remote interpreter ABI, the sha1 of the remote requirements file
+	& the key of the last install in one go
+	"""
+
+	python = os.path.join(_get_venv_bin(env), 'python')
+
+	# Each probe prints a line, if only an empty one, so they stay in order
+	with settings(hide('everything'), warn_only=True):
+		probe = run('%s -c "%s" || echo; { sha1sum %s 2>/dev/null || echo; } | cut -d " " -f 1; cat %s 2>/dev/null; true' % (
+			python, ABI_SCRIPT, requirements, _stamp()
+		))
+
+	lines = probe.splitlines() + ['', '', '']
+
+	return lines[0].strip(), lines[1].strip(), lines[2].strip()
+
+def _key(digest, abi):
+	"""content address of a requirements file (by its sha1) built for an ABI"""
+
+	sha = hashlib.sha1()
+	sha.update(digest)
+	sha.update(abi)
+
+	return sha.hexdigest()[:16]
+
+def _remote_key(requirements):
+	"""
+	the key of the requirements file on this host & of the last install,
+	hashed there as that's the file pip installs from
+	"""
+
+	abi, digest, installed = _probe(requirements)
+
+	if not digest:
+		abort('No %s on %s, deploy the code first!' % (requirements, env.host_string))
+
+	return abi, _key(digest, abi), installed
+
+def _cached(key):
+	return _local_path('wheels', '%s.tar.gz' % key)
+
+def _pull(remote_tar, cached):
+	"""get the built wheels into the local cache, whole or not at all"""
+
+	partial = '%s.%s' % (cached, os.getpid())
+
+	get(remote_tar, partial)
+	os.rename(partial, cached)
+
+def _build(pip, requirements, wheels, cached):
+	"""build the wheels on this host & pull them back into the local cache"""
+
+	remote_tar = '/tmp/wheels-%s' % os.path.basename(cached)
+
+	sudo('%s install -q wheel' % pip, user=env.project_user)
+	sudo('%s wheel -q -w %s -r %s' % (pip, wheels, requirements), user=env.project_user)
+	sudo('tar czf %s -C %s .' % (remote_tar, wheels), user=env.project_user)
+
+	_pull(remote_tar, cached)
+
+	sudo('rm -f %s' % remote_tar, user=env.project_user)
+
+def _build_local():
+	"""
+	build wheels for the local requirements file on this host, in a throwaway
+	virtualenv so the host needn't be set up yet, returns their key
+	"""
+
+	requirements = _requirements()
+	python = getattr(env, 'venv_python', 'python')
+	build_dir = '/tmp/wheels-build-%s' % os.getpid()
+
+	put(requirements, '%s.txt' % build_dir, mode=0644)
+
+	with settings(hide('everything')):
+		abi = sudo('rm -rf %(dir)s && virtualenv -q -p %(python)s %(dir)s/venv > /dev/null && %(dir)s/venv/bin/python -c "%(abi)s"' % {
+			'dir': build_dir,
+			'python': python,
+			'abi': ABI_SCRIPT,
+		}, user=env.project_user).strip()
+
+	# The same key the hosts work out from the file once it's deployed
+	with open(requirements, 'rb') as f:
+		key = _key(hashlib.sha1(f.read()).hexdigest(), abi)
+
+	if os.path.exists(_cached(key)):
+		print yellow('Wheels %s already built.' % key)
+	else:
+		pip = os.path.join(build_dir, 'venv', 'bin', 'pip')
+		_build(pip, '%s.txt' % build_dir, os.path.join(build_dir, 'wheels'), _cached(key))
+
+	sudo('rm -rf %s %s.txt' % (build_dir, build_dir), user=env.project_user)
+
+	return key
+
+@runs_once
+def _build_once():
+	"""build the wheels once per run, before the hosts install them, returns their key"""
+
+	if _requirements() is None:
+		return None
+
+	build_host = getattr(env, 'wheels_build_host', None) or env.all_hosts[0]
+
+	print cyan('Building wheels on %s.' % build_host)
+
+	return execute(_with_host_vars(_build_local), hosts=[build_host])[build_host]
+
+def _push(cached, wheels):
+	"""upload & unpack cached wheels on this host"""
+
+	remote_tar = '/tmp/wheels-%s' % os.path.basename(cached)
+
+	put(cached, remote_tar, mode=0644)
+
+	sudo('mkdir -p %s && tar xzf %s -C %s' % (wheels, remote_tar, wheels), user=env.project_user)
+	run('rm -f %s' % remote_tar)
+
+def _install(requirements, force=False):
+	"""install requirements from the wheelhouse, returns False if nothing changed"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+
+	pip = os.path.join(_get_venv_bin(env), 'pip')
+	remote_requirements = os.path.join(_get_app_dir(env), requirements)
+
+	abi, key, installed = _remote_key(remote_requirements)
+
+	if installed == key and not force:
+		print yellow('Requirements unchanged (%s), skipping pip.' % key)
+		return False
+
+	wheels = os.path.join(_wheelhouse(), key)
+	cached = _cached(key)
+
+	if os.path.exists(cached):
+		_push(cached, wheels)
+	else:
+		# Hosts installing at once (forked by fab -P or provision) build it
+		# once between them, the rest wait to use it
+		with open('%s.lock' % cached, 'w') as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+
+			if os.path.exists(cached):
+				_push(cached, wheels)
+			else:
+				print cyan('No wheels cached for %s (%s), building.' % (key, abi))
+				_build(pip, remote_requirements, wheels, cached)
+
+	sudo('%s install -q --no-index --find-links=%s -r %s --log=%s' % (
+		pip,
+		wheels,
+		remote_requirements,
+		os.path.join(env.home, 'logs', 'pip.log')
+	), user=env.project_user)
+
+	# Remember what was installed so an unchanged requirements file skips pip
+	sudo('echo %s > %s' % (key, _stamp()), user=env.project_user)
+
+	return True
+
+@task
+@runs_once
+def build():
+	"""build wheels for the local requirements on the build host into the local cache"""
+
+	require('home', provided_by=('development', 'staging', 'production'))
+	require('project_user', provided_by=('development', 'staging', 'production'))
+
+	if _requirements() is None:
+		print yellow('No requirements to build!')
+		return
+
+	print green('Wheels %s built.' % _build_once())
+
+@task(default=True)
+@invalidates
+def install(force=False):
+	"""install the requirements from the wheelhouse"""
+
+	requirements = _requirements()
+
+	if requirements is None:
+		print yellow('No requirements to install!')
+		return
+
+	_build_once()
+
+	if _install(requirements, force=_boolean(force)):
+		print green('Wheels installed.')
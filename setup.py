@@ -25,8 +25,9 @@ setup(
 		'Programming Language :: Python',
 		'Topic :: Internet :: WWW/HTTP :: Dynamic Content',
 	],
-	zip_safe=True,
+	zip_safe=False,
 	packages=find_packages(exclude=['tests',]),
+	package_data={'architect': ['templates/*']},
 	install_requires=[
 		'Fabric>=1.3',
 		'pyyaml==3.10'
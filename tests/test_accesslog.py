@@ -0,0 +1,137 @@
+import calendar
+import time
+import unittest
+
+from architect import accesslog
+
+LINE = '10.0.0.1 - - [%s] "GET /orders/1234?page=2 HTTP/1.1" %s 512 "-" "curl/7.68" %s\n'
+
+def _local_time(epoch, offset_minutes):
+	"""an nginx $time_local for epoch on a host offset_minutes from UTC"""
+
+	local = time.gmtime(epoch + offset_minutes * 60)
+	sign = '-' if offset_minutes < 0 else '+'
+
+	return '%s %s%02d%02d' % (
+		time.strftime('%d/%b/%Y:%H:%M:%S', local), sign, abs(offset_minutes) // 60, abs(offset_minutes) % 60
+	)
+
+class TimestampTest(unittest.TestCase):
+	def test_utc(self):
+		self.assertEqual(
+			accesslog._timestamp('10/Oct/2026:13:55:36 +0000'),
+			calendar.timegm((2026, 10, 10, 13, 55, 36))
+		)
+
+	def test_offsets_are_taken_back_to_utc(self):
+		utc = calendar.timegm((2026, 10, 10, 13, 55, 36))
+
+		self.assertEqual(accesslog._timestamp('10/Oct/2026:08:55:36 -0500'), utc)
+		self.assertEqual(accesslog._timestamp('10/Oct/2026:19:25:36 +0530'), utc)
+
+	def test_offset_can_cross_midnight(self):
+		self.assertEqual(
+			accesslog._timestamp('09/Oct/2026:23:30:00 -0500'),
+			calendar.timegm((2026, 10, 10, 4, 30, 0))
+		)
+
+	def test_bad_offset(self):
+		self.assertRaises(ValueError, accesslog._timestamp, '10/Oct/2026:13:55:36 EST')
+
+class StatsTest(unittest.TestCase):
+	def test_line(self):
+		stats = accesslog.Stats()
+
+		self.assertTrue(stats.add(LINE % ('10/Oct/2026:13:55:36 +0000', 200, '0.120')))
+		self.assertTrue(stats.add(LINE % ('10/Oct/2026:13:55:37 +0000', 502, '0.002')))
+
+		# Ids in the path are folded into one endpoint
+		summary = stats.summary('GET /orders/:id')
+
+		self.assertEqual(summary['count'], 2)
+		self.assertEqual(summary['status'], {'2xx': 1, '5xx': 1})
+		self.assertEqual(summary['errors'], 0.5)
+		self.assertTrue(0.12 <= summary['p95'] < 0.12 * 1.25)
+
+	def test_unparsable_lines(self):
+		stats = accesslog.Stats()
+
+		self.assertFalse(stats.add('not an access log line\n'))
+		self.assertFalse(stats.add(LINE % ('yesterday', 200, '0.1')))
+		self.assertEqual(stats.endpoints, {})
+
+	def test_window_on_a_host_behind_utc(self):
+		now = time.time()
+		stats = accesslog.Stats()
+
+		# Written just now on a UTC-5 host, seen from a minute ago
+		stats.add(LINE % (_local_time(now, -300), 200, '0.010'), since=now - 60)
+		# An hour old, outside the window
+		stats.add(LINE % (_local_time(now - 3600, -300), 200, '0.010'), since=now - 60)
+
+		self.assertEqual(stats.total().summary('(all)')['count'], 1)
+
+	def test_window_on_a_host_ahead_of_utc(self):
+		now = time.time()
+		stats = accesslog.Stats()
+
+		# Written just now on a UTC+9 host, up to a minute from now
+		stats.add(LINE % (_local_time(now, 540), 200, '0.010'), until=now + 60)
+		stats.add(LINE % (_local_time(now, 540), 200, '0.010'), until=now - 60)
+
+		self.assertEqual(stats.total().summary('(all)')['count'], 1)
+
+	def test_merge_through_dicts(self):
+		stats = accesslog.Stats()
+		stats.add(LINE % ('10/Oct/2026:13:55:36 +0000', 200, '0.120'))
+
+		merged = accesslog.Stats()
+		merged.merge(accesslog.Stats.from_dict(stats.to_dict()))
+		merged.merge(accesslog.Stats.from_dict(stats.to_dict()))
+
+		self.assertEqual(merged.summary('GET /orders/:id')['count'], 2)
+		self.assertEqual(merged.first, stats.first)
+
+class WindowTest(unittest.TestCase):
+	"""lines of any of the logs filtered by time"""
+
+	def window(self, lines, since=None, until=None):
+		return list(accesslog.window(lines, since, until))
+
+	def test_nginx_lines_with_an_offset(self):
+		now = time.time()
+		lines = [
+			LINE % (_local_time(now - 3600, -300), 200, '0.010'),
+			LINE % (_local_time(now, -300), 200, '0.010'),
+		]
+
+		self.assertEqual(self.window(lines, since=now - 60), lines[1:])
+		self.assertEqual(self.window(lines, until=now - 60), lines[:1])
+
+	def test_uwsgi_request_lines(self):
+		now = time.time()
+		lines = [
+			'[pid: 12|app: 0|req: 1/1] 10.0.0.1 () {34 vars} [%s] GET / => generated 2 bytes\n' % (
+				time.strftime('%a %b %d %H:%M:%S %Y', time.localtime(when))
+			)
+			for when in (now - 3600, now)
+		]
+
+		self.assertEqual(self.window(lines, since=now - 60), lines[1:])
+
+	def test_lines_without_a_time_go_with_the_line_before(self):
+		now = time.time()
+		stamp = lambda when: time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when))
+		lines = [
+			'no time yet\n',
+			'%s,120 ERROR old\n' % stamp(now - 3600),
+			'Traceback (most recent call last):\n',
+			'%s,120 ERROR new\n' % stamp(now),
+			'Traceback (most recent call last):\n',
+		]
+
+		self.assertEqual(self.window(lines, since=now - 60), lines[3:])
+		self.assertEqual(self.window(lines, until=now - 60), lines[1:3])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from architect.batch import MARKER, Batch
+
+def _steps(*commands):
+	return [{'command': command, 'user': None, 'warn_only': False} for command in commands]
+
+class ScriptTest(unittest.TestCase):
+	def test_stops_on_error(self):
+		steps = Batch()
+		steps.add('true')
+		steps.add('false', warn_only=True)
+
+		script = steps._script(steps.steps)
+
+		self.assertEqual(script.count('|| exit $rc'), 1)
+		self.assertTrue('"%s 1 $rc"' % MARKER in script)
+
+	def test_user_switch_needs_root(self):
+		self.assertRaises(ValueError, Batch(user='shop').add, 'true', user='www-data')
+
+		steps = Batch()
+		steps.add('whoami', user='shop')
+
+		self.assertTrue(steps._script(steps.steps).startswith('( sudo -H -u shop /bin/sh -c whoami )'))
+
+class ParseTest(unittest.TestCase):
+	def test_output_per_step(self):
+		output = '\n'.join([
+			'one', 'two', '', '%s 0 0' % MARKER,
+			'', '%s 1 0' % MARKER,
+			'three', '', '%s 2 1' % MARKER,
+		])
+
+		results = Batch()._parse(output, _steps('a', 'b', 'c'))
+
+		self.assertEqual(results, ['one\ntwo', '', 'three'])
+		self.assertEqual([result.command for result in results], ['a', 'b', 'c'])
+		self.assertEqual([result.return_code for result in results], [0, 0, 1])
+		self.assertEqual([result.failed for result in results], [False, False, True])
+
+	def test_steps_after_a_failure_are_missing(self):
+		output = 'oops\n\n%s 0 2\n' % MARKER
+
+		results = Batch()._parse(output, _steps('a', 'b'))
+
+		self.assertEqual(len(results), 1)
+		self.assertEqual(results[0].return_code, 2)
+
+	def test_output_after_the_last_marker_is_dropped(self):
+		results = Batch()._parse('\n%s 0 0\nsudo noise' % MARKER, _steps('a'))
+
+		self.assertEqual(results, [''])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,109 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from cStringIO import StringIO
+
+from architect import accesslog, canary
+
+LINE = '10.0.0.1 - - [%s] "GET /health HTTP/1.1" %s 2 "-" "curl/7.68" %s\n'
+
+def _local_time(epoch, offset_minutes):
+	local = time.gmtime(epoch + offset_minutes * 60)
+	sign = '-' if offset_minutes < 0 else '+'
+
+	return '%s %s%02d%02d' % (
+		time.strftime('%d/%b/%Y:%H:%M:%S', local), sign, abs(offset_minutes) // 60, abs(offset_minutes) % 60
+	)
+
+def _health(seconds, failed=0):
+	return [(True, s) for s in seconds] + [(False, 5.0)] * failed
+
+class VerdictTest(unittest.TestCase):
+	def setUp(self):
+		self.stdout, sys.stdout = sys.stdout, StringIO()
+
+	def tearDown(self):
+		sys.stdout = self.stdout
+
+	def verdict(self, canary_health, baseline_health, threshold=1.5, errors=0.01):
+		return canary._verdict(
+			canary._measure([{'health': canary_health, 'log': None}]),
+			canary._measure([{'health': baseline_health, 'log': None}]),
+			threshold, errors
+		)
+
+	def test_same_latency_passes(self):
+		self.assertEqual(self.verdict(_health([0.1] * 20), _health([0.1] * 20)), [])
+
+	def test_slower_p95_fails(self):
+		reasons = self.verdict(_health([0.3] * 20), _health([0.1] * 20))
+
+		self.assertEqual(len(reasons), 1)
+		self.assertTrue(reasons[0].startswith('health p95'))
+
+	def test_small_differences_are_noise(self):
+		# 3x slower, but only by 4ms
+		self.assertEqual(self.verdict(_health([0.006] * 20), _health([0.002] * 20)), [])
+
+	def test_more_errors_fails(self):
+		reasons = self.verdict(_health([0.1] * 18, failed=2), _health([0.1] * 20))
+
+		self.assertEqual(reasons, ['health errors 10.0% vs 0.0%'])
+
+	def test_no_successful_requests_fails(self):
+		reasons = self.verdict(_health([], failed=5), _health([0.1] * 20))
+
+		self.assertTrue('health got no successful requests' in reasons)
+
+	def test_unreachable_host_counts_as_a_failure(self):
+		measures = canary._measure([Exception('unreachable')])
+
+		self.assertEqual(measures['health']['errors'], 1.0)
+
+class AccessLogWindowTest(unittest.TestCase):
+	"""the canary's access log window on hosts that aren't on UTC"""
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.stdout, sys.stdout = sys.stdout, StringIO()
+
+	def tearDown(self):
+		sys.stdout = self.stdout
+		shutil.rmtree(self.dir)
+
+	def sample(self, offset_minutes, latency, started):
+		path = os.path.join(self.dir, 'access-%s.log' % latency)
+
+		with open(path, 'w') as f:
+			# Before the window, then during it
+			f.write(LINE % (_local_time(started - 600, offset_minutes), 200, '9.000'))
+
+			for i in range(20):
+				f.write(LINE % (_local_time(started + 1, offset_minutes), 200, latency))
+
+		# What _sample gets back from running accesslog on the host
+		return {'health': [], 'log': accesslog.collect([path], started).to_dict()}
+
+	def test_window_holds_the_requests_made_during_it(self):
+		started = time.time()
+		measures = canary._measure([self.sample(-300, '0.050', started)])
+
+		self.assertEqual(measures['access log']['count'], 20)
+		self.assertTrue(measures['access log']['p95'] < 0.1)
+
+	def test_regression_found_across_offsets(self):
+		started = time.time()
+		canary_measures = canary._measure([self.sample(-300, '0.400', started)])
+		baseline = canary._measure([self.sample(330, '0.050', started)])
+
+		reasons = canary._verdict(canary_measures, baseline, 1.5, 0.01)
+
+		self.assertEqual(len(reasons), 1)
+		self.assertTrue(reasons[0].startswith('access log p95'))
+
+if __name__ == '__main__':
+	unittest.main()
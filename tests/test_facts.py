@@ -0,0 +1,44 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from fabric.api import settings
+
+from architect import facts
+from architect.artifact import MANIFEST_NAME
+
+class RevisionProbeTest(unittest.TestCase):
+	"""the revision of a tree without a working copy"""
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.release = os.path.join(self.dir, '20261018100000-abc1234')
+
+		os.mkdir(self.release)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def probe(self):
+		with settings(home=self.dir, project_name=os.path.basename(self.release)):
+			command = facts._probes()['revision']
+
+		process = subprocess.Popen(['/bin/sh', '-c', command], stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'))
+		output = process.communicate()[0].strip()
+
+		return output if process.returncode == 0 else None
+
+	def test_from_the_manifest(self):
+		with open(os.path.join(self.release, MANIFEST_NAME), 'w') as f:
+			json.dump({'release': 'r', 'revision': 'def5678', 'files': {}}, f, indent=1, sort_keys=True, separators=(',', ': '))
+
+		self.assertEqual(self.probe(), 'def5678')
+
+	def test_not_from_the_directory_name(self):
+		self.assertEqual(self.probe(), None)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,132 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from cStringIO import StringIO
+
+from fabric.api import env
+
+from architect import inventory
+
+INVENTORY = """
+vars:
+  project_name: shop
+  released: 2026-10-18
+groups:
+  web:
+    vars: {uwsgi_threads: 8}
+    hosts:
+      web1.example.com: {tags: [eu]}
+      web2.example.com: {tags: [us], uwsgi_threads: 16}
+  db:
+    hosts: [db1.example.com, db9.example.com]
+  worker:
+    vars: {deployed: 2026-10-18 10:00:00}
+    hosts:
+      worker1.example.com: {tags: [eu]}
+"""
+
+INDEX = inventory._index({
+	'vars': {'project_name': 'shop'},
+	'groups': {
+		'web': {
+			'vars': {'uwsgi_threads': 8},
+			'hosts': {
+				'web1.example.com': {'tags': ['eu']},
+				'web2.example.com': {'tags': ['us'], 'uwsgi_threads': 16},
+			},
+		},
+		'db': {'hosts': ['db1.example.com', 'db9.example.com']},
+		'worker': {'hosts': {'worker1.example.com': {'tags': ['eu'], 'uwsgi_threads': 2}}},
+		# A host in two groups has the vars of both
+		'batch': {'vars': {'queue': 'batch'}, 'hosts': ['worker1.example.com']},
+	},
+})
+
+class IndexTest(unittest.TestCase):
+	def test_vars(self):
+		self.assertEqual(INDEX['hosts']['web1.example.com'], {'project_name': 'shop', 'uwsgi_threads': 8})
+		self.assertEqual(INDEX['hosts']['db1.example.com'], {'project_name': 'shop'})
+
+	def test_own_vars_win(self):
+		self.assertEqual(INDEX['hosts']['web2.example.com']['uwsgi_threads'], 16)
+		self.assertEqual(INDEX['hosts']['worker1.example.com'], {
+			'project_name': 'shop', 'uwsgi_threads': 2, 'queue': 'batch',
+		})
+
+	def test_tags(self):
+		self.assertEqual(INDEX['tags'], {'eu': ['web1.example.com', 'worker1.example.com'], 'us': ['web2.example.com']})
+
+class SelectTest(unittest.TestCase):
+	def setUp(self):
+		self.stderr, sys.stderr = sys.stderr, StringIO()
+
+	def tearDown(self):
+		sys.stderr = self.stderr
+
+	def select(self, *selectors):
+		return inventory._select(INDEX, selectors)
+
+	def test_group(self):
+		self.assertEqual(self.select('web'), ['web1.example.com', 'web2.example.com'])
+
+	def test_tag(self):
+		self.assertEqual(self.select('@eu'), ['web1.example.com', 'worker1.example.com'])
+
+	def test_host_and_pattern(self):
+		self.assertEqual(self.select('web2.example.com'), ['web2.example.com'])
+		self.assertEqual(self.select('db*'), ['db1.example.com', 'db9.example.com'])
+
+	def test_any_selector_matches(self):
+		self.assertEqual(self.select('web', 'db1*'), ['db1.example.com', 'web1.example.com', 'web2.example.com'])
+
+	def test_leaving_out(self):
+		self.assertEqual(self.select('db', '~db9*'), ['db1.example.com'])
+		self.assertEqual(self.select('@eu', '~web'), ['worker1.example.com'])
+
+	def test_only_leaving_out_starts_from_every_host(self):
+		self.assertEqual(self.select('~web', '~db'), ['worker1.example.com'])
+
+	def test_nothing_matches(self):
+		self.assertRaises(SystemExit, self.select, 'mail*')
+		self.assertRaises(SystemExit, self.select, '@asia')
+
+class LoadTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.cwd = os.getcwd()
+		self.inventory = env.get('inventory')
+
+		os.chdir(self.dir)
+		env.inventory = os.path.join(self.dir, 'inventory.yml')
+		inventory._loaded.clear()
+
+		with open(env.inventory, 'w') as f:
+			f.write(INVENTORY)
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		env.inventory = self.inventory
+		inventory._loaded.clear()
+		shutil.rmtree(self.dir)
+
+	def test_cached_index_is_the_same(self):
+		index = inventory._load()
+
+		self.assertTrue(os.path.exists(os.path.join('.architect', 'inventory.json')))
+
+		# As the next run would see it
+		inventory._loaded.clear()
+
+		self.assertEqual(inventory._load(), index)
+
+	def test_dates_are_kept_as_written(self):
+		index = inventory._load()
+
+		self.assertEqual(index['vars']['released'], '2026-10-18')
+		self.assertEqual(index['hosts']['worker1.example.com']['deployed'], '2026-10-18 10:00:00')
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,64 @@
+import calendar
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from architect import accesslog, logs
+
+class EpochTest(unittest.TestCase):
+	def test_ago(self):
+		self.assertTrue(abs(logs._epoch('15m') - (time.time() - 900)) < 5)
+
+	def test_utc_time(self):
+		self.assertEqual(logs._epoch('2026-10-18T09:30'), calendar.timegm((2026, 10, 18, 9, 30, 0)))
+		self.assertEqual(logs._epoch('2026-10-18 09:30:15'), calendar.timegm((2026, 10, 18, 9, 30, 15)))
+
+	def test_epoch(self):
+		self.assertEqual(logs._epoch('1792000000'), 1792000000.0)
+		self.assertEqual(logs._epoch(None), None)
+
+class FilterTest(unittest.TestCase):
+	"""the pipeline filtering a log on the host, run here"""
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.script = logs.SCRIPT
+
+		# The script as _put_script would leave it on the host
+		logs.SCRIPT = os.path.join(self.dir, 'accesslog.py')
+		shutil.copy(accesslog.__file__.replace('.pyc', '.py'), logs.SCRIPT)
+
+	def tearDown(self):
+		logs.SCRIPT = self.script
+		shutil.rmtree(self.dir)
+
+	def filter(self, lines, **kwargs):
+		path = os.path.join(self.dir, 'app.log')
+
+		with open(path, 'w') as f:
+			f.writelines(lines)
+
+		process = subprocess.Popen(['/bin/sh', '-c', 'cat %s%s' % (path, logs._filter(**kwargs))], stdout=subprocess.PIPE)
+
+		return process.communicate()[0].splitlines(True)
+
+	def test_time_and_level(self):
+		now = time.time()
+		stamp = lambda when: time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when))
+		lines = [
+			'%s ERROR old\n' % stamp(now - 3600),
+			'%s INFO new\n' % stamp(now),
+			'%s ERROR new\n' % stamp(now),
+		]
+
+		self.assertEqual(self.filter(lines, since=now - 60), lines[1:])
+		self.assertEqual(self.filter(lines, level='error', since=now - 60), lines[2:])
+
+	def test_nothing_matching_isnt_a_failure(self):
+		self.assertEqual(self.filter(['2026-10-18 09:30:00 INFO x\n'], pattern='nothing'), [])
+
+if __name__ == '__main__':
+	unittest.main()
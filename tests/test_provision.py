@@ -0,0 +1,148 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from cStringIO import StringIO
+
+from fabric.api import settings
+
+from architect import provision
+
+ENV = {
+	'home': '/srv/shop',
+	'project_name': 'shop',
+	'project_user': 'shop',
+	'project_group': 'shop',
+	'project_repo': 'git://example.com/shop.git',
+	'project_url': 'shop.example.com',
+}
+
+def _stages(**depends):
+	return dict([(name, (tuple(after), [])) for name, after in depends.items()])
+
+class WavesTest(unittest.TestCase):
+	def test_waves(self):
+		stages = _stages(
+			structure=[], packages=[], virtualenv=['structure'], code=['structure'],
+			requirements=['virtualenv', 'code', 'packages'], configs=['code'],
+		)
+
+		self.assertEqual(provision._waves(stages), [
+			['packages', 'structure'],
+			['code', 'virtualenv'],
+			['configs', 'requirements'],
+		])
+
+	def test_missing_stages_are_not_waited_on(self):
+		self.assertEqual(provision._waves(_stages(requirements=['packages'])), [['requirements']])
+
+	def test_cycle(self):
+		self.stderr, sys.stderr = sys.stderr, StringIO()
+
+		try:
+			self.assertRaises(SystemExit, provision._waves, _stages(a=['b'], b=['a'], c=[]))
+		finally:
+			sys.stderr = self.stderr
+
+class StagesTest(unittest.TestCase):
+	"""the stages of a new host, from the project's etc/"""
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.cwd = os.getcwd()
+
+		os.chdir(self.dir)
+		os.mkdir('etc')
+
+		# nginx & uwsgi installed from the packages
+		with open('etc/build.conf', 'w') as f:
+			f.write('install: [nginx, uwsgi]\n')
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		shutil.rmtree(self.dir)
+
+	def waits_on(self):
+		"""the stages each stage waits on, directly or not"""
+
+		with settings(**ENV):
+			stages = provision._stages()
+
+		waits_on = {}
+
+		# The waves have each stage's dependencies in order before it
+		for wave in provision._waves(stages):
+			for name in wave:
+				waits_on[name] = set()
+
+				for depends in stages[name][0]:
+					if depends in stages:
+						waits_on[name].update(waits_on[depends] | set([depends]))
+
+		return waits_on
+
+	def test_generated_configs_wait_for_the_packages(self):
+		waits_on = self.waits_on()
+
+		self.assertTrue('packages' in waits_on['nginx'])
+		self.assertTrue('packages' in waits_on['service'])
+
+	def test_hand_written_configs_wait_for_the_packages(self):
+		for name in ('nginx', 'upstart'):
+			with open('etc/%s.conf' % name, 'w') as f:
+				f.write('# %s\n' % name)
+
+		waits_on = self.waits_on()
+
+		self.assertFalse('nginx' in waits_on)
+		self.assertTrue('packages' in waits_on['configs'])
+
+	def test_synced_trees_are_not_checked_out(self):
+		with settings(use_sync=True, **ENV):
+			stages = provision._stages()
+
+		self.assertEqual(stages['code'][1], provision._sync)
+
+class RunStagesTest(unittest.TestCase):
+	def runner(self, seconds, failing=()):
+		"""stands in for running a stage on the host, sleeping for its seconds"""
+
+		def runner(name, work):
+			time.sleep(seconds.get(name, 0))
+
+			if name in failing:
+				raise Exception('%s broke' % name)
+
+			return {'ok': True, 'seconds': seconds.get(name, 0), 'error': None}
+
+		return runner
+
+	def test_stages_start_once_their_dependencies_are_done(self):
+		stages = _stages(slow=[], quick=[], after_quick=['quick'], after_both=['slow', 'quick'])
+		outcomes = provision._run_stages(stages, self.runner({'slow': 0.5}))
+
+		self.assertTrue(all([outcome['ok'] for outcome in outcomes.values()]))
+
+		# Not held back by the slow stage it doesn't depend on
+		self.assertTrue(outcomes['after_quick']['started'] < 0.4)
+		self.assertTrue(outcomes['after_both']['started'] >= 0.5)
+
+	def test_dependents_of_a_failure_are_skipped(self):
+		stages = _stages(a=[], b=['a'], c=['b'], d=[])
+		finished = []
+
+		outcomes = provision._run_stages(
+			stages, self.runner({}, failing=['a']), lambda name, outcome: finished.append(name)
+		)
+
+		self.assertEqual(outcomes['a']['error'], 'a broke')
+		self.assertEqual(outcomes['b']['error'], 'skipped, a failed')
+		self.assertEqual(outcomes['c']['error'], 'skipped, b failed')
+		self.assertTrue(outcomes['d']['ok'])
+		self.assertEqual(sorted(finished), ['a', 'b', 'c', 'd'])
+
+if __name__ == '__main__':
+	unittest.main()
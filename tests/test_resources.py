@@ -0,0 +1,97 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from cStringIO import StringIO
+
+from fabric.operations import _AttributeString
+
+from architect import batch, provision, resources
+from architect.resources import Copy, Directory, Symlink
+
+def _local(command, **kwargs):
+	"""stands in for sudo(), running the command here"""
+
+	process = subprocess.Popen(['/bin/sh', '-c', command], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+	result = _AttributeString(process.communicate()[0].rstrip('\n'))
+	result.return_code = process.returncode
+	result.succeeded = process.returncode == 0
+	result.failed = not result.succeeded
+
+	return result
+
+class ConvergeTest(unittest.TestCase):
+	"""resources converged twice change the host once"""
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.stdout, sys.stdout = sys.stdout, StringIO()
+		self.patched = [(batch, 'sudo', batch.sudo), (provision, 'sudo', provision.sudo), (resources, '_invalidate', resources._invalidate)]
+
+		batch.sudo = provision.sudo = _local
+		resources._invalidate = lambda host=None: None
+
+		with open(self.path('source.conf'), 'w') as f:
+			f.write('listen 80;\n')
+
+	def tearDown(self):
+		for module, name, value in self.patched:
+			setattr(module, name, value)
+
+		sys.stdout = self.stdout
+		shutil.rmtree(self.dir)
+
+	def path(self, *parts):
+		return os.path.join(self.dir, *parts)
+
+	def resources(self):
+		return [
+			Directory(self.path('app', 'etc')),
+			Copy(self.path('app', 'etc', 'site.conf'), self.path('source.conf')),
+			Symlink(self.path('current'), self.path('app')),
+		]
+
+	def test_converge(self):
+		self.assertEqual(len(resources.converge(self.resources())), 3)
+		self.assertEqual(os.readlink(self.path('current')), self.path('app'))
+
+		self.assertEqual(resources.converge(self.resources()), [])
+
+	def test_only_what_drifted_is_fixed(self):
+		resources.converge(self.resources())
+
+		with open(self.path('app', 'etc', 'site.conf'), 'w') as f:
+			f.write('listen 8080;\n')
+
+		self.assertEqual([str(r) for r in resources.converge(self.resources())], [str(self.resources()[1])])
+
+		with open(self.path('app', 'etc', 'site.conf')) as f:
+			self.assertEqual(f.read(), 'listen 80;\n')
+
+	def test_provision_stage(self):
+		outcome = provision._run_resources(self.resources())
+
+		self.assertTrue(outcome['ok'])
+		self.assertEqual(outcome['changed'], 3)
+
+		outcome = provision._run_resources(self.resources())
+
+		self.assertTrue(outcome['ok'])
+		self.assertEqual(outcome['changed'], 0)
+
+	def test_provision_stage_stops_at_a_failure(self):
+		missing = Copy(self.path('site.conf'), self.path('missing.conf'))
+		outcome = provision._run_resources([missing, Directory(self.path('after'))])
+
+		self.assertFalse(outcome['ok'])
+		self.assertFalse(os.path.exists(self.path('after')))
+
+	def test_resources_need_a_check_and_fix(self):
+		self.assertRaises(TypeError, resources.Resource)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,111 @@
+import sys
+import unittest
+
+from cStringIO import StringIO
+
+from architect import rollout
+
+HOSTS = ['web%s' % i for i in range(1, 11)]
+
+def _executor(failing=(), calls=None):
+	"""stands in for running on each host of a batch, the failing hosts fail"""
+
+	def executor(batch_hosts):
+		if calls is not None:
+			calls.append(list(batch_hosts))
+
+		return dict([
+			(host, {'ok': host not in failing, 'seconds': 0.1, 'error': 'failed' if host in failing else None})
+			for host in batch_hosts
+		])
+
+	return executor
+
+class HostCountTest(unittest.TestCase):
+	def test_count(self):
+		self.assertEqual(rollout._host_count('3', 10), 3)
+		self.assertEqual(rollout._host_count(3, 10), 3)
+
+	def test_percentage_rounds_up(self):
+		self.assertEqual(rollout._host_count('25%', 10), 3)
+		self.assertEqual(rollout._host_count('10%', 10), 1)
+		self.assertEqual(rollout._host_count('1%', 10), 1)
+		self.assertEqual(rollout._host_count('0%', 10), 0)
+
+class BatchesTest(unittest.TestCase):
+	def test_sizes(self):
+		self.assertEqual([len(batch) for batch in rollout._batches(HOSTS, '25%')], [3, 3, 3, 1])
+		self.assertEqual([len(batch) for batch in rollout._batches(HOSTS, 4)], [4, 4, 2])
+
+	def test_keeps_host_order(self):
+		self.assertEqual(sum(rollout._batches(HOSTS, 3), []), HOSTS)
+
+	def test_at_least_one_at_most_all(self):
+		self.assertEqual(len(rollout._batches(HOSTS, 0)), 10)
+		self.assertEqual(rollout._batches(HOSTS, 50), [HOSTS])
+
+class RolloutTest(unittest.TestCase):
+	def setUp(self):
+		self.stdout, sys.stdout = sys.stdout, StringIO()
+
+	def tearDown(self):
+		sys.stdout = self.stdout
+
+	def test_all_ok(self):
+		calls = []
+		results = rollout._rollout(HOSTS, _executor(calls=calls), batch=4)
+
+		self.assertEqual(calls, [HOSTS[:4], HOSTS[4:8], HOSTS[8:]])
+		self.assertTrue(all([outcome['ok'] for outcome in results.values()]))
+
+	def test_stops_after_the_batch_that_used_the_budget(self):
+		calls = []
+		results = rollout._rollout(HOSTS, _executor(failing=['web2'], calls=calls), batch=4)
+
+		# The batch with the failure finishes, no more are started
+		self.assertEqual(calls, [HOSTS[:4]])
+		self.assertEqual(results['web2']['ok'], False)
+		self.assertEqual(results['web1']['ok'], True)
+		self.assertEqual([host for host in HOSTS if results[host]['ok'] is None], HOSTS[4:])
+		self.assertEqual(results['web5']['error'], 'skipped')
+
+	def test_failures_within_the_budget_carry_on(self):
+		calls = []
+		results = rollout._rollout(HOSTS, _executor(failing=['web2', 'web6'], calls=calls), batch=4, failures=2)
+
+		self.assertEqual(len(calls), 3)
+		self.assertEqual(len([outcome for outcome in results.values() if not outcome['ok']]), 2)
+
+	def test_budget_as_a_percentage(self):
+		failing = ['web1', 'web2', 'web5']
+
+		# 20% of 10 hosts is 2, the third failure stops it
+		results = rollout._rollout(HOSTS, _executor(failing=failing), batch=4, failures='20%')
+
+		self.assertEqual([host for host in HOSTS if results[host]['ok'] is None], HOSTS[8:])
+
+	def test_executor_errors_count_as_failures(self):
+		def executor(batch_hosts):
+			return dict([(host, Exception('unreachable')) for host in batch_hosts])
+
+		results = rollout._rollout(HOSTS[:2], executor, batch=2, failures=1)
+
+		self.assertEqual(results['web1'], {'ok': False, 'seconds': 0.0, 'error': 'unreachable'})
+
+class TimedTest(unittest.TestCase):
+	def test_outcomes(self):
+		self.assertTrue(rollout._timed(lambda: None)['ok'])
+		self.assertFalse(rollout._timed(lambda: False)['ok'])
+
+	def test_errors_are_caught(self):
+		def aborts():
+			sys.exit(1)
+
+		def raises():
+			raise ValueError('bad')
+
+		self.assertEqual(rollout._timed(aborts)['error'], 'aborted')
+		self.assertEqual(rollout._timed(raises)['error'], 'bad')
+
+if __name__ == '__main__':
+	unittest.main()